@@ -0,0 +1,285 @@
+"""
+Measures the throughput, latency and memory of `Brain` over a grid of node counts, encoding dimensions, numbers of
+cortices and nearest node index backends.
+
+Every combination runs in a fresh process (its own database, config and peak RSS) and reports:
+    - steps_per_sec: training steps (one encoding per cortex) per second, maintenance included.
+    - p99_step_ms: the 99th percentile latency of a step, maintenance excluded.
+    - maintenance_total_s / maintenance_max_pause_ms: the time spent in cleanup, index builds and neural growth.
+    - peak_rss_mb: the peak resident memory of the process.
+    - eval_encodings_per_sec: the throughput of classifying encodings with the frozen brain.
+
+The results are saved as JSON, together with the git commit and the grid, so that runs can be compared over time:
+    $ python -m cdzproject.benchmarks.brain_benchmark --preset quick --output before.json
+    $ python -m cdzproject.benchmarks.brain_benchmark --preset quick --output after.json --compare before.json
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import resource
+import subprocess
+import time
+from datetime import datetime
+
+import numpy as np
+
+from cdzproject import config, db
+from cdzproject.brain import Brain
+from cdzproject.modules.cortex.autoencoder import Autoencoder
+from cdzproject.benchmarks.workloads import SyntheticWorkload, DatasetWorkload
+
+# The nearest node index backends: whether the nearest node optimizer is enabled. 'partitions' uses about
+# sqrt(nodes) partitions (see config.NRND_PARTITIONS) instead of the Annoy index.
+INDEX_BACKENDS = {
+    'exact': False,
+    'annoy': True,
+    'partitions': True,
+}
+
+# The grids of the presets: workloads, node counts, encoding dims (synthetic only), numbers of cortices (synthetic
+# only) and index backends
+PRESETS = {
+    'quick': {
+        'workloads': ['synthetic'],
+        'nodes': [250, 1000],
+        'dims': [8, 64],
+        'cortices': [2, 4],
+        'backends': ['exact', 'annoy'],
+    },
+    'full': {
+        'workloads': ['synthetic', 'mnist_fsdd'],
+        'nodes': [250, 1000, 5000, 10000, 50000, 100000],
+        'dims': [1, 8, 64, 256],
+        'cortices': [2, 4, 6],
+        'backends': ['exact', 'annoy', 'partitions'],
+    },
+}
+
+# The number of timed training steps of every combination
+NUM_STEPS = 500
+
+# The number of encodings classified per cortex to measure the evaluation throughput
+NUM_EVAL_ENCODINGS = 10000
+
+
+def _git_commit():
+    """Returns the current git commit of the repository, None if it is not available."""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _peak_rss_mb():
+    """Returns the peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _seed_nodes(brain, workload, num_nodes):
+    """
+    Creates the initial nodes from the workload without training on it, so that large node counts do not take
+    `num_nodes` brute-force searches to set up.
+    """
+    blocks = {cortex_name: [] for cortex_name in brain.cortices}
+    for _ in range(num_nodes):
+        encodings, label = workload.sample()
+        for cortex_name, encoding in zip(brain.cortices, encodings):
+            blocks[cortex_name].append(encoding)
+
+    brain.seed_nodes(blocks, qty=num_nodes, method='reservoir')
+
+
+def run_case(case):
+    """
+    Runs one combination of the grid. Changes the global config and database, run it in its own process.
+
+    :param case: A dictionary with the workload, nodes, dims, cortices, backend, steps and seed.
+    :return: The case, updated with the measurements.
+    """
+    np.random.seed(case['seed'])
+    if case['workload'] == 'synthetic':
+        workload = SyntheticWorkload(case['cortices'], case['dims'], seed=case['seed'])
+    else:
+        workload = DatasetWorkload(case['workload'], seed=case['seed'])
+        case['dims'] = workload.dims
+        case['cortices'] = workload.num_cortices
+
+    # Exactly `nodes` nodes, no neural growth beyond them, and maintenance twice during the timed steps
+    config.INITIAL_NODES = case['nodes']
+    config.MAX_NODES = case['nodes']
+    config.NRND_OPTIMIZER_ENABLED = INDEX_BACKENDS[case['backend']]
+    config.NRND_PARTITIONS = int(math.sqrt(case['nodes'])) if case['backend'] == 'partitions' else 0
+    config.BRN_CLEANUP_FREQUENCY = max(case['steps'] // 2, 1)
+    config.NRND_BUILD_FREQUENCY = max(case['steps'] // 4, 1)
+    config.BRN_NEURAL_GROWTH_FREQUENCY = max(case['steps'] // 2, 1)
+    config.LOG_TOPOLOGY_TO_STDOUT = False
+
+    db.reset()
+    brain = Brain()
+    cortices = [brain.add_cortex('cortex_%d' % idx, Autoencoder()) for idx in range(case['cortices'])]
+
+    start = time.perf_counter()
+    _seed_nodes(brain, workload, case['nodes'])
+    case['seed_s'] = time.perf_counter() - start
+
+    step_seconds = []
+    maintenance_seconds = []
+    start = time.perf_counter()
+    for _ in range(case['steps']):
+        encodings, label = workload.sample()
+
+        step_start = time.perf_counter()
+        brain.increment_timestep()
+        for cortex, encoding in zip(cortices, encodings):
+            brain.receive_sensory_input(cortex, encoding)
+        maintenance_start = time.perf_counter()
+        brain.cleanup()
+        brain.build_nrnd_indexes()
+        brain.create_new_nodes()
+        maintenance_end = time.perf_counter()
+
+        step_seconds.append(maintenance_start - step_start)
+        maintenance_seconds.append(maintenance_end - maintenance_start)
+    elapsed = time.perf_counter() - start
+
+    frozen_brain = brain.freeze()
+    eval_seconds = 0
+    num_eval_encodings = 0
+    for idx, name in enumerate(frozen_brain.cortex_names):
+        encodings, labels = workload.eval_encodings(idx, NUM_EVAL_ENCODINGS)
+        eval_start = time.perf_counter()
+        frozen_brain.predict(name, encodings)
+        eval_seconds += time.perf_counter() - eval_start
+        num_eval_encodings += len(encodings)
+
+    case.update({
+        'steps_per_sec': case['steps'] / elapsed,
+        'p50_step_ms': float(np.percentile(step_seconds, 50)) * 1000,
+        'p99_step_ms': float(np.percentile(step_seconds, 99)) * 1000,
+        'maintenance_total_s': float(np.sum(maintenance_seconds)),
+        'maintenance_max_pause_ms': float(np.max(maintenance_seconds)) * 1000,
+        'final_nodes': sum(len(cortex.node_manager.nodes) for cortex in cortices),
+        'peak_rss_mb': _peak_rss_mb(),
+        'eval_encodings_per_sec': num_eval_encodings / eval_seconds if eval_seconds else 0.0,
+    })
+    return case
+
+
+def make_cases(grid, steps=NUM_STEPS, seed=0):
+    """
+    Expands a grid into the list of combinations to run. Dataset workloads have fixed dims and cortices, so they are
+    only combined with the node counts and backends.
+
+    :param grid: A dictionary like the ones in `PRESETS`.
+    :param steps: The number of timed steps of every combination.
+    :param seed: The random seed.
+    :return: A list of cases (see `run_case`).
+    """
+    cases = []
+    for workload in grid['workloads']:
+        if workload == 'synthetic':
+            combinations = itertools.product(grid['nodes'], grid['dims'], grid['cortices'], grid['backends'])
+        else:
+            combinations = itertools.product(grid['nodes'], [None], [2], grid['backends'])
+
+        for nodes, dims, cortices, backend in combinations:
+            cases.append({
+                'workload': workload, 'nodes': nodes, 'dims': dims, 'cortices': cortices, 'backend': backend,
+                'steps': steps, 'seed': seed,
+            })
+    return cases
+
+
+def run(grid, output, steps=NUM_STEPS, seed=0):
+    """
+    Runs every combination of a grid, each in a fresh process, and saves the results as JSON.
+
+    :param grid: A dictionary like the ones in `PRESETS`.
+    :param output: The path of the JSON file.
+    :param steps: The number of timed steps of every combination.
+    :param seed: The random seed.
+    :return: The saved results.
+    """
+    results = {
+        'started_at': datetime.now().isoformat(),
+        'git_commit': _git_commit(),
+        'grid': grid,
+        'cases': [],
+    }
+
+    for case in make_cases(grid, steps=steps, seed=seed):
+        with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+            try:
+                case = pool.apply(run_case, (case,))
+            except (OSError, AttributeError) as e:
+                # e.g. the data files of a dataset workload are missing
+                case['error'] = repr(e)
+        results['cases'].append(case)
+        print(_format_case(case))
+
+        # Save after every case, so that an interrupted sweep keeps its results
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    return results
+
+
+def _case_key(case):
+    """Returns the parameters that identify a case."""
+    return case['workload'], case['nodes'], case['dims'], case['cortices'], case['backend']
+
+
+def _format_case(case):
+    """Returns a one-line summary of a case."""
+    name = '{workload} nodes={nodes} dims={dims} cortices={cortices} backend={backend}'.format(**case)
+    if 'error' in case:
+        return name + ' -- ' + case['error']
+    return (name + ' -- {steps_per_sec:.1f} steps/s, p99 {p99_step_ms:.2f}ms, maintenance {maintenance_total_s:.2f}s '
+            '(max pause {maintenance_max_pause_ms:.0f}ms), {peak_rss_mb:.0f}MB, '
+            'eval {eval_encodings_per_sec:.0f} enc/s').format(**case)
+
+
+def compare(previous, current):
+    """
+    Prints the change of the main metrics between two runs, for the cases they have in common.
+
+    :param previous: The results of the earlier run (as saved by `run`).
+    :param current: The results of the later run.
+    """
+    previous_cases = {_case_key(case): case for case in previous['cases'] if 'error' not in case}
+    print('Comparing with', previous.get('git_commit'), 'from', previous.get('started_at'))
+    for case in current['cases']:
+        old = previous_cases.get(_case_key(case))
+        if old is None or 'error' in case:
+            continue
+        changes = [
+            '{0} x{1:.2f}'.format(metric, case[metric] / old[metric]) if old[metric] else metric + ' n/a'
+            for metric in ('steps_per_sec', 'p99_step_ms', 'peak_rss_mb', 'eval_encodings_per_sec')
+        ]
+        print('{workload} nodes={nodes} dims={dims} cortices={cortices} backend={backend}'.format(**case), '--',
+              ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the throughput, latency and memory of the brain.')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--steps', type=int, default=NUM_STEPS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', help='The results of an earlier run to compare with.')
+    args = parser.parse_args()
+
+    results = run(PRESETS[args.preset], args.output, steps=args.steps, seed=args.seed)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
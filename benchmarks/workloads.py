@@ -0,0 +1,93 @@
+"""
+Reproducible workloads for the benchmarks. Every workload yields one encoding per cortex and a label per step.
+"""
+
+import numpy as np
+
+from cdzproject.utils import dataset_registry
+
+
+class SyntheticWorkload(object):
+    """
+    Gaussian classes in every cortex. The encodings of a step belong to the same class in all the cortices.
+    """
+
+    def __init__(self, num_cortices, dims, num_classes=10, spread=0.1, seed=0):
+        """
+        Initializes a SyntheticWorkload instance.
+
+        :param num_cortices: The number of cortices (modalities).
+        :param dims: The number of dimensions of the encodings.
+        :param num_classes: The number of classes.
+        :param spread: The standard deviation of the encodings around their class center.
+        :param seed: The random seed.
+        """
+        self.num_cortices = num_cortices
+        self.dims = dims
+        self.num_classes = num_classes
+        self.spread = spread
+        self.rng = np.random.RandomState(seed)
+        self.centers = self.rng.uniform(0, 1, size=(num_cortices, num_classes, dims))
+
+    def sample(self):
+        """
+        Draws the encodings of one step.
+
+        :return: A tuple (list of encodings, one per cortex, label).
+        """
+        label = self.rng.randint(self.num_classes)
+        noise = self.rng.normal(0, self.spread, size=(self.num_cortices, self.dims))
+        return list(self.centers[:, label] + noise), label
+
+    def eval_encodings(self, cortex_idx, num_encodings):
+        """
+        Draws labelled encodings of one cortex for measuring the evaluation throughput.
+
+        :param cortex_idx: The index of the cortex.
+        :param num_encodings: The number of encodings.
+        :return: A tuple of arrays (encodings, labels).
+        """
+        labels = self.rng.randint(self.num_classes, size=num_encodings)
+        noise = self.rng.normal(0, self.spread, size=(num_encodings, self.dims))
+        return self.centers[cortex_idx][labels] + noise, labels
+
+
+class DatasetWorkload(object):
+    """
+    The visual/audio encodings of one of the bundled datasets (see `dataset_registry.DATASETS`).
+    """
+
+    num_cortices = 2
+
+    def __init__(self, dataset_name, seed=0):
+        """
+        Initializes a DatasetWorkload instance.
+
+        :param dataset_name: The name of the dataset.
+        :param seed: The random seed.
+        """
+        self.dataset = dataset_registry.get_dataset(dataset_name)
+        self.dims = self.dataset.v_train_data.shape[1]
+        self.seed = seed
+        self.samples = iter(self.dataset.sample_stream(seed=seed))
+
+    def sample(self):
+        """
+        Draws the encodings of one step.
+
+        :return: A tuple (list of encodings, one per cortex, label).
+        """
+        visual_input, audio_input, label = next(self.samples)
+        return [visual_input, audio_input], label
+
+    def eval_encodings(self, cortex_idx, num_encodings):
+        """
+        Returns labelled test encodings of one cortex for measuring the evaluation throughput.
+
+        :param cortex_idx: 0 for the visual cortex, 1 for the audio cortex.
+        :param num_encodings: The maximum number of encodings.
+        :return: A tuple of arrays (encodings, labels).
+        """
+        if cortex_idx == 0:
+            return self.dataset.v_test_data[:num_encodings], self.dataset.v_test_labels[:num_encodings]
+        return self.dataset.a_test_data[:num_encodings], self.dataset.a_test_labels[:num_encodings]
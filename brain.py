@@ -3,6 +3,8 @@ from collections import deque
 from cdzproject import config, db
 from cdzproject.modules.cortex.cortex import Cortex
 from cdzproject.modules.cdz.cdz import CDZ
+from cdzproject.inference.frozen_brain import FrozenBrain
+from cdzproject.utils import instrumentation, event_log, memory
 
 
 class Brain:
@@ -14,6 +16,15 @@ class Brain:
         self.cdz = CDZ(self)
         self.output_stream = deque(maxlen=10)
 
+        # See `enforce_memory_budget`
+        self.memory_budget = config.BRN_MEMORY_BUDGET
+        self.memory_evictions = dict.fromkeys(memory.EVICTION_COUNTERS, 0)
+
+        if config.INSTR_ENABLED:
+            instrumentation.enable()
+        if config.EVENT_LOG_FILE and event_log.current_log() is None:
+            event_log.open_log(config.EVENT_LOG_FILE)
+
     def add_cortex(self, cortex_name, autoencoder):
         """Initializes and adds a cortex by the given name to the brain instance.
 
@@ -28,6 +39,21 @@ class Brain:
         self.cortices[cortex_name] = new_cortex
         return new_cortex
 
+    def seed_nodes(self, encodings, **kwargs):
+        """Creates the initial nodes of the cortices at once from blocks of encodings, instead of one node per
+        received encoding. See `NodeManager.seed_nodes` for the options (qty, method, seed).
+
+        Args:
+            encodings (dict): a block of encodings (2D array or finite iterable) per cortex name
+
+        Returns:
+            dict: the new nodes per cortex name
+        """
+        return {
+            cortex_name: self.cortices[cortex_name].seed_nodes(block, **kwargs)
+            for cortex_name, block in encodings.items()
+        }
+
     def get_cortex(self, cortex_name):
         """Gets a cortex by name
 
@@ -46,6 +72,15 @@ class Brain:
             amount (int, optional): The amount to increment the timestep by. Defaults to 1.
         """
         self.timestep += amount
+        if config.CE_DEFER_FEEDBACK and self.timestep % config.CE_FEEDBACK_BATCH_STEPS == 0:
+            self.apply_feedback()
+
+    def apply_feedback(self):
+        """Applies the CDZ feedback buffered with config.CE_DEFER_FEEDBACK to the nodes. This runs every
+        config.CE_FEEDBACK_BATCH_STEPS timesteps and before maintenance, exports and freezes; call it to apply the
+        feedback of a partial batch.
+        """
+        self.cdz.apply_feedback()
 
     def receive_sensory_input(self, cortex, data, learn=True):
         """Takes sensory data and sends it to the cortex specified
@@ -57,6 +92,28 @@ class Brain:
         """
         cortex.receive_sensory_input(data, learn=learn)
 
+    def freeze(self):
+        """Compiles the brain into a read-only predictor. The brain itself is not modified.
+
+        Returns:
+            FrozenBrain: flat arrays for "encoding -> cluster -> cross-modal cluster" lookups. See `FrozenBrain.save`.
+        """
+        self.apply_feedback()
+        return FrozenBrain.from_brain(self)
+
+    def memory_report(self, trace=False):
+        """Estimates the memory used by the brain, per subsystem (nodes, clusters, relations, CDZ, indexes...)
+        and per cortex. See `utils.memory`.
+
+        Args:
+            trace (bool, False): also report the memory traced by tracemalloc, if it was started before the brain was
+                                 built (e.g. `python -X tracemalloc`)
+
+        Returns:
+            dict: {'total': bytes, 'subsystems': {subsystem: bytes}, 'cortices': {cortex name: {subsystem: bytes}}}
+        """
+        return memory.memory_report(self, trace=trace)
+
     def cleanup(self, force=False, delete_new_items=False):
         """Performs maintenance. Deletes unused nodes/clusters.
         Only runs if the timestep is a multiple of config.BRN_CLEANUP_FREQUENCY, or force=True
@@ -67,21 +124,81 @@ class Brain:
                                             for performing measurements at the end of learning.
         """
         if force or delete_new_items or self.timestep % config.BRN_CLEANUP_FREQUENCY == 0:
-            print("====== Start cleanup =====")
+            if config.LOG_TOPOLOGY_TO_STDOUT:
+                print("====== Start cleanup =====")
+            self.apply_feedback()
             for cortex in self.cortices.values():
                 cortex.cleanup(delete_new_items=delete_new_items)
 
             db.cleanup()
+            if config.NODE_DEDUP_ENABLED:
+                self.deduplicate_nodes()
+            if config.CE_COMPACTION_ENABLED:
+                self.compact_clusters()
+            self.enforce_memory_budget()
             self.build_nrnd_indexes(force=True)
-            print("====== End cleanup ======")
+            if config.LOG_TOPOLOGY_TO_STDOUT:
+                print("====== End cleanup ======")
+
+    def deduplicate_nodes(self):
+        """Merges the nodes of every cortex that collapsed onto nearly the same position and share their strongest
+        cluster. Runs at every cleanup if config.NODE_DEDUP_ENABLED. See `NodeManager.deduplicate_nodes`.
+
+        Returns:
+            dict: {cortex name: the number of nodes reclaimed}
+        """
+        return {name: cortex.node_manager.deduplicate_nodes() for name, cortex in self.cortices.items()}
+
+    def compact_clusters(self):
+        """Merges the clusters of every cortex whose CDZ connections are near-identical into the oldest of them, with
+        their nodes and correlations. Node splitting leaves many clusters that map to the same cluster of the other
+        modality; merging them shrinks the CDZ and the relationship tables. Runs at every cleanup if
+        config.CE_COMPACTION_ENABLED. See `CDZ.find_duplicate_clusters`.
+
+        Returns:
+            int: the number of clusters merged
+        """
+        qty_merged = 0
+        for cortex in self.cortices.values():
+            clusters = [cluster for cluster in cortex.cluster_store.clusters if cluster is not None]
+            for cluster, into in self.cdz.find_duplicate_clusters(clusters):
+                db.merge_clusters(cluster, into)
+                qty_merged += 1
+        return qty_merged
+
+    def enforce_memory_budget(self):
+        """Evicts the least recently used nodes, the weakest CDZ connections and stale relation positions until the
+        memory estimated by `memory_report` is within `self.memory_budget` (bytes, None for no budget). Runs at every
+        cleanup. What was evicted is counted in `self.memory_evictions`.
+
+        Returns:
+            int: the estimated memory in bytes after the eviction, None if there is no budget
+        """
+        if self.memory_budget is None:
+            return None
+
+        total = memory.enforce_budget(self, self.memory_budget, self.memory_evictions)
+        if config.LOG_TOPOLOGY_TO_STDOUT:
+            print("Memory: {0} bytes (budget {1}), evicted so far: {2}".format(
+                total, self.memory_budget, self.memory_evictions
+            ))
+        return total
 
-    def create_new_nodes(self):
-        """Creates new nodes in each cortex as needed."""
-        if self.timestep % config.BRN_NEURAL_GROWTH_FREQUENCY == 0:
-            print("====== Start neural growth =====")
+    def create_new_nodes(self, force=False):
+        """Creates new nodes in each cortex as needed.
+        Only runs if the timestep is a multiple of config.BRN_NEURAL_GROWTH_FREQUENCY, or force=True
+
+        Args:
+            force (bool, False): Default to false
+        """
+        if force or self.timestep % config.BRN_NEURAL_GROWTH_FREQUENCY == 0:
+            if config.LOG_TOPOLOGY_TO_STDOUT:
+                print("====== Start neural growth =====")
+            self.apply_feedback()
             for cortex in self.cortices.values():
                 cortex.create_new_nodes()
-            print("====== End neural growth =======")
+            if config.LOG_TOPOLOGY_TO_STDOUT:
+                print("====== End neural growth =======")
 
     def build_nrnd_indexes(self, force=False):
         """Builds the nearest node index. This is used to increase the performance of the algorithm.
@@ -8,6 +8,8 @@ because you did not adjust the dependent parameters as well.
 # The `division` import from `__future__` is no longer needed in Python 3, as true division is the default behavior.
 # It has been removed for Python 3 compatibility.
 
+import os
+
 EPOCHS = 20
 
 # The size of the subset to use for training. I often keep this small to save time and test new ideas.
@@ -21,6 +23,14 @@ BRN_NEURAL_GROWTH_FREQUENCY = TRAINING_SET_SIZE * 0.3
 # We don't want to create growth too often because it causes lots of noise
 assert BRN_CLEANUP_FREQUENCY <= BRN_NEURAL_GROWTH_FREQUENCY
 
+# The memory budget of a brain in bytes (as estimated by `Brain.memory_report()`), or None for no budget. It is enforced
+# at every cleanup by evicting state in this order: the least recently used nodes, the weakest CDZ connections and the
+# mean positions stored for the relations of the least recently used nodes.
+BRN_MEMORY_BUDGET = None
+BRN_MEMORY_EVICTION_ORDER = ('nodes', 'connections', 'positions')
+# The maximum fraction of the nodes (connections, positions) of a cortex evicted per round of eviction
+BRN_MEMORY_EVICTION_FRACTION = 0.1
+
 # ======================================================================================
 # ===================================== Cluster ========================================
 # ======================================================================================
@@ -65,15 +75,33 @@ NRND_SEARCH_K = NRND_N_TREES * 5
 NRND_MAX_AVG_DISTANCE_MOMENTUM = 1e50
 AVG_DISTANCE_MOMENTUM_DECAY = 0.5
 
+# Coarse-to-fine nearest node index for cortices with many nodes (see `NodePartitions`). With more than 0 partitions it
+# replaces the Annoy index: a codebook of NRND_PARTITIONS centroids, learned online, partitions the encoding space and
+# every query only searches the nodes of the NRND_PARTITION_PROBES partitions with the nearest centroids. About
+# sqrt(MAX_NODES) partitions keep both steps small.
+NRND_PARTITIONS = 0
+NRND_PARTITION_PROBES = 2
+NRND_PARTITION_LEARNING_RATE = 0.01
+
 # Maximum number of nodes allowed in each node manager (one NM per cortex)
 MAX_NODES = 6000
 INITIAL_NODES = 250
 assert INITIAL_NODES <= MAX_NODES
 
+# How `NodeManager.seed_nodes` chooses the initial nodes from a block of encodings: 'kmeans++' or 'reservoir'
+NODE_SEED_METHOD = 'kmeans++'
+
 # The maximum amount of correlation variance a node is allowed to have for it not to be broken up
 NODE_SPLIT_MAX_CORRELATION_VARIANCE = 5e-3
 NODE_SPLIT_MAX_QTY = max(TRAINING_SET_SIZE / 1000, 5)
 
+# Merges the nodes of a cortex that collapsed onto nearly the same position and share their strongest cluster at every
+# cleanup (see `NodeManager.deduplicate_nodes`)
+NODE_DEDUP_ENABLED = False
+# The maximum distance between two nodes to be merged, as a fraction of the spread of the nodes (the root mean square
+# distance of the nodes to their mean)
+NODE_DEDUP_MAX_DISTANCE_FACTOR = 0.005
+
 # ======================================================================================
 # ============================== Correlation Engine (CDZ) ==============================
 # ======================================================================================
@@ -84,4 +112,146 @@ CE_IGNORE_GAUSSIAN = True
 CE_CORRELATION_WINDOW_STD = 0.65
 CE_CORRELATION_WINDOW_MAX = 10
 
-CE_CERTAINTY_AGE_FACTOR = NODE_CERTAINTY_AGE_FACTOR
\ No newline at end of file
+CE_CERTAINTY_AGE_FACTOR = NODE_CERTAINTY_AGE_FACTOR
+
+# Buffers the Hebbian feedback of the CDZ to the nodes and applies it in one grouped pass every CE_FEEDBACK_BATCH_STEPS
+# timesteps (and before maintenance), instead of after every packet. The result is the same, except that the
+# certainties read during a batch do not include the feedback of that batch yet.
+CE_DEFER_FEEDBACK = False
+CE_FEEDBACK_BATCH_STEPS = 1
+
+# Merges the clusters of a cortex whose CDZ connections are near-identical at every cleanup (see
+# `Brain.compact_clusters`), so that the duplicate clusters left by node splitting do not accumulate.
+CE_COMPACTION_ENABLED = False
+# The minimum cosine similarity between the connections of two clusters for them to be merged
+CE_COMPACTION_MIN_SIMILARITY = 0.99
+# The minimum age (number of correlation updates) of a cluster to be merged, new clusters have too few connections
+CE_COMPACTION_MIN_AGE = 10
+
+# ======================================================================================
+# ===================================== Datasets =======================================
+# ======================================================================================
+# The directory containing the `.npy` encodings. Paths are resolved relative to the package, not the working directory.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# The number of paired examples a dataset's sample stream draws at once.
+DATA_STREAM_BATCH_SIZE = 4096
+
+# The maximum number of ready batches a sample stream keeps in its buffer.
+DATA_STREAM_PREFETCH = 4
+
+# The directory (in DATA_DIR) of the generated synthetic dataset, see `utils/encodings_synthetic.py`.
+SYNTH_DIR = 'synthetic'
+
+# The number of examples per file of the synthetic dataset.
+SYNTH_CHUNK_SIZE = 1000000
+
+# ======================================================================================
+# ===================================== Ingestion ======================================
+# ======================================================================================
+# The width of an event-time window, in the sensors' time unit. Samples of different modalities that fall in the same
+# window are sent to the brain at the same timestep, i.e. they are correlated by the CDZ.
+INGEST_WINDOW = 0.1
+
+# How long (in event time) a window waits for late samples. Samples that arrive later are dropped.
+INGEST_LATENESS = 0.5
+
+# The maximum number of queued samples per modality. Pushing a sample waits while the queue is full.
+INGEST_BUFFER_SIZE = 1024
+
+# How long (in seconds, wall-clock time) a modality's queue stays empty before the modality stops holding back the
+# windows of the others. Its samples that arrive after their window was sent are then dropped as late.
+INGEST_IDLE_TIMEOUT = 1.0
+
+# The maximum number of samples of a modality waiting for their windows to close. A modality that is ahead of the
+# others stops consuming its queue while it has this many, so its producer waits (backpressure).
+INGEST_MAX_PENDING = 4096
+
+# ======================================================================================
+# =============================== Data-Parallel Training ===============================
+# ======================================================================================
+# The number of worker processes. Each one trains a replica brain on its own shard of the stream.
+DP_NUM_WORKERS = 4
+
+# The number of samples each replica processes between merges.
+# Lower values keep the replicas closer to each other but spend more time merging. Replicas rebuild their nearest node
+# index after every merge, so merging more often than the index is rebuilt in a single-process run adds overhead.
+DP_MERGE_FREQUENCY = int(NRND_BUILD_FREQUENCY)
+
+# ======================================================================================
+# ===================================== Inference ======================================
+# ======================================================================================
+# The number of worker processes answering queries from a published frozen brain.
+INFERENCE_NUM_WORKERS = 4
+
+# The number of encodings sent to an inference worker at once.
+INFERENCE_BATCH_SIZE = 256
+
+# The number of published versions kept on disk. Older versions are deleted when a new one is published.
+INFERENCE_KEEP_VERSIONS = 2
+
+# The inference server coalesces concurrent requests into micro-batches of at most this many requests...
+INFERENCE_SERVER_MAX_BATCH_SIZE = 256
+# ...or closes a batch once its oldest request has waited this long (in seconds).
+INFERENCE_SERVER_MAX_WAIT = 0.002
+
+# The maximum number of requests waiting for a micro-batch. The server stops reading requests while the queue is full.
+INFERENCE_SERVER_MAX_PENDING = 4096
+
+# The maximum number of dimensions of a request to a cortex that has no nodes (and so no known dimensions).
+INFERENCE_SERVER_MAX_DIMS = 65536
+
+# The number of seconds between the inference server's latency/throughput reports.
+INFERENCE_SERVER_REPORT_INTERVAL = 60
+
+# ======================================================================================
+# ==================================== Evaluation ======================================
+# ======================================================================================
+# The number of worker processes scoring the train/test sets of both cortices. 1 scores them in the calling process.
+EVAL_NUM_WORKERS = 4
+
+# The file the background evaluation appends its metrics to, one JSON object per line.
+EVAL_METRICS_FILE = 'metrics.jsonl'
+
+# ======================================================================================
+# ================================== Instrumentation ===================================
+# ======================================================================================
+# Instruments the hot path with timers and counters when a Brain is created. See `utils/instrumentation.py`.
+# When disabled, the instrumented methods are left untouched, so there is no overhead at all.
+INSTR_ENABLED = False
+
+# Every call of an instrumented stage is counted, but only every n-th call of a hot stage is timed.
+# Maintenance stages (cleanup, neural growth, index builds) are rare and are always timed.
+INSTR_SAMPLE_EVERY = 100
+
+# Write the stage histograms to this file in the Prometheus text format (None disables it)...
+INSTR_PROMETHEUS_FILE = None
+# ...at most every this many seconds.
+INSTR_PROMETHEUS_INTERVAL = 15
+
+# Write a JSON summary of every stage to this file when the program exits (None disables it).
+INSTR_SUMMARY_FILE = None
+
+# ======================================================================================
+# ===================================== Event Log ======================================
+# ======================================================================================
+# Print topology changes (nodes added/deleted, clusters deleted, index rebuilds) and the maintenance banners.
+# Set to False to keep them off stdout; they can still be recorded with the event log.
+LOG_TOPOLOGY_TO_STDOUT = True
+
+# Record the topology changes to this binary file when a Brain is created (None disables it). See `utils/event_log.py`.
+EVENT_LOG_FILE = None
+
+# The number of events buffered in memory before they are handed to the background writer.
+EVENT_LOG_BUFFER_SIZE = 4096
+
+# ======================================================================================
+# ====================================== Kernels =======================================
+# ======================================================================================
+
+# The backend of the per-step kernels (nearest node search, node learning). See `modules/cortex/kernels.py`.
+# 'numba' compiles them with Numba, 'numpy' uses NumPy and 'auto' uses Numba if it is installed.
+KERNELS_BACKEND = 'auto'
+
+# Where Numba caches the compiled kernels between runs (None for the `__pycache__` next to the kernels).
+KERNELS_CACHE_DIR = None
@@ -1,5 +1,11 @@
+from collections import defaultdict
+
+import numpy as np
+
+from cdzproject import config
 from cdzproject.db.basic_table import BasicTable
 from cdzproject.db.one_to_many_table import OneToManyTable
+from cdzproject.utils import event_log
 
 
 class Database:
@@ -8,6 +14,12 @@ class Database:
         """This is a wrapper for a data structure that is used to
         maintain the relationships between clusters and nodes, and node/node_manager.
         """
+        self.reset()
+
+    def reset(self):
+        """
+        Removes all items and relationships from the database.
+        """
         self.nodes = BasicTable('nodes')
         self.clusters = BasicTable('clusters')
 
@@ -15,15 +27,21 @@ class Database:
         self.clusters_to_nodes = OneToManyTable('clusters_to_nodes')
         self.node_manager_to_nodes = OneToManyTable('node_manager_to_nodes')
 
-    def add_node(self, node, cluster, initial=False):
+    def add_node(self, node, cluster, initial=False, split_from=None):
         """
         Adds a node and its associated cluster to the database.
 
         :param node: The node to be added.
         :param cluster: The cluster associated with the node.
         :param initial: Whether this is an initial addition (default: False).
+        :param split_from: The node that was split to create this node, if any.
         """
-        print(f">> adding node: {node.name} (initial)" if initial else f">> adding node: {node.name}")
+        if config.LOG_TOPOLOGY_TO_STDOUT:
+            print(f">> adding node: {node.name} (initial)" if initial else f">> adding node: {node.name}")
+        if split_from is None:
+            event_log.emit(event_log.NODE_ADDED, node.cortex.timestep, node.cortex.name, node.name)
+        else:
+            event_log.emit(event_log.NODE_SPLIT, node.cortex.timestep, node.cortex.name, node.name, split_from.name)
         self.nodes.add(node)
         self.clusters.add(cluster)
 
@@ -34,6 +52,37 @@ class Database:
         # Add node to node_manager_to_nodes
         self.node_manager_to_nodes.add_related_item(node.cortex.node_manager, node)
 
+    def add_nodes(self, nodes, clusters, initial=False, split_from=None):
+        """
+        Adds nodes of a cortex and their associated clusters (one per node) to the database at once. This is
+        `add_node` for every node, except that the node manager's relationships are normalized once.
+
+        :param nodes: The nodes to be added, all from the same cortex.
+        :param clusters: The cluster associated with every node.
+        :param initial: Whether these are initial additions (default: False).
+        :param split_from: The node that was split to create every node, if any.
+        """
+        if not nodes:
+            return
+        if config.LOG_TOPOLOGY_TO_STDOUT:
+            print(f">> adding {len(nodes)} nodes (initial)" if initial else f">> adding {len(nodes)} nodes")
+
+        for node, cluster, split_node in zip(nodes, clusters, split_from or [None] * len(nodes)):
+            if split_node is None:
+                event_log.emit(event_log.NODE_ADDED, node.cortex.timestep, node.cortex.name, node.name)
+            else:
+                event_log.emit(
+                    event_log.NODE_SPLIT, node.cortex.timestep, node.cortex.name, node.name, split_node.name
+                )
+            self.nodes.add(node)
+            self.clusters.add(cluster)
+
+            # We are always making a new cluster and a new node
+            self.nodes_to_clusters.add(node, [cluster], [1])
+            self.clusters_to_nodes.add(cluster, [node], [1])
+
+        self.node_manager_to_nodes.add_related_items(nodes[0].cortex.node_manager, nodes)
+
     def add_cluster(self, cluster):
         """
         Adds a cluster to the database.
@@ -48,7 +97,9 @@ class Database:
 
         :param node: The node to be deleted.
         """
-        print(f">> removing node: {node.name}")
+        if config.LOG_TOPOLOGY_TO_STDOUT:
+            print(f">> removing node: {node.name}")
+        event_log.emit(event_log.NODE_DELETED, node.cortex.timestep, node.cortex.name, node.name)
         self.nodes.remove(node)
 
         clusters = self.get_nodes_clusters(node)
@@ -58,6 +109,32 @@ class Database:
         self.nodes_to_clusters.remove(node)
         self.node_manager_to_nodes.remove_related_item(node.cortex.node_manager, node)
 
+        # Free the node's row of the node store
+        node.store.release(node.row)
+
+    def merge_nodes(self, node, into):
+        """
+        Merges a node into another node of the same cortex and deletes it. Its cluster relationships move to `into`
+        (see `OneToManyTable.merge_item`) and its state is combined with the state of `into` (see `NodeStore.merge`).
+
+        :param node: The node to be merged and deleted.
+        :param into: The node that absorbs it.
+        """
+        assert node.cortex is into.cortex and node is not into
+        if config.LOG_TOPOLOGY_TO_STDOUT:
+            print(f">> merging node: {node.name} into {into.name}")
+        event_log.emit(event_log.NODE_MERGED, node.cortex.timestep, node.cortex.name, node.name, into.name)
+
+        for cluster in self.get_nodes_clusters(node):
+            self.clusters_to_nodes.merge_related_item(cluster, node, into)
+        self.nodes_to_clusters.merge_item(node, into)
+        self.nodes.remove(node)
+        self.node_manager_to_nodes.remove_related_item(node.cortex.node_manager, node)
+
+        # Free the node's row of the node store, keeping its state
+        node.store.merge(node.row, into.row)
+        node.store.release(node.row)
+
     def _delete_cluster(self, cluster, force=False):
         """
         Deletes a cluster from the database.
@@ -65,7 +142,9 @@ class Database:
         :param cluster: The cluster to be deleted.
         :param force: Whether to force deletion even if the cluster has related nodes (default: False).
         """
-        print(f">> removing cluster: {cluster.name}")
+        if config.LOG_TOPOLOGY_TO_STDOUT:
+            print(f">> removing cluster: {cluster.name}")
+        event_log.emit(event_log.CLUSTER_DELETED, cluster.cortex.timestep, cluster.cortex.name, cluster.name)
 
         if force:
             nodes = self.get_clusters_nodes(cluster)
@@ -86,6 +165,33 @@ class Database:
         ce = cluster.cdz
         ce.remove_cluster(cluster)
 
+        # Free the cluster's row of the cluster store
+        cluster.store.release(cluster.row)
+
+    def merge_clusters(self, cluster, into):
+        """
+        Merges a cluster into another cluster of the same cortex and deletes it. Its nodes and its CDZ correlation
+        move to `into`.
+
+        :param cluster: The cluster to be merged and deleted.
+        :param into: The cluster that absorbs it.
+        """
+        assert cluster.cortex is into.cortex and cluster is not into
+        if config.LOG_TOPOLOGY_TO_STDOUT:
+            print(f">> merging cluster: {cluster.name} into {into.name}")
+        event_log.emit(event_log.CLUSTER_MERGED, cluster.cortex.timestep, cluster.cortex.name, cluster.name, into.name)
+
+        for node in self.get_clusters_nodes(cluster):
+            self.nodes_to_clusters.merge_related_item(node, cluster, into)
+        self.clusters_to_nodes.merge_item(cluster, into)
+        self.clusters.remove(cluster)
+
+        cluster.cdz.merge_cluster(cluster, into)
+
+        # Free the cluster's row of the cluster store, keeping its timesteps
+        cluster.store.merge(cluster.row, into.row)
+        cluster.store.release(cluster.row)
+
     def get_clusters_nodes(self, cluster, include_strengths=False):
         """
         Retrieves the nodes associated with a cluster.
@@ -151,6 +257,66 @@ class Database:
             # Increase the relationship strength
             self.nodes_to_clusters.increase_relationship_strength(node, cluster, amount, last_encoding)
 
+    def adjust_node_to_cluster_strengths(self, nodes, clusters, amounts, last_encodings):
+        """
+        Applies many `adjust_node_to_cluster_strength` updates at once, with the same result. The updates are grouped
+        per relationship and summed with one scatter-add, and the strengths of every node are normalized once:
+        normalizing after every update scales the strengths by 1 / (1 + amount), so every amount is weighted by the
+        product of those factors of the updates that follow it, and the old strengths by the product of all of them.
+
+        :param nodes: The node of every update. All the nodes must belong to the same cortex.
+        :param clusters: The cluster of every update.
+        :param amounts: The quantity of every update.
+        :param last_encodings: The encoding of every update.
+        """
+        # The index of the node and of the relationship of every update, in order of first appearance
+        node_groups = {}
+        groups = {}
+        node_idxs = np.fromiter((node_groups.setdefault(node.name, len(node_groups)) for node in nodes),
+                                dtype=np.intp, count=len(nodes))
+        group_idxs = np.fromiter(
+            (groups.setdefault((node.name, cluster.name), len(groups)) for node, cluster in zip(nodes, clusters)),
+            dtype=np.intp, count=len(nodes)
+        )
+        amounts = np.asarray(amounts, dtype=float)
+        last_encodings = np.asarray(last_encodings)
+
+        # The log of the scaling of every update and of the ones that follow it for the same node
+        log_scales = -np.log1p(amounts)
+        order = np.argsort(node_idxs, kind='stable')
+        prefix = np.empty(len(amounts))
+        prefix[order] = np.cumsum(log_scales[order])
+        totals = np.bincount(node_idxs, weights=log_scales)
+        first_node_idxs = np.unique(node_idxs, return_index=True)[1]
+        starts = prefix[first_node_idxs] - log_scales[first_node_idxs]
+        suffix = totals[node_idxs] - (prefix - log_scales - starts[node_idxs])
+        weighted_amounts = amounts * np.exp(suffix)
+        decays = np.exp(totals)
+
+        qty_groups = len(groups)
+        first_idxs = np.unique(group_idxs, return_index=True)[1]
+        qty_updates = np.bincount(group_idxs, minlength=qty_groups)
+        group_amounts = np.bincount(group_idxs, weights=weighted_amounts, minlength=qty_groups)
+        position_sums = np.zeros((qty_groups,) + last_encodings.shape[1:], dtype=np.result_type(last_encodings, float))
+        np.add.at(position_sums, group_idxs, last_encodings)
+
+        updates = defaultdict(list)
+        for group_idx, first_idx in enumerate(first_idxs):
+            node, cluster = nodes[first_idx], clusters[first_idx]
+            # A new relationship is created by its first update, like `adjust_node_to_cluster_strength` does
+            if not self.nodes_to_clusters.is_related(node, cluster):
+                self.clusters_to_nodes.add_related_item(cluster, node, amounts[first_idx])
+
+            updates[node].append((
+                cluster, group_amounts[group_idx], qty_updates[group_idx], position_sums[group_idx],
+                last_encodings[first_idx]
+            ))
+
+        for node, node_updates in updates.items():
+            self.nodes_to_clusters.increase_relationship_strengths(
+                node, *zip(*node_updates), decay=decays[node_groups[node.name]]
+            )
+
     def adjust_cluster_to_node_strength(self, cluster, node, amount):
         """
         Adjusts the strength of the relationship between a cluster and a node.
@@ -166,12 +332,11 @@ class Database:
         Performs maintenance on the system.
         - Deletes clusters that are underutilized.
         """
-        # Deletes clusters that are underutilized
+        # Deletes clusters that are underutilized, checked per cortex on the cluster stores
         clusters_to_delete = []
-        for cluster_data in self.clusters_to_nodes.data.values():
-            cluster = cluster_data['obj']
-            if cluster.is_underutilized():
-                clusters_to_delete.append(cluster)
+        for node_manager_data in self.node_manager_to_nodes.data.values():
+            cortex = node_manager_data['obj'].cortex
+            clusters_to_delete.extend(cortex.cluster_store.get_underutilized(cortex.timestep))
 
         for cluster in clusters_to_delete:
             self._delete_cluster(cluster, force=True)
@@ -31,6 +31,26 @@ class OneToManyTable:
         else:
             raise Exception('Item already in table')
 
+    def load(self, item, related_items, strengths, positions, counts):
+        """
+        Stores the item with all of its relationships at once, replacing any existing entry.
+        The strengths are stored as given and are not normalized.
+
+        :param item: The main item to be stored.
+        :param related_items: A list of related items.
+        :param strengths: A list of relationship strengths.
+        :param positions: A list of positions, one per related item.
+        :param counts: A list of counts, one per related item.
+        """
+        assert len(related_items) == len(strengths) == len(positions) == len(counts)
+        self.data[item.name] = {
+            'obj': item,
+            'list': list(related_items),
+            'strengths': list(strengths),
+            'position': list(positions),
+            'count': list(counts)
+        }
+
     def get(self, item):
         """
         Retrieves the data associated with the given item.
@@ -70,6 +90,30 @@ class OneToManyTable:
 
         self._normalize_item(item)
 
+    def add_related_items(self, item, related_items, strength=1):
+        """
+        Adds several related items to the given item at once. The strengths are normalized once, at the end.
+
+        :param item: The main item.
+        :param related_items: A list of related items to add.
+        :param strength: The strength of every new relationship (default: 1).
+        """
+        if not self.data.get(item.name):
+            self.load(item, [], [], [], [])
+
+        data = self.data[item.name]
+        already_related = set(map(id, data['list']))
+        if any(id(related_item) in already_related for related_item in related_items):
+            raise Exception('The item is already related.')
+
+        data['list'].extend(related_items)
+        data['strengths'].extend([strength] * len(related_items))
+        data['position'].extend([None] * len(related_items))
+        data['count'].extend([1] * len(related_items))
+
+        if len(data['list']) > 0:
+            self._normalize_item(item)
+
     def remove_related_item(self, item, related_item):
         """
         Removes a related item from the given item.
@@ -163,6 +207,131 @@ class OneToManyTable:
 
         self._normalize_item(item)
 
+    def increase_relationship_strengths(self, item, related_items, amounts, qty_updates, position_sums,
+                                        first_positions, decay=1):
+        """
+        Increases the strengths of several relationships of the given item, each by the sum of several updates, and
+        normalizes once. Related items that are not related yet are added. The moving averages of the positions end
+        up where `increase_relationship_strength` would have left them after the same updates, one at a time.
+
+        :param item: The main item.
+        :param related_items: The related items.
+        :param amounts: The total quantity to increase the strength of every relationship by.
+        :param qty_updates: The number of updates of every relationship.
+        :param position_sums: The sum of the positions of the updates of every relationship.
+        :param first_positions: The position of the first update of every relationship.
+        :param decay: The factor the existing strengths are multiplied by before the amounts are added.
+        """
+        data = self.data[item.name]
+        data['strengths'][:] = [strength * decay for strength in data['strengths']]
+        for related_item, amount, qty, position_sum, first_position in zip(
+                related_items, amounts, qty_updates, position_sums, first_positions):
+            if related_item in data['list']:
+                idx = data['list'].index(related_item)
+            else:
+                # Its first update sets the position and the count to 1, like `add_related_item`
+                data['list'].append(related_item)
+                data['strengths'].append(0.0)
+                data['position'].append(None)
+                data['count'].append(0)
+                idx = len(data['list']) - 1
+
+            data['strengths'][idx] += amount
+            count = data['count'][idx]
+            data['count'][idx] = count + qty
+
+            # The first update sets a missing position, the others move the average
+            old_pos = data['position'][idx]
+            if old_pos is None:
+                old_pos = first_position
+                position_sum = position_sum - first_position
+                count += 1
+                qty -= 1
+            data['position'][idx] = old_pos + (position_sum - qty * old_pos) / (count + qty)
+
+        self._normalize_item(item)
+
+    def merge_related_item(self, item, related_item, into):
+        """
+        Replaces the relationship between the given item and related_item by a relationship with `into`. If the item
+        is already related to `into`, the strengths and counts are summed and the positions averaged, weighted by the
+        counts. The total strength does not change.
+
+        :param item: The main item.
+        :param related_item: The related item to replace.
+        :param into: The related item that replaces it.
+        """
+        data = self.data[item.name]
+        idx = data['list'].index(related_item)
+        if into not in data['list']:
+            data['list'][idx] = into
+            return
+
+        self._merge_relationship(data, idx, data, data['list'].index(into))
+        for values in (data['list'], data['strengths'], data['position'], data['count']):
+            values.pop(idx)
+
+    def merge_item(self, item, into):
+        """
+        Moves the relationships of the given item to `into` and removes the item. Relationships they have in common
+        are combined like in `merge_related_item`. The strengths are normalized.
+
+        :param item: The item to remove.
+        :param into: The item that receives its relationships.
+        """
+        data = self.data.pop(item.name)
+        into_data = self.data[into.name]
+        for idx, related_item in enumerate(data['list']):
+            if related_item in into_data['list']:
+                self._merge_relationship(data, idx, into_data, into_data['list'].index(related_item))
+            else:
+                into_data['list'].append(related_item)
+                into_data['strengths'].append(data['strengths'][idx])
+                into_data['position'].append(data['position'][idx])
+                into_data['count'].append(data['count'][idx])
+
+        if len(into_data['list']) > 0:
+            self._normalize_item(into)
+
+    @staticmethod
+    def _merge_relationship(data, idx, into_data, into_idx):
+        """
+        Adds a relationship to another one: sums the strengths and counts and averages the positions, weighted by the
+        counts.
+
+        :param data: The entry of the relationship to add.
+        :param idx: The index of the relationship to add in its entry.
+        :param into_data: The entry of the relationship that receives it.
+        :param into_idx: The index of the relationship that receives it in its entry.
+        """
+        into_data['strengths'][into_idx] += data['strengths'][idx]
+        count, into_count = data['count'][idx], into_data['count'][into_idx]
+        into_data['count'][into_idx] = count + into_count
+
+        position, into_position = data['position'][idx], into_data['position'][into_idx]
+        if into_position is None:
+            into_data['position'][into_idx] = position
+        elif position is not None:
+            into_data['position'][into_idx] = (into_count * into_position + count * position) / (count + into_count)
+
+    def reset_positions(self, item):
+        """
+        Drops the positions of all the relationships of the given item. The moving averages restart from the next
+        position they receive, so their counts are reset too.
+
+        :param item: The main item.
+        :return: The number of positions dropped.
+        """
+        positions = self.data[item.name]['position']
+        counts = self.data[item.name]['count']
+        qty_reset = 0
+        for idx, position in enumerate(positions):
+            if position is not None:
+                positions[idx] = None
+                counts[idx] = 1
+                qty_reset += 1
+        return qty_reset
+
     def count(self):
         """
         Returns the number of items in the table.
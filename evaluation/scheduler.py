@@ -0,0 +1,112 @@
+"""
+Periodic evaluation in a background process, so that training does not stop while the brain is scored.
+
+At every checkpoint the brain is frozen (see `Brain.freeze()`) and the snapshot is scored in a worker process while
+training continues. The results are appended to a metrics file as one JSON object per line:
+    {"timestep": ..., "time": ..., "nodes": {cortex: count}, "clusters": {cortex: count},
+     "scores": {set name: {cortex: {"avg_score": ..., "unique_top_clusters": ...,
+                                     "labels": {label: {"accuracy": ..., "cluster": ...}}}}}}
+"""
+
+from datetime import datetime
+import json
+import multiprocessing
+
+import numpy as np
+
+from cdzproject import config
+from cdzproject.evaluation import scoring
+
+
+def _evaluate_snapshot(frozen_brain, dataset_name):
+    """
+    Scores a snapshot in the worker process.
+
+    :param frozen_brain: The FrozenBrain to score.
+    :param dataset_name: The name of the dataset module.
+    :return: The metrics record.
+    """
+    cluster_counts = np.bincount(frozen_brain.cluster_cortices, minlength=len(frozen_brain.cortex_names))
+    scores = scoring.evaluate(frozen_brain, dataset_name, num_workers=1)
+
+    return {
+        'timestep': frozen_brain.timestep,
+        'time': datetime.now().isoformat(),
+        'nodes': {name: len(frozen_brain.positions[name]) for name in frozen_brain.cortex_names},
+        'clusters': {name: int(count) for name, count in zip(frozen_brain.cortex_names, cluster_counts)},
+        'scores': {
+            set_name: {
+                cortex_name: {
+                    'avg_score': result['avg_score'],
+                    'unique_top_clusters': result['unique_top_clusters'],
+                    'labels': {
+                        str(label): {'accuracy': float(accuracy), 'cluster': cluster_name}
+                        for label, (accuracy, cluster_name) in result['labels'].items()
+                    },
+                }
+                for cortex_name, result in cortex_scores.items()
+            }
+            for set_name, cortex_scores in scores.items()
+        },
+    }
+
+
+class EvaluationScheduler(object):
+    """
+    Scores snapshots of a brain in a background process at regular timesteps and streams the results to a file.
+    """
+
+    def __init__(self, dataset, metrics_file=config.EVAL_METRICS_FILE, frequency=config.TRAINING_SET_SIZE):
+        """
+        Initializes an EvaluationScheduler instance.
+
+        :param dataset: The dataset module (or its name, see `dataset_registry.DATASETS`).
+        :param metrics_file: The path of the file the metrics are appended to.
+        :param frequency: The number of timesteps between evaluations.
+        """
+        self.dataset_name = dataset if isinstance(dataset, str) else dataset.__name__
+        self.frequency = frequency
+        self.metrics = open(metrics_file, 'a')
+        self.pool = multiprocessing.Pool(1)
+
+    def step(self, brain):
+        """
+        Submits an evaluation if the brain reached a checkpoint. Call this once per timestep.
+
+        :param brain: The brain being trained.
+        """
+        if brain.timestep and brain.timestep % self.frequency == 0:
+            self.submit(brain)
+
+    def submit(self, brain):
+        """
+        Snapshots the brain and scores the snapshot in the background. Returns as soon as the snapshot is taken.
+
+        :param brain: The brain to score.
+        """
+        self.pool.apply_async(
+            _evaluate_snapshot, (brain.freeze(), self.dataset_name),
+            callback=self._write, error_callback=self._report_error
+        )
+
+    def close(self):
+        """
+        Waits for the submitted evaluations to finish and closes the metrics file.
+        """
+        self.pool.close()
+        self.pool.join()
+        self.metrics.close()
+
+    def _write(self, record):
+        """Appends a metrics record to the file."""
+        self.metrics.write(json.dumps(record) + '\n')
+        self.metrics.flush()
+        print('Evaluation at timestep', record['timestep'], '--', {
+            set_name: {cortex_name: '{0:.4f}'.format(result['avg_score']) for cortex_name, result in scores.items()}
+            for set_name, scores in record['scores'].items()
+        })
+
+    @staticmethod
+    def _report_error(error):
+        """Reports an evaluation that failed; training goes on."""
+        print('Evaluation failed:', repr(error))
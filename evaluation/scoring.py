@@ -0,0 +1,101 @@
+"""
+Scores how well the clusters of a brain are associated with the labels of a dataset.
+
+Scoring works on a FrozenBrain (see `Brain.freeze()`), so it never changes the brain that is being trained: no cluster
+fires, no node is marked as used and no packet reaches the CDZ. Every encoding is classified with one batched lookup
+and the label majorities are computed from a (label x cluster) confusion matrix.
+
+An encoding counts towards its label if its cluster is correlated with a cluster of another cortex and was not
+underutilized when the brain was frozen. The score of a label is the share of its encodings that excite the label's
+most common cross-modal cluster; the score of a cortex is the average over its labels.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+from cdzproject import config
+from cdzproject.utils import dataset_registry
+
+# The evaluations run by `evaluate`: (set name, cortex name, data attribute, labels attribute)
+EVALUATIONS = (
+    ('train', 'visual', 'v_train_data', 'v_train_labels'),
+    ('train', 'audio', 'a_train_data', 'a_train_labels'),
+    ('test', 'visual', 'v_test_data', 'v_test_labels'),
+    ('test', 'audio', 'a_test_data', 'a_test_labels'),
+)
+
+
+def score(frozen_brain, cortex_name, encodings, labels):
+    """
+    Scores one cortex on a set of labelled encodings.
+
+    :param frozen_brain: The FrozenBrain to score.
+    :param cortex_name: The name of the cortex the encodings belong to.
+    :param encodings: A (n, dims) array of encodings.
+    :param labels: An array of the n labels.
+    :return: A dictionary:
+                - avg_score: the average score of the labels, 0.0 if no encoding counted.
+                - unique_top_clusters: the number of different clusters that are the top cluster of a label.
+                - labels: a dictionary of (score, top cluster name) tuples, keyed by label.
+    """
+    prediction = frozen_brain.predict(cortex_name, encodings)
+    targets = prediction['cross_modal_cluster']
+    counted = targets >= 0
+    counted[counted] = ~frozen_brain.cluster_underutilized[prediction['cluster'][counted]]
+
+    label_values, label_idxs = np.unique(np.asarray(labels), return_inverse=True)
+    num_clusters = len(frozen_brain.cluster_names)
+    confusion = np.bincount(
+        label_idxs[counted] * num_clusters + targets[counted], minlength=len(label_values) * num_clusters
+    ).reshape(len(label_values), num_clusters)
+
+    totals = confusion.sum(axis=1)
+    top_clusters = confusion.argmax(axis=1)
+    label_scores = {}
+    for idx in np.flatnonzero(totals):
+        label_scores[label_values[idx].item()] = (
+            confusion[idx, top_clusters[idx]] / totals[idx], str(frozen_brain.cluster_names[top_clusters[idx]])
+        )
+
+    scores = [label_score for label_score, cluster_name in label_scores.values()]
+    return {
+        'avg_score': float(np.mean(scores)) if scores else 0.0,
+        'unique_top_clusters': len(set(cluster_name for label_score, cluster_name in label_scores.values())),
+        'labels': label_scores,
+    }
+
+
+def _score_dataset(args):
+    """Runs one evaluation. The dataset arrays are opened in the worker instead of being sent to it."""
+    frozen_brain, dataset_name, cortex_name, data_attribute, labels_attribute = args
+    dataset = dataset_registry.get_dataset(dataset_name)
+    return score(frozen_brain, cortex_name, getattr(dataset, data_attribute), getattr(dataset, labels_attribute))
+
+
+def evaluate(frozen_brain, dataset, num_workers=config.EVAL_NUM_WORKERS):
+    """
+    Scores both cortices on the train and test sets of a dataset.
+
+    :param frozen_brain: The FrozenBrain to score.
+    :param dataset: The dataset module (or its name, see `dataset_registry.DATASETS`).
+    :param num_workers: The number of worker processes. With 1, or when called from a daemon process (which cannot
+                        have children), the evaluations run in the calling process.
+    :return: A dictionary of `score` results keyed by set name and cortex name.
+    """
+    dataset_name = dataset if isinstance(dataset, str) else dataset.__name__
+    tasks = [
+        (frozen_brain, dataset_name, cortex_name, data_attribute, labels_attribute)
+        for set_name, cortex_name, data_attribute, labels_attribute in EVALUATIONS
+    ]
+
+    if num_workers > 1 and not multiprocessing.current_process().daemon:
+        with multiprocessing.Pool(min(num_workers, len(tasks))) as pool:
+            results = pool.map(_score_dataset, tasks)
+    else:
+        results = [_score_dataset(task) for task in tasks]
+
+    scores = {}
+    for (set_name, cortex_name, data_attribute, labels_attribute), result in zip(EVALUATIONS, results):
+        scores.setdefault(set_name, {})[cortex_name] = result
+    return scores
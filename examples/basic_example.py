@@ -3,6 +3,7 @@ import pprint
 from cdzproject.utils import utils
 from cdzproject import db, config
 from cdzproject.brain import Brain
+from cdzproject.evaluation.scheduler import EvaluationScheduler
 from cdzproject.modules.cortex.autoencoder import Autoencoder
 
 # == CHOOSE ONE OF THE DATASETS BELOW ==
@@ -23,11 +24,17 @@ audio_cortex = brain.add_cortex('audio', audio_autoencoder)
 
 NUM_EXAMPLES = config.EPOCHS * config.TRAINING_SET_SIZE
 
+# Scores the brain in the background every `TRAINING_SET_SIZE` steps, see `config.EVAL_METRICS_FILE`
+scheduler = EvaluationScheduler(dataset)
+
+# Random training examples are drawn in blocks by a background thread
+samples = iter(dataset.sample_stream())
+
 for timestep in range(NUM_EXAMPLES):
     brain.increment_timestep()
 
     # Get random visual and audio encodings
-    visual_input, audio_input, class_label = dataset.get_random_train_data()
+    visual_input, audio_input, class_label = next(samples)
 
     # Send the encodings to the brain
     brain.receive_sensory_input(visual_cortex, visual_input)
@@ -35,7 +42,7 @@ for timestep in range(NUM_EXAMPLES):
 
     brain.cleanup()       # Deletes under-utilized nodes/clusters
     brain.build_nrnd_indexes()  # Rebuild NearestNode indexes (For performance only)
-    utils.print_info(dataset, brain, NUM_EXAMPLES)
+    utils.print_info(dataset, brain, NUM_EXAMPLES, scheduler=scheduler)
 
     # Stop creating new nodes towards the end of training
     # This is mostly so the new nodes don't interfere with the score as they are not fully trained yet
@@ -45,6 +52,7 @@ for timestep in range(NUM_EXAMPLES):
 
 
 # == Finally ==
+scheduler.close()
 brain.cleanup(force=True)
 db.verify_data_integrity()
 
@@ -0,0 +1,16 @@
+"""
+Trains the brain with several worker processes and compares it with a single-process run.
+See `cdzproject/parallel/data_parallel.py`.
+"""
+
+import pprint
+
+from cdzproject import config
+from cdzproject.parallel.data_parallel import compare_with_single_process
+
+if __name__ == '__main__':
+    # Print the configuration info so we can keep track of what the configuration was for the given run
+    pprint.pprint(config.__dict__)
+
+    NUM_EXAMPLES = config.EPOCHS * config.TRAINING_SET_SIZE
+    compare_with_single_process('mnist_fsdd', NUM_EXAMPLES)
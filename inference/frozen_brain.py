@@ -0,0 +1,253 @@
+"""
+A read-only predictor compiled from a trained brain.
+
+Serving only needs "encoding -> cluster -> cross-modal cluster". A FrozenBrain stores that path as flat arrays:
+    - per cortex: the node positions, each node's strongest cluster and the node certainties.
+    - for every cluster: its cortex, its strongest cross-modal cluster (-1 if it has none) and the CDZ certainty.
+
+Predictions are vectorized lookups and never touch the brain that was frozen or the database.
+"""
+
+import numpy as np
+
+from cdzproject import db, config
+
+# The number of encodings whose distances to every node are computed at once.
+CHUNK_SIZE = 1024
+
+
+class FrozenBrain(object):
+    """
+    A read-only snapshot of a brain's classification path. See `Brain.freeze()`.
+    """
+
+    def __init__(self, timestep, cortex_names, positions, node_clusters, node_certainties, cluster_names,
+                 cluster_cortices, cluster_targets, cluster_certainties, cluster_underutilized, indexes=None):
+        """
+        Initializes a FrozenBrain instance.
+
+        :param timestep: The timestep of the brain when it was frozen.
+        :param cortex_names: The names of the cortices.
+        :param positions: A dictionary of (n_nodes, dims) node position arrays, keyed by cortex name.
+        :param node_clusters: A dictionary of arrays of each node's strongest cluster index, keyed by cortex name.
+        :param node_certainties: A dictionary of arrays of each node's certainty, keyed by cortex name.
+        :param cluster_names: An array of the names of all the clusters.
+        :param cluster_cortices: An array of each cluster's cortex index (in `cortex_names`).
+        :param cluster_targets: An array of each cluster's strongest cross-modal cluster index, -1 if it has none.
+        :param cluster_certainties: An array of the certainty of each cluster's strongest correlation.
+        :param cluster_underutilized: An array of flags, True if the cluster was underutilized when frozen.
+        :param indexes: An optional dictionary of nearest node indexes (AnnoyIndex), keyed by cortex name.
+                        Cortices without an index are searched exhaustively.
+        """
+        self.timestep = timestep
+        self.cortex_names = list(cortex_names)
+        self.positions = positions
+        self.node_clusters = node_clusters
+        self.node_certainties = node_certainties
+        self.cluster_names = cluster_names
+        self.cluster_cortices = cluster_cortices
+        self.cluster_targets = cluster_targets
+        self.cluster_certainties = cluster_certainties
+        self.cluster_underutilized = cluster_underutilized
+        self.indexes = indexes or {}
+
+        # Squared norms of the positions, used to compute distances with a single matrix product
+        self.squared_norms = {name: np.einsum('ij,ij->i', pos, pos) for name, pos in self.positions.items()}
+
+    @classmethod
+    def from_brain(cls, brain):
+        """
+        Compiles a brain into a FrozenBrain. The brain is only read.
+
+        :param brain: The brain to freeze.
+        :return: A FrozenBrain instance.
+        """
+        cortex_names = list(brain.cortices)
+        cortex_idxs = {name: idx for idx, name in enumerate(cortex_names)}
+
+        clusters = [
+            data['obj'] for data in db.clusters_to_nodes.data.values()
+            if data['obj'].cortex.brain is brain
+        ]
+        cluster_idxs = {cluster.name: idx for idx, cluster in enumerate(clusters)}
+
+        cluster_targets = np.full(len(clusters), -1, dtype=np.int64)
+        cluster_certainties = np.zeros(len(clusters))
+        for idx, cluster in enumerate(clusters):
+            correlation = brain.cdz.correlations.get(cluster.name)
+            if correlation and correlation.connections:
+                target, strength = correlation.get_strongest_correlation()
+                cluster_targets[idx] = cluster_idxs[target.name]
+                cluster_certainties[idx] = correlation.certainty()
+
+        positions = {}
+        node_clusters = {}
+        node_certainties = {}
+        for name, cortex in brain.cortices.items():
+            nodes = cortex.node_manager.nodes
+            if nodes:
+                positions[name] = np.array([node.position for node in nodes], dtype=np.float64)
+            else:
+                # Keep the dimensions of the encodings if the cortex had nodes before
+                store = cortex.node_manager.store
+                positions[name] = np.empty((0, store.positions.shape[1] if 'positions' in store.columns else 0))
+            node_clusters[name] = np.array(
+                [cluster_idxs[node.get_strongest_cluster().name] for node in nodes], dtype=np.int64
+            )
+            node_certainties[name] = np.array([node.certainty() for node in nodes], dtype=np.float64)
+
+        return cls(
+            brain.timestep, cortex_names, positions, node_clusters, node_certainties,
+            np.array([cluster.name for cluster in clusters], dtype=np.str_),
+            np.array([cortex_idxs[cluster.cortex.name] for cluster in clusters], dtype=np.int64),
+            cluster_targets, cluster_certainties,
+            np.array([cluster.is_underutilized() for cluster in clusters], dtype=bool),
+        )
+
+    def nearest_nodes(self, cortex_name, encodings):
+        """
+        Returns the nearest node of every encoding.
+
+        :param cortex_name: The name of the cortex the encodings belong to.
+        :param encodings: A (n, dims) array of encodings.
+        :return: A tuple of arrays (node indexes, euclidean distances). A cortex without nodes returns -1 and an
+                 infinite distance for every encoding.
+        """
+        positions = self.positions[cortex_name]
+        squared_norms = self.squared_norms[cortex_name]
+        if len(positions) == 0:
+            qty_encodings = len(np.atleast_2d(encodings)) if np.size(encodings) else 0
+            return np.full(qty_encodings, -1, dtype=np.int64), np.full(qty_encodings, np.inf)
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, positions.shape[1])
+
+        if cortex_name in self.indexes:
+            return self._search_index(self.indexes[cortex_name], encodings)
+
+        node_idxs = np.empty(len(encodings), dtype=np.int64)
+        distances = np.empty(len(encodings))
+        for start in range(0, len(encodings), CHUNK_SIZE):
+            chunk = encodings[start:start + CHUNK_SIZE]
+            # |x - p|^2 = |x|^2 - 2 x.p + |p|^2, the |x|^2 term does not change the argmin
+            partial = squared_norms[None, :] - 2 * chunk @ positions.T
+            idxs = np.argmin(partial, axis=1)
+            node_idxs[start:start + CHUNK_SIZE] = idxs
+            squared = partial[np.arange(len(chunk)), idxs] + np.einsum('ij,ij->i', chunk, chunk)
+            distances[start:start + CHUNK_SIZE] = np.sqrt(np.maximum(squared, 0))
+
+        return node_idxs, distances
+
+    @staticmethod
+    def _search_index(index, encodings):
+        """
+        Returns the nearest node of every encoding using an approximate nearest node index.
+
+        :param index: The AnnoyIndex of the cortex. Item i of the index must be node i.
+        :param encodings: A (n, dims) array of encodings.
+        :return: A tuple of arrays (node indexes, euclidean distances).
+        """
+        node_idxs = np.empty(len(encodings), dtype=np.int64)
+        distances = np.empty(len(encodings))
+        for idx, encoding in enumerate(encodings):
+            nn_idxs, nn_distances = index.get_nns_by_vector(
+                encoding, 1, include_distances=True, search_k=config.NRND_SEARCH_K or -1
+            )
+            node_idxs[idx] = nn_idxs[0]
+            distances[idx] = nn_distances[0]
+        return node_idxs, distances
+
+    def predict(self, cortex_name, encodings):
+        """
+        Classifies encodings: encoding -> nearest node -> cluster -> cross-modal cluster.
+
+        :param cortex_name: The name of the cortex the encodings belong to.
+        :param encodings: A (n, dims) array of encodings.
+        :return: A dictionary of arrays:
+                    - node: the index of the nearest node in the cortex.
+                    - distance: the distance to the nearest node.
+                    - cluster: the index of the node's strongest cluster.
+                    - certainty: the node's certainty of its cluster.
+                    - cross_modal_cluster: the index of the cluster's strongest cross-modal cluster, -1 if none.
+                    - cross_modal_certainty: the CDZ's certainty of the cross-modal cluster.
+                 Cluster indexes refer to `cluster_names`. If the cortex has no nodes, the nodes and clusters are -1
+                 and the certainties 0.
+        """
+        node_idxs, distances = self.nearest_nodes(cortex_name, encodings)
+        if len(self.positions[cortex_name]) == 0:
+            return {
+                'node': node_idxs,
+                'distance': distances,
+                'cluster': node_idxs.copy(),
+                'certainty': np.zeros(len(node_idxs)),
+                'cross_modal_cluster': node_idxs.copy(),
+                'cross_modal_certainty': np.zeros(len(node_idxs)),
+            }
+
+        clusters = self.node_clusters[cortex_name][node_idxs]
+        return {
+            'node': node_idxs,
+            'distance': distances,
+            'cluster': clusters,
+            'certainty': self.node_certainties[cortex_name][node_idxs],
+            'cross_modal_cluster': self.cluster_targets[clusters],
+            'cross_modal_certainty': self.cluster_certainties[clusters],
+        }
+
+    def to_arrays(self):
+        """
+        Returns every array of the FrozenBrain by name. Nearest node indexes are not included.
+
+        :return: A dictionary of numpy arrays.
+        """
+        arrays = {
+            'timestep': np.array(self.timestep),
+            'cortex_names': np.array(self.cortex_names, dtype=np.str_),
+            'cluster_names': self.cluster_names,
+            'cluster_cortices': self.cluster_cortices,
+            'cluster_targets': self.cluster_targets,
+            'cluster_certainties': self.cluster_certainties,
+            'cluster_underutilized': self.cluster_underutilized,
+        }
+        for idx, name in enumerate(self.cortex_names):
+            arrays['positions_%d' % idx] = self.positions[name]
+            arrays['node_clusters_%d' % idx] = self.node_clusters[name]
+            arrays['node_certainties_%d' % idx] = self.node_certainties[name]
+
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, indexes=None):
+        """
+        Creates a FrozenBrain from the arrays returned by `to_arrays`. The arrays are used as they are, not copied.
+
+        :param arrays: A dictionary (or npz file) of numpy arrays.
+        :param indexes: An optional dictionary of nearest node indexes, keyed by cortex name.
+        :return: A FrozenBrain instance.
+        """
+        cortex_names = [str(name) for name in arrays['cortex_names']]
+        return cls(
+            int(arrays['timestep']), cortex_names,
+            {name: arrays['positions_%d' % idx] for idx, name in enumerate(cortex_names)},
+            {name: arrays['node_clusters_%d' % idx] for idx, name in enumerate(cortex_names)},
+            {name: arrays['node_certainties_%d' % idx] for idx, name in enumerate(cortex_names)},
+            arrays['cluster_names'], arrays['cluster_cortices'], arrays['cluster_targets'],
+            arrays['cluster_certainties'], arrays['cluster_underutilized'], indexes=indexes,
+        )
+
+    def save(self, path):
+        """
+        Saves the FrozenBrain as a standalone `.npz` file. It can be loaded without the brain or the database.
+
+        :param path: The path of the file.
+        """
+        np.savez(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a FrozenBrain saved with `save`.
+
+        :param path: The path of the file.
+        :return: A FrozenBrain instance.
+        """
+        with np.load(path) as data:
+            return cls.from_arrays({name: data[name] for name in data.files})
@@ -0,0 +1,318 @@
+"""
+A local inference server that answers classification queries over a UNIX domain socket.
+
+Clients send one encoding per request. Concurrent requests are coalesced into micro-batches (closed when they reach
+`max_batch_size` or when the oldest request waited `max_wait` seconds) and answered with a single batched nearest node
+lookup of a FrozenBrain.
+
+Framing (little-endian):
+    request:  header (request id: uint32, cortex index: uint8, dims: uint32) followed by `dims` float32 values.
+    response: request id: uint32, cluster: int32, cross-modal cluster: int32, certainty: float32,
+              cross-modal certainty: float32.
+The cortex index refers to `FrozenBrain.cortex_names` and the cluster ids to `FrozenBrain.cluster_names`.
+A cross-modal cluster of -1 means that the cluster is not correlated with any other cluster yet. A cluster of -2 means
+that the request could not be answered: its lookup failed, or its header had an unknown cortex index or the wrong
+number of dimensions. The server closes the connection after answering a bad header, since it does not read the rest
+of the frame.
+
+The server stops reading a connection while `max_pending` requests wait for a micro-batch or while the client does not
+read its responses.
+"""
+
+import asyncio
+import collections
+import os
+import struct
+import time
+
+import numpy as np
+
+from cdzproject import config
+
+REQUEST_HEADER = struct.Struct('<IBI')
+RESPONSE = struct.Struct('<Iiiff')
+
+# The cluster of the response to a request that could not be answered
+ERROR_CLUSTER = -2
+
+# The number of most recent request latencies the percentiles are computed from
+LATENCY_WINDOW = 10000
+
+
+class InferenceServer(object):
+    """
+    Serves a FrozenBrain over a UNIX domain socket, batching concurrent requests.
+    """
+
+    def __init__(self, frozen_brain, path, max_batch_size=config.INFERENCE_SERVER_MAX_BATCH_SIZE,
+                 max_wait=config.INFERENCE_SERVER_MAX_WAIT, max_pending=config.INFERENCE_SERVER_MAX_PENDING):
+        """
+        Initializes an InferenceServer instance.
+
+        :param frozen_brain: The FrozenBrain that answers the queries (see `Brain.freeze()`).
+        :param path: The path of the UNIX domain socket.
+        :param max_batch_size: The maximum number of requests in a micro-batch.
+        :param max_wait: The maximum time (in seconds) a request waits for its micro-batch to fill up.
+        :param max_pending: The maximum number of requests waiting for a micro-batch.
+        """
+        self.model = frozen_brain
+        self.path = path
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+
+        # The dimensions of the encodings of every cortex, None if the cortex never had nodes
+        self.dims = [frozen_brain.positions[name].shape[1] or None for name in frozen_brain.cortex_names]
+
+        self.pending = None
+        self.server = None
+        self.batcher = None
+        # The tasks reading the open connections, keyed by their writers
+        self.connections = {}
+
+        self.started_at = None
+        self.qty_requests = 0
+        self.qty_batches = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    async def start(self):
+        """
+        Starts listening on the socket and batching requests.
+        """
+        self.pending = asyncio.Queue(maxsize=self.max_pending)
+        self.started_at = time.perf_counter()
+        self.batcher = asyncio.ensure_future(self._run_batcher())
+        self.server = await asyncio.start_unix_server(self._handle_client, path=self.path)
+
+    async def stop(self):
+        """
+        Stops the server. The open connections are closed, so their clients fail the queries still in flight.
+        """
+        self.server.close()
+        self.batcher.cancel()
+        for writer in list(self.connections):
+            writer.close()
+        while self.connections:
+            # The queued requests are dropped, so that the connections waiting for room in the queue end too
+            while not self.pending.empty():
+                self.pending.get_nowait()
+            await asyncio.wait(list(self.connections.values()), timeout=0.01)
+        await self.server.wait_closed()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def serve_forever(self, report_interval=config.INFERENCE_SERVER_REPORT_INTERVAL):
+        """
+        Starts the server and prints its stats every `report_interval` seconds until it is cancelled.
+
+        :param report_interval: The number of seconds between stats reports.
+        """
+        await self.start()
+        try:
+            while True:
+                await asyncio.sleep(report_interval)
+                print('Inference server:', self.stats())
+        finally:
+            await self.stop()
+
+    def stats(self):
+        """
+        Returns the latency and throughput counters.
+
+        :return: A dictionary with the number of requests and batches, the average batch size, the throughput
+                 (requests/sec since the start) and the p50/p99 latencies (in milliseconds) of the recent requests.
+        """
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'requests': self.qty_requests,
+            'batches': self.qty_batches,
+            'avg_batch_size': self.qty_requests / self.qty_batches if self.qty_batches else 0.0,
+            'throughput': self.qty_requests / elapsed if elapsed else 0.0,
+            'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+        }
+
+    async def _handle_client(self, reader, writer):
+        """Reads the requests of one connection and queues them for the batcher."""
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                header = await reader.readexactly(REQUEST_HEADER.size)
+                request_id, cortex_idx, dims = REQUEST_HEADER.unpack(header)
+
+                # A bad header is answered before its payload is read, it could announce any size
+                if not self._is_valid(cortex_idx, dims):
+                    writer.write(self._error_response(request_id))
+                    await writer.drain()
+                    break
+
+                encoding = np.frombuffer(await reader.readexactly(dims * 4), dtype='<f4')
+                await self.pending.put((time.perf_counter(), request_id, cortex_idx, encoding, writer))
+                # Stop reading the requests of a client that does not read its responses
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        del self.connections[writer]
+        writer.close()
+
+    def _is_valid(self, cortex_idx, dims):
+        """Returns whether a request header refers to a cortex and has the number of dimensions of its encodings."""
+        if cortex_idx >= len(self.dims):
+            return False
+        if self.dims[cortex_idx] is None:
+            return dims <= config.INFERENCE_SERVER_MAX_DIMS
+        return dims == self.dims[cortex_idx]
+
+    async def _next_batch(self):
+        """Waits for a request and collects more until the batch is full or the first request waited too long."""
+        batch = [await self.pending.get()]
+        deadline = batch[0][0] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Requests that are already queued never wait
+            if not self.pending.empty():
+                batch.append(self.pending.get_nowait())
+                continue
+
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.pending.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run_batcher(self):
+        """Answers the queued requests in micro-batches."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            # The lookup runs in a thread so that the event loop keeps accepting requests in the meantime.
+            responses = await loop.run_in_executor(None, self._answer, batch)
+
+            now = time.perf_counter()
+            for (received_at, request_id, cortex_idx, encoding, writer), response in zip(batch, responses):
+                if not writer.is_closing():
+                    writer.write(response)
+                self.latencies.append(now - received_at)
+
+            self.qty_requests += len(batch)
+            self.qty_batches += 1
+
+    def _answer(self, batch):
+        """
+        Classifies a micro-batch, grouped by cortex.
+
+        :param batch: A list of queued requests.
+        :return: A list of packed responses, in the order of the batch.
+        """
+        responses = [None] * len(batch)
+        by_cortex = collections.defaultdict(list)
+        for idx, request in enumerate(batch):
+            by_cortex[request[2]].append(idx)
+
+        for cortex_idx, idxs in by_cortex.items():
+            try:
+                prediction = self.model.predict(
+                    self.model.cortex_names[cortex_idx], np.stack([batch[idx][3] for idx in idxs])
+                )
+            except Exception:
+                # The other cortices of the batch are still answered
+                for idx in idxs:
+                    responses[idx] = self._error_response(batch[idx][1])
+                continue
+
+            for row, idx in enumerate(idxs):
+                responses[idx] = RESPONSE.pack(
+                    batch[idx][1], prediction['cluster'][row], prediction['cross_modal_cluster'][row],
+                    prediction['certainty'][row], prediction['cross_modal_certainty'][row]
+                )
+
+        return responses
+
+    @staticmethod
+    def _error_response(request_id):
+        """Returns the packed response to a request that could not be answered."""
+        return RESPONSE.pack(request_id, ERROR_CLUSTER, -1, 0.0, 0.0)
+
+
+class InferenceClient(object):
+    """
+    A client of the InferenceServer. Any number of queries can be in flight on the same connection.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes an InferenceClient instance.
+
+        :param path: The path of the server's UNIX domain socket.
+        """
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.responses = None
+        self.next_request_id = 0
+        self.futures = {}
+
+    async def connect(self):
+        """
+        Connects to the server.
+        """
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self.responses = asyncio.ensure_future(self._read_responses())
+
+    async def close(self):
+        """
+        Closes the connection.
+        """
+        self.responses.cancel()
+        self._fail_pending(ConnectionError('The connection was closed.'))
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    async def classify(self, cortex_idx, encoding):
+        """
+        Classifies one encoding.
+
+        :param cortex_idx: The index of the encoding's cortex in `FrozenBrain.cortex_names`.
+        :param encoding: The encoding.
+        :return: A tuple (cluster, cross-modal cluster, certainty, cross-modal certainty). Raises an exception if the
+                 server could not answer, and a ConnectionError if the connection is lost.
+        """
+        if self.responses.done():
+            raise ConnectionError('The connection to the inference server is closed.')
+
+        request_id = self.next_request_id
+        self.next_request_id = (self.next_request_id + 1) % 2**32
+
+        encoding = np.asarray(encoding, dtype='<f4').ravel()
+        future = asyncio.get_running_loop().create_future()
+        self.futures[request_id] = future
+        self.writer.write(REQUEST_HEADER.pack(request_id, cortex_idx, len(encoding)) + encoding.tobytes())
+        await self.writer.drain()
+        return await future
+
+    async def _read_responses(self):
+        """Resolves the pending queries as their responses arrive, and fails them all if the connection is lost."""
+        try:
+            while True:
+                response = RESPONSE.unpack(await self.reader.readexactly(RESPONSE.size))
+                future = self.futures.pop(response[0])
+                if response[1] == ERROR_CLUSTER:
+                    future.set_exception(Exception('The server could not answer request %d.' % response[0]))
+                else:
+                    future.set_result(response[1:])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self._fail_pending(ConnectionError('The connection to the inference server was lost.'))
+
+    def _fail_pending(self, error):
+        """Fails the queries that are waiting for a response."""
+        for future in self.futures.values():
+            if not future.done():
+                future.set_exception(error)
+        self.futures = {}
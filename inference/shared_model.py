@@ -0,0 +1,230 @@
+"""
+Serves a frozen brain from many processes without copying it into each one.
+
+A training process publishes versions of a FrozenBrain into a directory:
+    <directory>/v<N>/<array>.npy      one file per array of the FrozenBrain
+    <directory>/v<N>/<cortex>.ann     optional Annoy nearest node indexes
+    <directory>/CURRENT               the name of the latest complete version
+
+Readers memory-map the arrays (and indexes) read-only, so every process shares the same physical pages. A version is
+only referenced by CURRENT once all of its files are written, and CURRENT is replaced atomically, so readers pick up
+new versions between queries without a restart and never see a partially written one.
+"""
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from annoy import AnnoyIndex
+
+from cdzproject import config
+from cdzproject.inference.frozen_brain import FrozenBrain
+
+CURRENT_FILE = 'CURRENT'
+
+
+def _versions(directory):
+    """Returns the version numbers published in the directory, in ascending order."""
+    return sorted(
+        int(name[1:]) for name in os.listdir(directory)
+        if name.startswith('v') and name[1:].isdigit() and os.path.isdir(os.path.join(directory, name))
+    )
+
+
+def publish(frozen_brain, directory, build_indexes=False, keep_versions=config.INFERENCE_KEEP_VERSIONS):
+    """
+    Publishes a new version of a FrozenBrain.
+
+    :param frozen_brain: The FrozenBrain to publish (see `Brain.freeze()`).
+    :param directory: The directory the readers attach to.
+    :param build_indexes: Whether to build and publish Annoy nearest node indexes.
+    :param keep_versions: The number of versions to keep, at least one (the published version). Older versions are
+                          deleted.
+    :return: The name of the published version.
+    """
+    if keep_versions < 1:
+        raise Exception('keep_versions must be at least 1, got {}'.format(keep_versions))
+
+    os.makedirs(directory, exist_ok=True)
+    versions = _versions(directory)
+    version = 'v%d' % (versions[-1] + 1 if versions else 1)
+
+    # Write everything into a temporary directory first, so a version directory is always complete. Its name is
+    # unique, so the directory left behind by a publish that failed does not get in the way.
+    tmp_path = tempfile.mkdtemp(prefix='.tmp_%s_' % version, dir=directory)
+    try:
+        for name, array in frozen_brain.to_arrays().items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+
+        if build_indexes:
+            for name in frozen_brain.cortex_names:
+                positions = frozen_brain.positions[name]
+                if len(positions) == 0:
+                    # Cortices without nodes are answered without searching
+                    continue
+                index = AnnoyIndex(positions.shape[1], metric='euclidean')
+                for idx, position in enumerate(positions):
+                    index.add_item(idx, position)
+                index.build(config.NRND_N_TREES)
+                index.save(os.path.join(tmp_path, name + '.ann'))
+                index.unload()
+
+        os.rename(tmp_path, os.path.join(directory, version))
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    # Atomically point readers to the new version
+    tmp_current = os.path.join(directory, '.tmp_' + CURRENT_FILE)
+    with open(tmp_current, 'w') as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(directory, CURRENT_FILE))
+
+    # Readers that are still attached to a deleted version keep working, the files stay alive until they are unmapped.
+    for old_version in _versions(directory)[:-keep_versions]:
+        shutil.rmtree(os.path.join(directory, 'v%d' % old_version), ignore_errors=True)
+
+    return version
+
+
+def attach(directory, version):
+    """
+    Attaches to a published version read-only.
+
+    :param directory: The directory the versions are published in.
+    :param version: The name of the version.
+    :return: A FrozenBrain backed by memory-mapped arrays.
+    """
+    path = os.path.join(directory, version)
+    arrays = {
+        name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r')
+        for name in os.listdir(path) if name.endswith('.npy')
+    }
+
+    indexes = {}
+    for idx, name in enumerate(str(name) for name in arrays['cortex_names']):
+        index_path = os.path.join(path, name + '.ann')
+        if os.path.exists(index_path):
+            indexes[name] = AnnoyIndex(arrays['positions_%d' % idx].shape[1], metric='euclidean')
+            indexes[name].load(index_path)
+
+    return FrozenBrain.from_arrays(arrays, indexes=indexes)
+
+
+class SharedModelReader(object):
+    """
+    Keeps a read-only view of the latest published version and switches to new versions between queries.
+    """
+
+    def __init__(self, directory):
+        """
+        Initializes a SharedModelReader instance.
+
+        :param directory: The directory the versions are published in.
+        """
+        self.directory = directory
+        self.version = None
+        self.model = None
+
+    def refresh(self):
+        """
+        Attaches to the latest published version if it changed.
+
+        :return: The FrozenBrain of the latest version.
+        """
+        with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+            version = f.read().strip()
+
+        if version != self.version:
+            self.model = attach(self.directory, version)
+            self.version = version
+
+        return self.model
+
+    def predict(self, cortex_name, encodings):
+        """
+        Classifies encodings with the latest published version. See `FrozenBrain.predict`.
+
+        :param cortex_name: The name of the cortex the encodings belong to.
+        :param encodings: A (n, dims) array of encodings.
+        :return: A dictionary of arrays. 'version' holds the name of the version that answered.
+        """
+        try:
+            model = self.refresh()
+        except FileNotFoundError:
+            # The version was replaced and deleted while we were attaching to it, attach to the newer one.
+            model = self.refresh()
+
+        prediction = model.predict(cortex_name, encodings)
+        prediction['version'] = self.version
+        return prediction
+
+
+# The reader of a worker process, see `_init_worker`
+_reader = None
+
+
+def _init_worker(directory):
+    """Attaches the worker process to the published model."""
+    global _reader
+    _reader = SharedModelReader(directory)
+
+
+def _predict(args):
+    """Answers one batch in a worker process."""
+    cortex_name, encodings = args
+    return _reader.predict(cortex_name, encodings)
+
+
+class InferenceWorkers(object):
+    """
+    A pool of worker processes that answer batched queries from a published model.
+    """
+
+    def __init__(self, directory, num_workers=config.INFERENCE_NUM_WORKERS,
+                 batch_size=config.INFERENCE_BATCH_SIZE):
+        """
+        Initializes an InferenceWorkers instance.
+
+        :param directory: The directory the versions are published in.
+        :param num_workers: The number of worker processes.
+        :param batch_size: The number of encodings sent to a worker at once.
+        """
+        self.batch_size = batch_size
+        self.pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(directory,))
+
+    def predict(self, cortex_name, encodings):
+        """
+        Classifies encodings, split into batches across the workers. See `FrozenBrain.predict`.
+
+        :param cortex_name: The name of the cortex the encodings belong to.
+        :param encodings: A (n, dims) array of encodings.
+        :return: A dictionary of arrays. 'version' holds the names of the versions that answered each encoding.
+        """
+        encodings = np.asarray(encodings)
+        batches = [
+            (cortex_name, encodings[start:start + self.batch_size])
+            for start in range(0, len(encodings), self.batch_size)
+        ]
+        if not batches:
+            # A single empty batch returns empty arrays of the right types
+            batches = [(cortex_name, encodings)]
+        results = self.pool.map(_predict, batches)
+
+        prediction = {
+            key: np.concatenate([result[key] for result in results])
+            for key in results[0] if key != 'version'
+        }
+        prediction['version'] = np.concatenate([
+            np.full(len(batch[1]), result['version']) for batch, result in zip(batches, results)
+        ])
+        return prediction
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,274 @@
+"""
+Asyncio ingestion of asynchronous sensor streams.
+
+Every modality pushes timestamped samples into its own bounded queue; pushing waits when the queue is full
+(backpressure). An aligner groups the samples into event-time windows of width `window`. Samples of different
+modalities that fall in the same window are sent to the brain at the same timestep, so the CDZ correlates them. A
+window holding several samples of the same modality is sent over several timesteps, each with at most one sample per
+modality.
+
+Every modality tracks the newest event time it consumed, and a window is sent to the brain once the oldest of these is
+`lateness` past its end. Samples that are consumed in event-time order within their modality are therefore never late,
+whatever the sample rates of the modalities. A modality whose queue stays empty for `idle_timeout` seconds (wall-clock
+time) stops holding the windows back, so a stalled sensor does not stall the others: its samples that arrive after
+their window was sent are dropped and counted in `stats()['late_events']`.
+
+While the windows wait for a slower modality, a modality that is ahead holds at most `max_pending` samples in open
+windows. It then stops consuming its queue, and once the queue is full its producer waits too.
+"""
+
+import asyncio
+import collections
+import time
+
+from cdzproject import config
+
+
+class StreamingIngestor(object):
+    """
+    Aligns asynchronous modality streams by event time and feeds them to a brain in order.
+    """
+
+    def __init__(self, brain, window=config.INGEST_WINDOW, lateness=config.INGEST_LATENESS,
+                 buffer_size=config.INGEST_BUFFER_SIZE, idle_timeout=config.INGEST_IDLE_TIMEOUT,
+                 max_pending=config.INGEST_MAX_PENDING, learn=True, maintenance=True):
+        """
+        Initializes a StreamingIngestor instance.
+
+        :param brain: The brain to feed.
+        :param window: The width of an event-time window.
+        :param lateness: How long (in event time) a window waits for late samples.
+        :param buffer_size: The maximum number of queued samples per modality.
+        :param idle_timeout: How long (in seconds) a modality's queue stays empty before the modality stops holding
+                             the windows back.
+        :param max_pending: The maximum number of samples per modality waiting for their windows to close.
+        :param learn: Whether the brain should learn from the samples.
+        :param maintenance: Whether to run the brain's periodic maintenance after every window, like
+                            `examples/basic_example.py` does.
+        """
+        self.brain = brain
+        self.window = window
+        self.lateness = lateness
+        self.buffer_size = buffer_size
+        self.idle_timeout = idle_timeout
+        self.max_pending = max_pending
+        self.learn = learn
+        self.maintenance = maintenance
+
+        self.queues = {}
+        self.consumers = []
+
+        # Samples waiting for their window to close, keyed by window index
+        self.pending = collections.defaultdict(list)
+        # The number of samples of every modality in `pending`, and an event set whenever windows are sent
+        self.qty_pending = {}
+        self.windows_sent = asyncio.Event()
+        # The newest event time consumed from every modality, and the wall-clock time of its last sample
+        self.newest_event_times = {}
+        self.last_received = {}
+        self.last_sent_window = None
+
+        self.qty_events = 0
+        self.qty_late_events = 0
+        self.qty_windows = 0
+
+    def add_modality(self, cortex_name):
+        """
+        Adds the input stream of a cortex. Must be called before `start()`.
+
+        :param cortex_name: The name of the cortex the samples are sent to.
+        """
+        self.brain.get_cortex(cortex_name)
+        self.queues[cortex_name] = asyncio.Queue(maxsize=self.buffer_size)
+        self.newest_event_times[cortex_name] = None
+        self.qty_pending[cortex_name] = 0
+
+    async def push(self, cortex_name, event_time, data):
+        """
+        Pushes a sample. Waits while the modality's queue is full.
+
+        :param cortex_name: The name of the cortex the sample belongs to.
+        :param event_time: The time at which the sensor recorded the sample.
+        :param data: The sensory data.
+        """
+        self._raise_consumer_errors()
+        queue = self.queues[cortex_name]
+        if not queue.full():
+            queue.put_nowait((event_time, data))
+            return
+
+        # Wait for room in the queue, unless a consumer fails in the meantime
+        put = asyncio.ensure_future(queue.put((event_time, data)))
+        await asyncio.wait([put] + self.consumers, return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+        self._raise_consumer_errors()
+
+    def start(self):
+        """
+        Starts consuming the modality queues.
+        """
+        now = time.monotonic()
+        self.last_received = {cortex_name: now for cortex_name in self.queues}
+        self.consumers = [
+            asyncio.ensure_future(self._consume(cortex_name, queue)) for cortex_name, queue in self.queues.items()
+        ]
+
+    async def close(self):
+        """
+        Waits for the queued samples to be consumed, then sends every pending window to the brain.
+        """
+        # A failed consumer never empties its queue, wait for the queues and the consumers together
+        joined = asyncio.ensure_future(asyncio.gather(*[queue.join() for queue in self.queues.values()]))
+        await asyncio.wait([joined] + self.consumers, return_when=asyncio.FIRST_COMPLETED)
+        if not joined.done():
+            joined.cancel()
+        self._raise_consumer_errors()
+
+        for consumer in self.consumers:
+            consumer.cancel()
+
+        self._send_windows(flush=True)
+
+    def stats(self):
+        """
+        Returns the ingestion counters.
+
+        :return: A dictionary with the number of received and late events, sent windows, and queued and pending
+                 samples per modality.
+        """
+        return {
+            'events': self.qty_events,
+            'late_events': self.qty_late_events,
+            'windows': self.qty_windows,
+            'queued': {cortex_name: queue.qsize() for cortex_name, queue in self.queues.items()},
+            'pending': dict(self.qty_pending),
+        }
+
+    def _raise_consumer_errors(self):
+        """Re-raises the error of a consumer that stopped, so the producers do not wait on a full queue forever."""
+        for consumer in self.consumers:
+            if consumer.done() and not consumer.cancelled() and consumer.exception() is not None:
+                raise consumer.exception()
+
+    async def _consume(self, cortex_name, queue):
+        """Moves the samples of one modality into their windows and sends the windows that are ready."""
+        while True:
+            while self._is_over_capacity(cortex_name):
+                # Wait for windows to be sent. The modalities holding them back may become idle in the meantime.
+                self.windows_sent.clear()
+                try:
+                    await asyncio.wait_for(self.windows_sent.wait(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    self._send_windows()
+
+            event_time, data = await queue.get()
+            self._add_event(cortex_name, event_time, data)
+            self._send_windows()
+            queue.task_done()
+
+            # Let the other modalities (and the producers) run
+            await asyncio.sleep(0)
+
+    def _add_event(self, cortex_name, event_time, data):
+        """Adds a sample to its window, or drops it if the window was already sent."""
+        self.qty_events += 1
+        self.last_received[cortex_name] = time.monotonic()
+        if self.newest_event_times[cortex_name] is None or event_time > self.newest_event_times[cortex_name]:
+            self.newest_event_times[cortex_name] = event_time
+
+        window_idx = int(event_time // self.window)
+
+        if self.last_sent_window is not None and window_idx <= self.last_sent_window:
+            self.qty_late_events += 1
+            return
+
+        self.pending[window_idx].append((event_time, cortex_name, data))
+        self.qty_pending[cortex_name] += 1
+
+    def _active_event_times(self):
+        """
+        Returns the newest event time of every modality that is not idle, None for the modalities that did not send
+        anything yet. A modality is idle when its queue has been empty for `idle_timeout` seconds.
+        """
+        now = time.monotonic()
+        return {
+            cortex_name: event_time for cortex_name, event_time in self.newest_event_times.items()
+            if not self.queues[cortex_name].empty() or now - self.last_received[cortex_name] < self.idle_timeout
+        }
+
+    def _is_over_capacity(self, cortex_name):
+        """
+        Returns whether a modality holds `max_pending` samples in open windows while another active modality holds the
+        windows back. The modality that holds them back is never over capacity, consuming it is what closes them.
+        """
+        if self.qty_pending[cortex_name] < self.max_pending:
+            return False
+        event_time = self.newest_event_times[cortex_name]
+        return any(
+            other_time is None or other_time < event_time
+            for other_name, other_time in self._active_event_times().items() if other_name != cortex_name
+        )
+
+    def _watermark(self):
+        """
+        Returns the event time up to which every modality that is not idle was consumed, None if an active modality did
+        not send anything yet.
+        """
+        event_times = list(self._active_event_times().values())
+        if None in event_times:
+            # An active modality did not send anything yet
+            return None
+        if not event_times:
+            event_times = [event_time for event_time in self.newest_event_times.values() if event_time is not None]
+        return min(event_times) - self.lateness
+
+    def _send_windows(self, flush=False):
+        """
+        Sends the windows that can no longer receive samples to the brain, oldest first.
+
+        :param flush: If True, every pending window is sent.
+        """
+        if not self.pending:
+            return
+
+        watermark = None if flush else self._watermark()
+        if not flush and watermark is None:
+            return
+
+        for window_idx in sorted(self.pending):
+            if not flush and (window_idx + 1) * self.window > watermark:
+                break
+
+            events = self.pending.pop(window_idx)
+            for event_time, cortex_name, data in events:
+                self.qty_pending[cortex_name] -= 1
+            self._send_window(sorted(events, key=lambda event: event[0]))
+            self.last_sent_window = window_idx
+            self.windows_sent.set()
+
+    def _send_window(self, events):
+        """
+        Sends the samples of one window to the brain. A cortex receives at most one sample per timestep, so a window
+        with several samples of the same modality is sent over several timesteps, in event-time order.
+
+        :param events: A list of (event_time, cortex_name, data) tuples, in event-time order.
+        """
+        steps = []
+        for event in events:
+            if not steps or any(cortex_name == event[1] for _, cortex_name, _ in steps[-1]):
+                steps.append([])
+            steps[-1].append(event)
+
+        brain = self.brain
+        for step in steps:
+            brain.increment_timestep()
+            for event_time, cortex_name, data in step:
+                brain.receive_sensory_input(brain.get_cortex(cortex_name), data, learn=self.learn)
+
+            if self.maintenance and self.learn:
+                brain.cleanup()
+                brain.build_nrnd_indexes()
+                brain.create_new_nodes()
+
+        self.qty_windows += 1
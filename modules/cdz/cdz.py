@@ -1,9 +1,10 @@
-from collections import deque
+from collections import defaultdict, deque
+import math
 
-from scipy import signal
+from scipy import signal, sparse
 import numpy as np
 
-from cdzproject import config
+from cdzproject import config, db
 from cdzproject.modules.shared_components.data_packet import DataPacket
 from cdzproject.modules.cdz.cluster_correlation import ClusterCorrelation
 
@@ -40,6 +41,9 @@ class CDZ(object):
         # A dictionary to store the connections/correlations between different modalities.
         self.correlations = {}
 
+        # The (node, cluster, amount, encoding) of the feedback not applied yet, with config.CE_DEFER_FEEDBACK
+        self.feedback_buffer = []
+
     def receive_packet(self, packet, learn=True):
         """
         Accepts a single packet from a cortex cluster and updates the correlations between that cluster and
@@ -52,6 +56,8 @@ class CDZ(object):
         :param packet: The incoming packet.
         :param learn: Whether to update correlations (default: True).
         """
+        # Older packets within the temporal window, correlated with this packet in one batch below.
+        window_packets = []
         for q_packet in self.packet_queue:
             # Check to see if the packet is within the specified temporal window... i.e., not expired.
             if (packet.time - q_packet.time) >= config.CE_CORRELATION_WINDOW_MAX:
@@ -65,6 +71,12 @@ class CDZ(object):
 
                     self._send_feedback_packet(q_packet)
                     self._send_feedback_packet(packet)
+                elif packet.time != q_packet.time:
+                    window_packets.append(q_packet)
+
+        # With CE_IGNORE_GAUSSIAN the weights of older packets are all zero, so there is nothing to update.
+        if learn and window_packets and not config.CE_IGNORE_GAUSSIAN:
+            self._update_window_connections(window_packets, packet)
 
         # Process this packet so it gets the brain to output something.
         self._process_output(packet)
@@ -103,9 +115,45 @@ class CDZ(object):
         certainty_factor = packet.source_node.certainty() * cdz_connection.certainty()
         strength = (1 + certainty_factor) ** 2
 
+        if config.CE_DEFER_FEEDBACK:
+            # What `Cluster.receive_feedback_packet` and `Node.receive_feedback_packet` would do, applied later by
+            # `apply_feedback`
+            cluster.last_feedback_packet = cluster.cortex.timestep
+            node = cluster.node_manager.last_fired_node
+            self.feedback_buffer.append(
+                (node, cluster, strength * config.NODE_TO_CLUSTER_LEARNING_RATE, node.last_encoding)
+            )
+            return
+
         feedback_packet = DataPacket(cluster, strength, packet.time, packet.source_node)
         cluster.receive_feedback_packet(feedback_packet)
 
+    def apply_feedback(self):
+        """
+        Applies the buffered feedback (see config.CE_DEFER_FEEDBACK) to the nodes, one grouped update per cortex.
+        Feedback for nodes or clusters that were deleted in the meantime is dropped.
+        """
+        if not self.feedback_buffer:
+            return
+
+        updates_per_cortex = defaultdict(list)
+        for update in self.feedback_buffer:
+            node, cluster = update[0], update[1]
+            if node.name in db.nodes.data and cluster.name in db.clusters.data:
+                updates_per_cortex[node.cortex.name].append(update)
+        self.feedback_buffer = []
+
+        for updates in updates_per_cortex.values():
+            nodes, clusters, amounts, encodings = zip(*updates)
+            # Grouping a single update costs more than applying it
+            if len(updates) == 1:
+                db.adjust_node_to_cluster_strength(*updates[0])
+            else:
+                db.adjust_node_to_cluster_strengths(nodes, clusters, amounts, encodings)
+
+            store = nodes[0].store
+            np.add.at(store.qty_feedback_packets, store.rows(nodes), 1)
+
     def _update_connection(self, old_packet, new_packet):
         """
         Updates the connection between two packets.
@@ -117,18 +165,68 @@ class CDZ(object):
         if new_packet.cortex == old_packet.cortex:
             return
 
-        if not self.correlations.get(old_packet.cluster.name):
-            self.correlations[old_packet.cluster.name] = ClusterCorrelation(old_packet.cluster, self)
-
-        # We do this so that we can add the reference.
-        if not self.correlations.get(new_packet.cluster.name):
-            self.correlations[new_packet.cluster.name] = ClusterCorrelation(new_packet.cluster, self)
+        # We also get the new packet's correlation so that we can add the reference.
+        old_correlation = self._get_correlation(old_packet.cluster)
+        new_correlation = self._get_correlation(new_packet.cluster)
 
         # Update the connections.
-        self.correlations[old_packet.cluster.name].update(old_packet, new_packet)
+        old_correlation.update(old_packet, new_packet)
 
         # Add the reference (won't add if it already exists).
-        self.correlations[new_packet.cluster.name].add_ref(old_packet.cluster)
+        new_correlation.add_ref(old_packet.cluster)
+
+    def _update_window_connections(self, old_packets, new_packet):
+        """
+        Updates the connections from the clusters of older packets in the temporal window to the cluster of a new
+        packet, weighted by the Gaussian of their time difference.
+
+        This gives the same connections as calling `_update_connection` for every older packet, but every correlation
+        is updated and normalized only once. All the updates of a correlation go to the connection to the new packet's
+        cluster, and the connections sum to one before each of them. Adding u1, ..., uk one at a time, each followed by
+        a normalization, is therefore the same as adding (1 + u1) * ... * (1 + uk) - 1 once and normalizing once.
+
+        :param old_packets: The older packets in the temporal window.
+        :param new_packet: The newer packet.
+        """
+        # Don't correlate the cortex to itself.
+        old_packets = [q_packet for q_packet in old_packets if q_packet.cortex != new_packet.cortex]
+        if not old_packets:
+            return
+
+        time_diffs = np.array([new_packet.time - q_packet.time for q_packet in old_packets])
+        strengths = np.array([q_packet.strength for q_packet in old_packets])
+        assert np.all(time_diffs >= 0)
+        assert max(strengths.max(), new_packet.strength) <= 1
+
+        correlation_updates = self.LEARNING_RATE * self.GAUSSIAN[time_diffs] * strengths * new_packet.strength
+
+        # Combine the updates of packets that come from the same cluster, as the log of (1 + u1) * ... * (1 + uk).
+        clusters = {}
+        cluster_log_factors = defaultdict(float)
+        qty_updates = defaultdict(int)
+        for q_packet, log_factor in zip(old_packets, np.log1p(correlation_updates).tolist()):
+            clusters[q_packet.cluster.name] = q_packet.cluster
+            cluster_log_factors[q_packet.cluster.name] += log_factor
+            qty_updates[q_packet.cluster.name] += 1
+
+        new_correlation = self._get_correlation(new_packet.cluster)
+        for cluster_name, cluster in clusters.items():
+            self._get_correlation(cluster).add(
+                new_packet.cluster, math.expm1(cluster_log_factors[cluster_name]),
+                qty_updates=qty_updates[cluster_name]
+            )
+            new_correlation.add_ref(cluster)
+
+    def _get_correlation(self, cluster):
+        """
+        Returns the correlation of a cluster, creating it if it does not exist yet.
+
+        :param cluster: The cluster.
+        :return: The ClusterCorrelation of the cluster.
+        """
+        if not self.correlations.get(cluster.name):
+            self.correlations[cluster.name] = ClusterCorrelation(cluster, self)
+        return self.correlations[cluster.name]
 
     def remove_cluster(self, cluster):
         """
@@ -151,4 +249,104 @@ class CDZ(object):
             for excited_by_c in excited_by[:]:
                 self.correlations[excited_by_c.name].remove_cluster(cluster)
 
-            del self.correlations[cluster.name]
\ No newline at end of file
+            del self.correlations[cluster.name]
+
+    def remove_connection(self, cluster, connected_cluster):
+        """
+        Removes the connection from a cluster to a cluster of another modality. Both clusters stay in the CDZ.
+
+        :param cluster: The cluster whose connection is removed.
+        :param connected_cluster: The cluster it is connected to.
+        """
+        self.correlations[cluster.name].remove_cluster(connected_cluster)
+        self.correlations[connected_cluster.name].ref_clusters.remove(cluster)
+
+    def merge_cluster(self, cluster, into):
+        """
+        Merges the correlation of a cluster into the correlation of another cluster of the same cortex and removes the
+        cluster from the CDZ. The connections of both are averaged, weighted by their ages, and the clusters of the
+        other modalities, the queued packets and the buffered feedback refer to `into` instead.
+
+        :param cluster: The cluster to remove.
+        :param into: The cluster that absorbs its correlation.
+        """
+        correlation = self.correlations.pop(cluster.name, None)
+        if correlation is not None:
+            into_correlation = self._get_correlation(into)
+            age = correlation.age + into_correlation.age
+            for cluster_name in set(correlation.connections) | set(into_correlation.connections):
+                into_correlation.connections[cluster_name] = (
+                    correlation.age * correlation.connections.get(cluster_name, 0) +
+                    into_correlation.age * into_correlation.connections.get(cluster_name, 0)
+                ) / age
+            into_correlation._normalize()
+            into_correlation.age = age
+            into_correlation.cluster_objects.update(correlation.cluster_objects)
+
+            # The clusters it excites are now excited by `into`
+            for cluster_name in correlation.cluster_objects:
+                self.correlations[cluster_name].ref_clusters.remove(cluster)
+                self.correlations[cluster_name].add_ref(into)
+
+            # The clusters that excite it now excite `into`
+            for ref_cluster in correlation.ref_clusters:
+                ref_correlation = self.correlations[ref_cluster.name]
+                ref_correlation.connections[into.name] += ref_correlation.connections.pop(cluster.name)
+                del ref_correlation.cluster_objects[cluster.name]
+                ref_correlation.cluster_objects[into.name] = into
+                into_correlation.add_ref(ref_cluster)
+
+        for packet in self.packet_queue:
+            if packet.cluster is cluster:
+                packet.cluster = into
+        self.feedback_buffer = [
+            (node, into if feedback_cluster is cluster else feedback_cluster, amount, encoding)
+            for node, feedback_cluster, amount, encoding in self.feedback_buffer
+        ]
+
+    def find_duplicate_clusters(self, clusters, min_similarity=config.CE_COMPACTION_MIN_SIMILARITY,
+                                min_age=config.CE_COMPACTION_MIN_AGE):
+        """
+        Finds the clusters whose connections are near-identical to the connections of an older cluster. The
+        connections of all the clusters are compared at once, as the cosine similarities of a sparse matrix. Every
+        cluster is paired with the oldest similar cluster that is not merged itself, so merges are never chained.
+
+        :param clusters: The clusters to compare, usually all the clusters of a cortex.
+        :param min_similarity: The minimum cosine similarity between the connections of two clusters.
+        :param min_age: The minimum age of the correlation of a cluster to be compared.
+        :return: A list of (cluster, cluster to merge it into) tuples.
+        """
+        correlations = [
+            self.correlations[cluster.name] for cluster in clusters
+            if cluster.name in self.correlations and self.correlations[cluster.name].age >= min_age and
+            self.correlations[cluster.name].connections
+        ]
+        if len(correlations) < 2:
+            return []
+
+        # The oldest cluster of a group of duplicates absorbs the others
+        correlations.sort(key=lambda correlation: -correlation.age)
+        columns = {}
+        rows, cols, values = [], [], []
+        for row, correlation in enumerate(correlations):
+            for cluster_name, strength in correlation.connections.items():
+                rows.append(row)
+                cols.append(columns.setdefault(cluster_name, len(columns)))
+                values.append(strength)
+
+        profiles = sparse.csr_matrix((values, (rows, cols)), shape=(len(correlations), len(columns)))
+        norms = np.sqrt(np.asarray(profiles.multiply(profiles).sum(axis=1)).ravel())
+        profiles = sparse.diags(1 / np.maximum(norms, 1e-12)) @ profiles
+        similarities = (profiles @ profiles.T).tocsr()
+
+        merged = set()
+        duplicates = []
+        for row, correlation in enumerate(correlations):
+            if row in merged:
+                continue
+            start, end = similarities.indptr[row], similarities.indptr[row + 1]
+            for other_row, similarity in zip(similarities.indices[start:end], similarities.data[start:end]):
+                if other_row > row and other_row not in merged and similarity >= min_similarity:
+                    merged.add(other_row)
+                    duplicates.append((correlations[other_row].cluster, correlation.cluster))
+        return duplicates
@@ -42,12 +42,22 @@ class ClusterCorrelation(object):
 
         # Increase the connection strength between the new packet and the existing (remaining)
         # packets in proportion to their Gaussian overlap and their classification certainty.
-        self.connections[new_packet.cluster.name] += correlation_update
+        self.add(new_packet.cluster, correlation_update)
+
+    def add(self, cluster, correlation_update, qty_updates=1):
+        """
+        Increases the connection strength to a cluster and normalizes the connections.
+
+        :param cluster: The cluster to strengthen the connection to.
+        :param correlation_update: The amount to add to the connection strength.
+        :param qty_updates: The number of packet updates summed into `correlation_update`. The age grows by this much.
+        """
+        self.connections[cluster.name] += correlation_update
         self._normalize()
-        self.age += 1
+        self.age += qty_updates
 
         # Store a reference to the cluster object
-        self.cluster_objects[new_packet.cluster.name] = new_packet.cluster
+        self.cluster_objects[cluster.name] = cluster
 
     def _normalize(self, dict_to_normalize=None):
         """
@@ -9,8 +9,13 @@ class Cluster(object):
     """
     Represents a cluster within a cortex. Clusters are responsible for managing relationships with nodes,
     sending packets to the CDZ, and handling feedback packets.
+
+    The state of a cluster is stored in a row of its cortex's `ClusterStore`; a Cluster is a light handle to that row.
+    A cluster must not be used after it is deleted from the database, its row is reused by new clusters.
     """
 
+    __slots__ = ('name', 'cortex', 'store', 'row')
+
     def __init__(self, cortex, name, required_utilization=config.CLUSTER_REQUIRED_UTILIZATION):
         """
         Initializes a Cluster instance.
@@ -21,10 +26,50 @@ class Cluster(object):
         """
         self.name = utils.name_generator(cortex, name)
         self.cortex = cortex
-        self.created_at = self.cortex.timestep
-        self.last_fired = None
-        self.last_feedback_packet = None
-        self.REQUIRED_UTILIZATION = required_utilization
+        self.store = cortex.cluster_store
+        self.row = self.store.allocate(self, self.cortex.timestep, required_utilization)
+
+    @property
+    def created_at(self):
+        """
+        The timestep the cluster was created at.
+        """
+        return int(self.store.created_at[self.row])
+
+    @created_at.setter
+    def created_at(self, timestep):
+        self.store.created_at[self.row] = timestep
+
+    @property
+    def last_fired(self):
+        """
+        The last timestep the cluster fired, None if it never did.
+        """
+        timestep = int(self.store.last_fired[self.row])
+        return timestep if timestep >= 0 else None
+
+    @last_fired.setter
+    def last_fired(self, timestep):
+        self.store.last_fired[self.row] = timestep if timestep is not None else -1
+
+    @property
+    def last_feedback_packet(self):
+        """
+        The last timestep the cluster received a feedback packet, None if it never did.
+        """
+        timestep = int(self.store.last_feedback_packet[self.row])
+        return timestep if timestep >= 0 else None
+
+    @last_feedback_packet.setter
+    def last_feedback_packet(self, timestep):
+        self.store.last_feedback_packet[self.row] = timestep if timestep is not None else -1
+
+    @property
+    def REQUIRED_UTILIZATION(self):
+        """
+        The minimum utilization required before the cluster is considered underutilized.
+        """
+        return float(self.store.required_utilization[self.row])
 
     @property
     def age(self):
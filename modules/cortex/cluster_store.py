@@ -0,0 +1,75 @@
+import numpy as np
+
+from cdzproject.modules.shared_components.column_store import ColumnStore
+
+
+class ClusterStore(ColumnStore):
+    """
+    The state of the clusters of a cortex, one row per cluster (see `Cluster`):
+        - created_at: the timestep the cluster was created at, -1 for free rows.
+        - last_fired, last_feedback_packet: timesteps, -1 if it never happened.
+        - required_utilization: the number of timesteps after which an unused cluster is underutilized.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty ClusterStore instance.
+        """
+        super(ClusterStore, self).__init__()
+        self.add_column('created_at', np.int64, fill=-1)
+        self.add_column('last_fired', np.int64, fill=-1)
+        self.add_column('last_feedback_packet', np.int64, fill=-1)
+        self.add_column('required_utilization', np.float64, fill=np.inf)
+
+        # The cluster of every row, None for free rows
+        self.clusters = []
+
+    def allocate(self, cluster, created_at, required_utilization):
+        """
+        Stores a new cluster.
+
+        :param cluster: The cluster.
+        :param created_at: The timestep the cluster is created at.
+        :param required_utilization: The utilization required before the cluster is considered underutilized.
+        :return: The index of the cluster's row.
+        """
+        row = super(ClusterStore, self).allocate()
+        self.created_at[row] = created_at
+        self.required_utilization[row] = required_utilization
+
+        if row == len(self.clusters):
+            self.clusters.append(cluster)
+        else:
+            self.clusters[row] = cluster
+        return row
+
+    def release(self, row):
+        """
+        Frees the row of a deleted cluster so that it can be reused.
+
+        :param row: The index of the row.
+        """
+        super(ClusterStore, self).release(row)
+        self.clusters[row] = None
+
+    def merge(self, row, into_row):
+        """
+        Combines the timesteps of a row into another row: the earliest creation and the latest firing and feedback.
+
+        :param row: The index of the row of the merged cluster.
+        :param into_row: The index of the row of the cluster it is merged into.
+        """
+        self.created_at[into_row] = min(self.created_at[row], self.created_at[into_row])
+        self.last_fired[into_row] = max(self.last_fired[row], self.last_fired[into_row])
+        self.last_feedback_packet[into_row] = max(self.last_feedback_packet[row], self.last_feedback_packet[into_row])
+
+    def get_underutilized(self, timestep):
+        """
+        Returns the clusters that are underutilized. This is `Cluster.is_underutilized` for all the clusters at once.
+
+        :param timestep: The current timestep.
+        :return: A list of clusters.
+        """
+        time_to_use = np.maximum(self.created_at, np.maximum(self.last_fired, self.last_feedback_packet))
+        rows = np.flatnonzero((self.created_at >= 0) & (timestep - time_to_use >= self.required_utilization))
+        return [self.clusters[row] for row in rows]
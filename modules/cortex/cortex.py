@@ -1,4 +1,5 @@
 from cdzproject.modules.cortex.node_manager import NodeManager
+from cdzproject.modules.cortex.cluster_store import ClusterStore
 from cdzproject import db
 
 
@@ -19,6 +20,8 @@ class Cortex(object):
         self.autoencoder = autoencoder
         self.brain = brain
 
+        # The state of the clusters, see `Cluster`
+        self.cluster_store = ClusterStore()
         self.node_manager = NodeManager(self)
         db.node_manager_to_nodes.add(self.node_manager, [], [])
 
@@ -63,6 +66,15 @@ class Cortex(object):
         """
         self.node_manager.cleanup(delete_new_items=delete_new_items)
 
+    def seed_nodes(self, encodings, **kwargs):
+        """
+        Creates the initial nodes at once from a block of encodings. See `NodeManager.seed_nodes`.
+
+        :param encodings: A 2D array of encodings, or a finite iterable of encodings.
+        :return: The new nodes.
+        """
+        return self.node_manager.seed_nodes(encodings, **kwargs)
+
     def create_new_nodes(self):
         """
         Creates new nodes if needed.
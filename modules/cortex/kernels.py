@@ -0,0 +1,196 @@
+"""
+The kernels of the per-step hot path, over the columns of a `NodeStore`:
+    - nearest: the nearest node to an encoding, by brute force.
+    - learn: moves a node towards an encoding, with momentum (see `Node.learn`).
+
+Every kernel has a NumPy implementation and a loop implementation. When Numba is installed (see
+`config.KERNELS_BACKEND`), the loop implementations are compiled on first use and the compiled code is cached on disk,
+so later runs start without compiling. Otherwise the NumPy implementations are used.
+
+`verify()` checks that all the implementations agree with the pure-Python path of `Node`:
+    $ python -m cdzproject.modules.cortex.kernels
+"""
+
+import os
+import time
+
+import numpy as np
+
+from cdzproject import config
+
+if config.KERNELS_CACHE_DIR:
+    os.environ.setdefault('NUMBA_CACHE_DIR', config.KERNELS_CACHE_DIR)
+
+if config.KERNELS_BACKEND == 'numba':
+    import numba
+elif config.KERNELS_BACKEND == 'auto':
+    try:
+        import numba
+    except ImportError:
+        numba = None
+else:
+    numba = None
+
+BACKEND = 'numba' if numba is not None else 'numpy'
+
+
+def _nearest_numpy(positions, rows, encoding):
+    distances = np.linalg.norm(positions[rows] - encoding, axis=1)
+    idx = int(np.argmin(distances))
+    return idx, distances[idx]
+
+
+def _nearest_loops(positions, rows, encoding):
+    nearest_idx = -1
+    nearest_distance = np.inf
+    for idx in range(rows.shape[0]):
+        row = rows[idx]
+        distance = 0.0
+        for dim in range(encoding.shape[0]):
+            diff = positions[row, dim] - encoding[dim]
+            distance += diff * diff
+        if distance < nearest_distance:
+            nearest_idx = idx
+            nearest_distance = distance
+    return nearest_idx, np.sqrt(nearest_distance)
+
+
+def _learn_numpy(positions, momenta, row, encoding, learning_rate, momentum_alpha, momentum_decay):
+    direction = encoding - positions[row]
+    positions[row] += learning_rate * (direction + momentum_alpha * momenta[row])
+    momenta[row] = momentum_decay * momenta[row] + learning_rate * direction
+
+
+def _learn_loops(positions, momenta, row, encoding, learning_rate, momentum_alpha, momentum_decay):
+    for dim in range(encoding.shape[0]):
+        direction = encoding[dim] - positions[row, dim]
+        positions[row, dim] += learning_rate * (direction + momentum_alpha * momenta[row, dim])
+        momenta[row, dim] = momentum_decay * momenta[row, dim] + learning_rate * direction
+
+
+if numba is not None:
+    _nearest = numba.njit(cache=True)(_nearest_loops)
+    _learn = numba.njit(cache=True)(_learn_loops)
+else:
+    _nearest = _nearest_numpy
+    _learn = _learn_numpy
+
+
+def nearest(positions, rows, encoding):
+    """
+    Finds the nearest of the given rows to an encoding.
+
+    :param positions: The positions column of a NodeStore.
+    :param rows: An array of the rows to search.
+    :param encoding: The encoding.
+    :return: A tuple (index in `rows` of the nearest row, euclidean distance).
+    """
+    return _nearest(positions, rows, encoding)
+
+
+def learn(positions, momenta, row, encoding, learning_rate=config.NODE_POSITION_LEARNING_RATE,
+          momentum_alpha=config.NODE_POSITION_MOMENTUM_ALPHA, momentum_decay=config.NODE_POSITION_MOMENTUM_DECAY):
+    """
+    Moves the position of a row towards an encoding, in place. The position moves with the momentum from before the
+    update, then the momentum is updated.
+
+    :param positions: The positions column of a NodeStore.
+    :param momenta: The momenta column of a NodeStore.
+    :param row: The row of the node.
+    :param encoding: The encoding to move towards.
+    :param learning_rate: The learning rate of the position.
+    :param momentum_alpha: How much of the momentum is added to the move.
+    :param momentum_decay: The decay of the momentum.
+    """
+    _learn(positions, momenta, row, encoding, learning_rate, momentum_alpha, momentum_decay)
+
+
+def verify(num_nodes=500, dims=(1, 8, 64), num_steps=200, dtypes=(np.float32, np.float64), seed=0):
+    """
+    Checks that the kernels of every backend give the same results as the pure-Python path of `Node`, run on the
+    nodes of a real `NodeStore`: `Node.get_distance` for the nearest node and `Node._move_in_direction` for learning.
+    Raises an AssertionError otherwise.
+
+    :param num_nodes: The number of positions.
+    :param dims: The numbers of dimensions to check.
+    :param num_steps: The number of learning steps to check.
+    :param dtypes: The dtypes of the positions to check.
+    :param seed: The random seed.
+    :return: A dictionary with the time per call of every implementation, in microseconds.
+    """
+    # Imported here, the cortex modules import this module
+    from cdzproject import db
+    from cdzproject.modules.cortex.cortex import Cortex
+    from cdzproject.modules.cortex.node import Node
+
+    implementations = {
+        'numpy': (_nearest_numpy, _learn_numpy),
+        'loops': (_nearest_loops, _learn_loops),
+    }
+    if numba is not None:
+        implementations['numba'] = (_nearest, _learn)
+
+    rng = np.random.RandomState(seed)
+    timings = {}
+    for dtype in dtypes:
+        for num_dims in dims:
+            positions = rng.uniform(size=(num_nodes, num_dims)).astype(dtype)
+            rows = rng.permutation(num_nodes)[:num_nodes // 2].astype(np.intp)
+            encodings = rng.uniform(size=(num_steps, num_dims)).astype(dtype)
+            tolerance = 1e-4 if dtype == np.float32 else 1e-10
+
+            # The pure-Python path, on the nodes of a cortex that is not part of any brain
+            cortex = Cortex(None, 'verify', None)
+            try:
+                store = cortex.node_manager.store
+                nodes = [
+                    Node(cortex, None, name='verify_%d' % row, row=row)
+                    for row in store.allocate_many(positions, created_at=0)
+                ]
+                assert store.positions.dtype == dtype
+
+                expected_nearest = []
+                for encoding in encodings:
+                    distances = [nodes[row].get_distance(encoding)[0] for row in rows]
+                    expected_nearest.append((int(np.argmin(distances)), min(distances)))
+
+                node = nodes[rows[0]]
+                for encoding in encodings:
+                    node._move_in_direction(encoding - node.position)
+                expected_positions = store.positions[:num_nodes].copy()
+            finally:
+                db.node_manager_to_nodes.remove(cortex.node_manager)
+
+            for name, (nearest_kernel, learn_kernel) in implementations.items():
+                start = time.perf_counter()
+                for encoding, (expected_idx, expected_distance) in zip(encodings, expected_nearest):
+                    idx, distance = nearest_kernel(positions, rows, encoding)
+                    assert idx == expected_idx, (name, 'nearest', dtype, num_dims)
+                    assert abs(distance - expected_distance) <= tolerance * max(expected_distance, 1), name
+                nearest_us = (time.perf_counter() - start) / num_steps * 1e6
+
+                kernel_positions = positions.copy()
+                momenta = np.zeros_like(positions)
+                start = time.perf_counter()
+                for encoding in encodings:
+                    learn_kernel(
+                        kernel_positions, momenta, rows[0], encoding, config.NODE_POSITION_LEARNING_RATE,
+                        config.NODE_POSITION_MOMENTUM_ALPHA, config.NODE_POSITION_MOMENTUM_DECAY
+                    )
+                learn_us = (time.perf_counter() - start) / num_steps * 1e6
+                assert np.allclose(kernel_positions, expected_positions, rtol=tolerance, atol=tolerance), (
+                    name, 'learn', dtype, num_dims
+                )
+
+                timings[(name, np.dtype(dtype).name, num_dims)] = {'nearest_us': nearest_us, 'learn_us': learn_us}
+
+    return timings
+
+
+if __name__ == '__main__':
+    print('Backend:', BACKEND)
+    for (name, dtype, num_dims), timing in sorted(verify().items()):
+        print('{0:>6} {1:>8} dims={2:<3} nearest {3:9.1f}us  learn {4:7.1f}us'.format(
+            name, dtype, num_dims, timing['nearest_us'], timing['learn_us']
+        ))
+    print('All implementations agree with the pure-Python path.')
@@ -1,31 +1,92 @@
 import numpy as np
 from cdzproject.utils import utils
 from cdzproject import db, config
+from cdzproject.modules.cortex import kernels
 
 
 class Node(object):
     """
     Represents a node similar to a Growing Neural Gas (GNG) node.
+
+    The state of a node is stored in a row of its cortex's `NodeStore`; a Node is a light handle to that row. A node
+    must not be used after it is deleted from the database, its row is reused by new nodes.
     """
 
-    def __init__(self, cortex, initial_position, name=None):
+    __slots__ = ('name', 'cortex', 'store', 'row', 'last_encoding')
+
+    def __init__(self, cortex, initial_position, name=None, row=None):
         """
         Initializes a Node instance.
 
         :param cortex: The cortex this node belongs to.
-        :param initial_position: The initial position of the node in the feature space.
+        :param initial_position: The initial position of the node in the feature space. It is copied into the store.
         :param name: The name of the node (optional).
+        :param row: A row of the node store that already holds the state of this node (see `NodeStore.allocate_many`).
+                    `initial_position` is ignored if it is given.
         """
         self.name = utils.name_generator(cortex, name)
         self.cortex = cortex
-        self.created_at = self.cortex.timestep
-
-        self.position = initial_position
-        self.position_momentum = 0
-        self.qty_feedback_packets = 0  # Also equivalent to the number of times it fired (for now)
-        self.last_utilized = None
+        self.store = cortex.node_manager.store
+        self.row = row if row is not None else self.store.allocate(initial_position, self.cortex.timestep)
         self.last_encoding = None  # The last encoding this node received
 
+    @property
+    def position(self):
+        """
+        The position of the node in the feature space. This is a view of the store, changing it in place moves the
+        node.
+        """
+        return self.store.positions[self.row]
+
+    @position.setter
+    def position(self, position):
+        self.store.positions[self.row] = position
+
+    @property
+    def position_momentum(self):
+        """
+        The momentum of the node's position.
+        """
+        return self.store.momenta[self.row]
+
+    @position_momentum.setter
+    def position_momentum(self, momentum):
+        self.store.momenta[self.row] = momentum
+
+    @property
+    def created_at(self):
+        """
+        The timestep the node was created at.
+        """
+        return int(self.store.created_at[self.row])
+
+    @created_at.setter
+    def created_at(self, timestep):
+        self.store.created_at[self.row] = timestep
+
+    @property
+    def last_utilized(self):
+        """
+        The last timestep the node learned, None if it never did.
+        """
+        timestep = int(self.store.last_utilized[self.row])
+        return timestep if timestep >= 0 else None
+
+    @last_utilized.setter
+    def last_utilized(self, timestep):
+        self.store.last_utilized[self.row] = timestep if timestep is not None else -1
+
+    @property
+    def qty_feedback_packets(self):
+        """
+        The number of feedback packets the node received. Also equivalent to the number of times it fired (for now).
+        """
+        return int(self.store.qty_feedback_packets[self.row])
+
+    @qty_feedback_packets.setter
+    def qty_feedback_packets(self, qty):
+        self.store.qty_feedback_packets[self.row] = qty
+
     @property
     def age(self):
         """
@@ -67,10 +128,14 @@ class Node(object):
         """
         Moves the node in the direction of the passed position.
 
+        This is `_move_in_direction(position - self.position)`, computed by `kernels.learn` on the node store.
+
         :param position: The target position to move towards.
         """
-        error, distance_vector = self.get_distance(position)
-        self._move_in_direction(-1 * distance_vector)
+        kernels.learn(
+            self.store.positions, self.store.momenta, self.row, position, config.NODE_POSITION_LEARNING_RATE,
+            config.NODE_POSITION_MOMENTUM_ALPHA, config.NODE_POSITION_MOMENTUM_DECAY
+        )
         self.last_utilized = self.cortex.timestep
 
     def _move_in_direction(self, direction):
@@ -167,4 +232,5 @@ class Node(object):
         :return: The strongest cluster.
         """
         clusters, strengths = db.get_nodes_clusters(self, include_strengths=True)
-        return clusters[np.argmax(strengths)]
\ No newline at end of file
+        # The first maximum, like np.argmax, without converting the short list to an array
+        return clusters[strengths.index(max(strengths))]
\ No newline at end of file
@@ -1,8 +1,15 @@
+import math
+
+import numpy as np
 from annoy import AnnoyIndex
+from scipy.spatial import cKDTree
 
 from cdzproject.modules.cortex.node import Node
+from cdzproject.modules.cortex.node_store import NodeStore
+from cdzproject.modules.cortex.partitions import NodePartitions
+from cdzproject.modules.cortex import kernels, seeding
 from cdzproject import db, config
-from cdzproject.utils import utils
+from cdzproject.utils import utils, event_log
 from cdzproject.modules.cortex.cluster import Cluster
 
 
@@ -31,7 +38,16 @@ class NodeManager(object):
         self.name = utils.name_generator(cortex, name)
         self.last_fired_node = None
         self.finished_initial = False
+        # The state of the nodes, see `Node`
+        self.store = NodeStore()
         self.nn_index = None
+        # The nodes of the index, by item id
+        self.nn_index_nodes = []
+        # The nodes added since the index was built (searched by brute force) and the qty of indexed nodes removed since
+        self.nn_pending_nodes = []
+        self.nn_qty_removed = 0
+        # The coarse-to-fine index used instead of the Annoy index with config.NRND_PARTITIONS
+        self.partitions = None
 
         self.avg_distance = 0
         self.distance_count = 0
@@ -46,31 +62,82 @@ class NodeManager(object):
         """
         return db.get_node_managers_nodes(self)
 
-    def build_nrnd_index(self):
+    def build_nrnd_index(self, force=False):
         """
         Builds/rebuilds an index for finding the nearest nodes. This improves performance.
+        With config.NRND_PARTITIONS the partitions are built once and then refreshed (see `NodePartitions.refresh`).
+
+        :param force: Whether to build the index even if the nodes have not settled yet (default: False).
         """
         if config.NRND_OPTIMIZER_ENABLED:
             if (
-                self.nn_index
+                force
+                or self.nn_index
+                or self.partitions is not None
                 or (
                     self.finished_initial
                     and abs(self.avg_distance_momentum) < config.NRND_MAX_AVG_DISTANCE_MOMENTUM
                     and self.distance_count > 1000
                 )
             ):
-                print("Building nearest node index...")
+                if config.NRND_PARTITIONS:
+                    self._build_partitions()
+                    return
+
+                if config.LOG_TOPOLOGY_TO_STDOUT:
+                    print("Building nearest node index...")
+                event_log.emit(
+                    event_log.INDEX_REBUILT, self.cortex.timestep, self.cortex.name, subject_id=len(self.nodes)
+                )
                 dimensions = len(self.nodes[0].position)
                 self.nn_index = AnnoyIndex(dimensions, metric="euclidean")
+                self.nn_index_nodes = list(self.nodes)
+                self.nn_pending_nodes = []
+                self.nn_qty_removed = 0
 
                 idx = 0
-                for node in self.nodes:
+                for node in self.nn_index_nodes:
                     assert node.position is not None
                     self.nn_index.add_item(idx, node.position)
                     idx += 1
 
                 self.nn_index.build(config.NRND_N_TREES)
 
+    def _build_partitions(self):
+        """
+        Builds the partitions of the coarse-to-fine index once there are enough nodes for the codebook and refreshes
+        them afterwards. The codebook is built again whenever the number of nodes doubled, so that the partitions
+        follow the growth of the nodes, at an amortized cost.
+        """
+        nodes = self.nodes
+        if self.partitions is not None and len(nodes) < 2 * self.partitions.qty_nodes_built:
+            self.partitions.refresh()
+            return
+
+        if len(nodes) < config.NRND_PARTITIONS:
+            return
+
+        if config.LOG_TOPOLOGY_TO_STDOUT:
+            print("Building node partitions...")
+        event_log.emit(event_log.INDEX_REBUILT, self.cortex.timestep, self.cortex.name, subject_id=len(nodes))
+        self.partitions = NodePartitions(
+            self.store, config.NRND_PARTITIONS, config.NRND_PARTITION_PROBES, config.NRND_PARTITION_LEARNING_RATE
+        )
+        self.partitions.build(list(nodes))
+
+    def _index_new_nodes(self, nodes):
+        """
+        Makes new nodes searchable until the next index build: they are searched by brute force next to the Annoy
+        index, or added to their partition.
+
+        :param nodes: The new nodes.
+        """
+        if self.nn_index:
+            self.nn_pending_nodes.extend(nodes)
+        if self.partitions is not None:
+            for node in nodes:
+                self.partitions.add(node)
+
     def _update_avg_distance(self, distance):
         """
         Keeps a moving average of node distances.
@@ -106,6 +173,8 @@ class NodeManager(object):
         if learn:
             nearest_node.learn(encoding)
             self._update_avg_distance(distance)
+            if self.partitions is not None:
+                self.partitions.learn(encoding)
 
         # Fire the cluster so that it sends a packet to the CDZ
         # POSSIBLE IMPROVEMENT: Strength can be a function of distance
@@ -156,39 +225,21 @@ class NodeManager(object):
     def create_new_nodes(self):
         """
         Creates new nodes in locations that have high variance.
+
+        Every eligible node (see `_split_candidates`) is split into a node at its position and a node at the mean
+        position of every cluster it received more than 3 feedback packets for, until the cortex has
+        `config.MAX_NODES` nodes or `config.NODE_SPLIT_MAX_QTY` nodes were added. The new nodes are searched by brute
+        force next to the nearest node index until it is rebuilt.
         """
         if len(self.nodes) >= config.MAX_NODES:
             return
 
+        qty_nodes = len(self.nodes)
         num_nodes_added = 0
 
-        # Sort the nodes in this cortex by their correlation variance
-        sorted_nodes = sorted(
-            self.nodes, key=(lambda node: node.correlation_variance()), reverse=True
-        )
-        assert sorted_nodes[0].correlation_variance() >= sorted_nodes[-1].correlation_variance()
-
-        def is_eligible(node):
-            """
-            Determines if a node is eligible for splitting:
-                - Not new.
-                - Not underutilized.
-                - Has high variance in its connections to clusters.
-
-            :param node: The node to check.
-            :return: True if the node is eligible, False otherwise.
-            """
-            has_high_variance = bool(
-                node.correlation_variance() > config.NODE_SPLIT_MAX_CORRELATION_VARIANCE
-            )
-            return has_high_variance and not node.is_new() and not node.is_underutilized()
-
-        # Loop through the nodes and create new ones nearby the ones that are ambiguous
-        for node in sorted_nodes:
-            if not is_eligible(node):
-                continue
-
-            # Get all the node's clusters
+        # Choose the nodes to split and the positions of their new nodes
+        splits = []
+        for node in self._split_candidates():
             clusters, strengths, positions, counts = db.get_nodes_clusters(
                 node, include_all=True
             )
@@ -196,26 +247,72 @@ class NodeManager(object):
             assert len(clusters) == len(strengths)
             assert len(clusters) == len(positions)
 
-            for idx, cluster in enumerate(clusters):
-                if counts[idx] > 3:
-                    new_position = positions[idx]
-                    new_node = Node(self.cortex, new_position)
-                    new_cluster = Cluster(self.cortex, "cluster_" + new_node.name)
-                    db.add_node(new_node, new_cluster)
-                    num_nodes_added += 1
+            new_positions = [positions[idx] for idx in range(len(clusters)) if counts[idx] > 3] + [node.position]
+            splits.append((node, new_positions))
+            num_nodes_added += len(new_positions) - 1
 
-            new_node = Node(self.cortex, node.position)
-            new_cluster = Cluster(self.cortex, "cluster_" + new_node.name)
-            db.add_node(new_node, new_cluster)
-            num_nodes_added += 1
+            if qty_nodes + num_nodes_added >= config.MAX_NODES or num_nodes_added >= config.NODE_SPLIT_MAX_QTY:
+                break
 
+        # Create the new nodes at once and remove the split ones
+        split_from = [node for node, new_positions in splits for _ in new_positions]
+        if not split_from:
+            return
+        rows = self.store.allocate_many(
+            np.array([new_position for node, new_positions in splits for new_position in new_positions]),
+            self.cortex.timestep
+        )
+        new_nodes = [Node(self.cortex, None, row=row) for row in rows]
+        new_clusters = [Cluster(self.cortex, "cluster_" + new_node.name) for new_node in new_nodes]
+        db.add_nodes(new_nodes, new_clusters, split_from=split_from)
+
+        for node, new_positions in splits:
             node.teardown()
-            num_nodes_added -= 1
 
-            if len(self.nodes) >= config.MAX_NODES or num_nodes_added >= config.NODE_SPLIT_MAX_QTY:
-                break
+        self._index_new_nodes(new_nodes)
+        if self.nn_index:
+            self.nn_qty_removed += len(splits)
 
-        self.build_nrnd_index()
+    def _split_candidates(self):
+        """
+        Yields the nodes eligible for splitting, by decreasing correlation variance. A node is eligible if it is not
+        new, not underutilized and its correlation variance is above `config.NODE_SPLIT_MAX_CORRELATION_VARIANCE`.
+
+        This is equivalent to `node.is_new()`, `node.is_underutilized()` and `node.correlation_variance()`. The first
+        two are computed for all the nodes at once from the store columns. The variance needs the node's relations
+        in the database, so it is only looked up for the nodes that pass them. Only the first
+        `config.NODE_SPLIT_MAX_QTY` candidates are sorted up front; the others are sorted if they are needed.
+        """
+        nodes = list(self.nodes)
+        if not nodes:
+            return
+
+        rows = self.store.rows(nodes)
+        last_utilized = self.store.last_utilized[rows]
+        created_at = self.store.created_at[rows]
+
+        is_new = self.store.is_new(rows)
+        is_underutilized = (
+            self.cortex.timestep - np.maximum(created_at, last_utilized) >= config.NODE_REQUIRED_UTILIZATION
+        )
+        eligible = np.flatnonzero(~is_new & ~is_underutilized)
+
+        variances = np.zeros(len(nodes))
+        variances[eligible] = 1 - np.array(
+            [max(db.get_nodes_clusters(nodes[idx], include_strengths=True)[1]) for idx in eligible]
+        )
+        eligible = eligible[variances[eligible] > config.NODE_SPLIT_MAX_CORRELATION_VARIANCE]
+
+        qty_top = min(int(math.ceil(config.NODE_SPLIT_MAX_QTY)), len(eligible))
+        if qty_top == 0:
+            return
+
+        # The top candidates, then the rest
+        is_top = np.zeros(len(eligible), dtype=bool)
+        is_top[np.argpartition(-variances[eligible], qty_top - 1)[:qty_top]] = True
+        for candidates in (eligible[is_top], eligible[~is_top]):
+            for idx in candidates[np.argsort(-variances[candidates], kind='stable')]:
+                yield nodes[idx]
 
     def _delete_underutilized_items(self):
         """
@@ -235,6 +332,89 @@ class NodeManager(object):
             if node.is_new():
                 node.teardown()
 
+    def deduplicate_nodes(self, max_distance_factor=config.NODE_DEDUP_MAX_DISTANCE_FACTOR):
+        """
+        Merges the nodes that collapsed onto nearly the same position, e.g. after repeated splits placed new nodes at
+        the same mean positions. Two nodes are merged if they are closer than `max_distance_factor` times the spread of
+        the nodes and have the same strongest cluster; the node with more feedback packets absorbs the other (see
+        `Database.merge_nodes`). The closest pairs are merged first and every node is merged at most once.
+
+        The pairs are found with a KD-tree of the current positions: the nearest node index holds the positions the
+        nodes had when it was built.
+
+        :param max_distance_factor: The maximum distance between two merged nodes, as a fraction of the root mean
+                                    square distance of the nodes to their mean.
+        :return: The number of nodes merged into other nodes.
+        """
+        nodes = list(self.nodes)
+        if len(nodes) < 2:
+            return 0
+
+        positions = self.store.positions[self.store.rows(nodes)]
+        spread = np.sqrt(np.mean(np.sum((positions - positions.mean(axis=0)) ** 2, axis=1)))
+        pairs = cKDTree(positions).query_pairs(max_distance_factor * spread, output_type='ndarray')
+        if len(pairs) == 0:
+            return 0
+
+        distances = np.linalg.norm(positions[pairs[:, 0]] - positions[pairs[:, 1]], axis=1)
+        strongest_clusters = {}
+        merged = set()
+        for idx, other_idx in pairs[np.argsort(distances, kind='stable')]:
+            if idx in merged or other_idx in merged:
+                continue
+            for node_idx in (idx, other_idx):
+                if node_idx not in strongest_clusters:
+                    strongest_clusters[node_idx] = nodes[node_idx].get_strongest_cluster()
+            if strongest_clusters[idx] is not strongest_clusters[other_idx]:
+                continue
+
+            if nodes[idx].qty_feedback_packets < nodes[other_idx].qty_feedback_packets:
+                idx, other_idx = other_idx, idx
+            if self.last_fired_node is nodes[other_idx]:
+                self.last_fired_node = nodes[idx]
+            db.merge_nodes(nodes[other_idx], nodes[idx])
+            merged.add(other_idx)
+            # Its strengths changed
+            del strongest_clusters[idx]
+
+        if self.nn_index:
+            self.nn_qty_removed += len(merged)
+        if config.LOG_TOPOLOGY_TO_STDOUT and merged:
+            print(f">> {self.cortex.name}: merged {len(merged)} collapsed nodes")
+        return len(merged)
+
+    def seed_nodes(self, encodings, qty=None, method=config.NODE_SEED_METHOD, seed=None):
+        """
+        Creates the initial nodes at once from a block of encodings, instead of one node per received encoding (see
+        `_add_initial_nodes`). The nodes, their clusters and the nearest node index are created in bulk and the
+        initialization is finished, so that learning starts in steady state.
+
+        :param encodings: A 2D array of encodings, or a finite iterable of encodings.
+        :param qty: The number of nodes to create (default: `config.INITIAL_NODES` minus the existing nodes). Never more
+                    than `config.MAX_NODES` nodes in total, or than the number of encodings.
+        :param method: How the positions are chosen from the block (see `seeding.METHODS`): 'kmeans++' spreads them
+                       over the encodings, 'reservoir' samples them uniformly.
+        :param seed: A random seed (default: use the global numpy random state).
+        :return: The new nodes.
+        """
+        qty_nodes = len(self.nodes)
+        qty = config.INITIAL_NODES - qty_nodes if qty is None else qty
+        qty = max(min(qty, config.MAX_NODES - qty_nodes), 0)
+
+        rng = np.random if seed is None else np.random.RandomState(seed)
+        positions = seeding.METHODS[method](encodings, qty, rng)
+
+        rows = self.store.allocate_many(positions, self.cortex.timestep)
+        nodes = [Node(self.cortex, None, row=row) for row in rows]
+        clusters = [Cluster(self.cortex, "cluster_" + node.name) for node in nodes]
+        db.add_nodes(nodes, clusters, initial=True)
+        self._index_new_nodes(nodes)
+
+        self.finished_initial = True
+        if self.nodes:
+            self.build_nrnd_index(force=True)
+        return nodes
+
     def _add_initial_nodes(self, encoding):
         """
         Adds nodes near the passed encoding if all the initial nodes have not been initialized yet.
@@ -245,10 +425,34 @@ class NodeManager(object):
             node = Node(self.cortex, encoding)
             cluster = Cluster(node.cortex, "cluster_" + node.name)
             db.add_node(node, cluster, initial=True)
+            self._index_new_nodes([node])
 
         if len(self.nodes) >= config.INITIAL_NODES:
             self.finished_initial = True
 
+    def _search_nrnd_index(self, encoding, qty_neighbours):
+        """
+        Returns the nearest node of the nearest node index that has not been removed since the index was built.
+
+        :param encoding: The encoding to find the nearest node for.
+        :param qty_neighbours: The number of neighbours to search.
+        :return: A tuple containing the nearest node and its distance, None if all the neighbours were removed.
+        """
+        if config.NRND_SEARCH_K:
+            nn_idxs, distances = self.nn_index.get_nns_by_vector(
+                encoding, qty_neighbours, include_distances=True, search_k=config.NRND_SEARCH_K
+            )
+        else:
+            nn_idxs, distances = self.nn_index.get_nns_by_vector(
+                encoding, qty_neighbours, include_distances=True
+            )
+
+        for idx, distance in zip(nn_idxs, distances):
+            node = self.nn_index_nodes[idx]
+            if node.name in db.nodes.data:
+                return node, distance
+        return None
+
     def _find_nearest_node(self, encoding):
         """
         Returns the node that is nearest to the passed encoding.
@@ -256,17 +460,39 @@ class NodeManager(object):
         :param encoding: The encoding to find the nearest node for.
         :return: A tuple containing the nearest node and its distance.
         """
+        if self.partitions is not None:
+            nearest = self.partitions.nearest(encoding)
+            if nearest is not None:
+                return nearest
+
         if config.NRND_OPTIMIZER_ENABLED and self.nn_index:
-            if config.NRND_SEARCH_K:
-                nn_idxs, distances = self.nn_index.get_nns_by_vector(
-                    encoding, 1, include_distances=True, search_k=config.NRND_SEARCH_K
-                )
-            else:
-                nn_idxs, distances = self.nn_index.get_nns_by_vector(
-                    encoding, 1, include_distances=True
-                )
-            return self.nodes[nn_idxs[0]], distances[0]
-        else:
-            tuples = [(node, node.get_distance(encoding)[0]) for node in self.nodes]
-            assert len(tuples) > 0
-            return min(tuples, key=lambda x: x[1])
\ No newline at end of file
+            nearest = self._search_nrnd_index(encoding, 1)
+            if nearest is None and self.nn_qty_removed:
+                # The nearest indexed node was removed, ask for as many extra neighbours as nodes were removed
+                nearest = self._search_nrnd_index(encoding, 1 + self.nn_qty_removed)
+
+            if self.nn_pending_nodes:
+                # The nodes added since the index was built, compared by their current distance
+                candidates = [node for node in self.nn_pending_nodes if node.name in db.nodes.data]
+                if nearest is not None:
+                    candidates.append(nearest[0])
+                if candidates:
+                    nearest = self._find_nearest_of(candidates, encoding)
+
+            if nearest is not None:
+                return nearest
+
+        nodes = self.nodes
+        assert len(nodes) > 0
+        return self._find_nearest_of(nodes, encoding)
+
+    def _find_nearest_of(self, nodes, encoding):
+        """
+        Returns the node of the given nodes that is nearest to the passed encoding, by brute force.
+
+        :param nodes: A list of nodes of this NodeManager.
+        :param encoding: The encoding to find the nearest node for.
+        :return: A tuple containing the nearest node and its distance.
+        """
+        idx, distance = kernels.nearest(self.store.positions, self.store.rows(nodes), encoding)
+        return nodes[idx], distance
@@ -0,0 +1,103 @@
+import numpy as np
+
+from cdzproject import config
+from cdzproject.modules.shared_components.column_store import ColumnStore
+
+
+class NodeStore(ColumnStore):
+    """
+    The state of the nodes of a cortex, one row per node (see `Node`):
+        - positions, momenta: the position of every node in the feature space and its momentum.
+        - created_at, last_utilized: timesteps. `last_utilized` is -1 for nodes that were never utilized.
+        - qty_feedback_packets: the number of feedback packets every node received.
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty NodeStore instance. The position columns are added with the first node, once the number
+        of dimensions is known.
+        """
+        super(NodeStore, self).__init__()
+        self.add_column('created_at', np.int64)
+        self.add_column('last_utilized', np.int64, fill=-1)
+        self.add_column('qty_feedback_packets', np.int64)
+
+    def allocate(self, position, created_at):
+        """
+        Stores a new node.
+
+        :param position: The initial position of the node. It is copied.
+        :param created_at: The timestep the node is created at.
+        :return: The index of the node's row.
+        """
+        position = np.asarray(position)
+        self._add_position_columns(position)
+
+        row = super(NodeStore, self).allocate()
+        self.positions[row] = position
+        self.created_at[row] = created_at
+        return row
+
+    def allocate_many(self, positions, created_at):
+        """
+        Stores new nodes at once.
+
+        :param positions: A 2D array with the initial position of every node. It is copied.
+        :param created_at: The timestep the nodes are created at.
+        :return: An array with the index of every node's row.
+        """
+        positions = np.asarray(positions)
+        if len(positions) == 0:
+            return np.zeros(0, dtype=np.intp)
+        self._add_position_columns(positions[0])
+
+        rows = np.array([super(NodeStore, self).allocate() for _ in range(len(positions))], dtype=np.intp)
+        self.positions[rows] = positions
+        self.created_at[rows] = created_at
+        return rows
+
+    def _add_position_columns(self, position):
+        """
+        Adds the position columns, with the dimensions of the given position, if they do not exist yet.
+        """
+        if 'positions' not in self.columns:
+            # Keep the precision of the encodings
+            dtype = position.dtype if np.issubdtype(position.dtype, np.floating) else np.float64
+            self.add_column('positions', dtype, width=len(position))
+            self.add_column('momenta', dtype, width=len(position))
+
+    def merge(self, row, into_row):
+        """
+        Combines a row into another row: the positions are averaged, weighted by the number of feedback packets of
+        every node (plus one), the feedback packets are summed, and the earliest creation and latest utilization are
+        kept. The momentum of `into_row` is kept.
+
+        :param row: The index of the row of the merged node.
+        :param into_row: The index of the row of the node it is merged into.
+        """
+        weight, into_weight = self.qty_feedback_packets[row] + 1, self.qty_feedback_packets[into_row] + 1
+        self.positions[into_row] = (weight * self.positions[row] + into_weight * self.positions[into_row]) / (
+            weight + into_weight
+        )
+        self.qty_feedback_packets[into_row] += self.qty_feedback_packets[row]
+        self.created_at[into_row] = min(self.created_at[row], self.created_at[into_row])
+        self.last_utilized[into_row] = max(self.last_utilized[row], self.last_utilized[into_row])
+
+    def rows(self, nodes):
+        """
+        Returns the rows of the given nodes, to index the columns with.
+
+        :param nodes: A list of nodes of this store.
+        :return: An array of row indexes.
+        """
+        return np.fromiter((node.row for node in nodes), dtype=np.intp, count=len(nodes))
+
+    def is_new(self, rows):
+        """
+        Returns whether the nodes of the given rows are new. This is `Node.is_new` for many nodes at once.
+
+        :param rows: An array of row indexes.
+        :return: An array of flags.
+        """
+        # `last_utilized` is -1 for nodes that were never utilized
+        return (self.last_utilized[rows] < 0) | (self.qty_feedback_packets[rows] <= config.NODE_IS_NEW)
@@ -0,0 +1,194 @@
+import numpy as np
+
+from cdzproject import db
+from cdzproject.modules.cortex import kernels, seeding
+
+
+class NodePartitions(object):
+    """
+    A coarse-to-fine nearest node index for cortices with many nodes (see `config.NRND_PARTITIONS`).
+
+    A small codebook of centroids, learned online from the encodings, partitions the encoding space. Every node belongs
+    to the partition of its nearest centroid, and every partition keeps its own nodes and the array of their rows in the
+    node store. A query compares the encoding with the centroids and searches only the nodes of the nearest partitions,
+    by brute force (see `kernels.nearest`).
+
+    Nodes and centroids move as they learn. The partitions they moved in are marked as dirty and `refresh` reassigns
+    only the nodes of the dirty partitions, so the maintenance cost stays local. Nodes deleted from the database are
+    dropped from their partition when a query finds them, or when their partition is refreshed.
+    """
+
+    # The codebook is chosen from a sample of up to this many nodes per partition
+    SAMPLE_PER_PARTITION = 32
+    # The number of positions compared with the centroids at once
+    CHUNK_SIZE = 4096
+
+    def __init__(self, store, qty_partitions, qty_probes, learning_rate):
+        """
+        Initializes an empty NodePartitions instance. The codebook is created by `build`.
+
+        :param store: The node store of the cortex.
+        :param qty_partitions: The number of partitions (centroids).
+        :param qty_probes: The number of nearest partitions searched per query.
+        :param learning_rate: The rate at which the nearest centroid moves towards every encoding.
+        """
+        self.store = store
+        self.qty_partitions = qty_partitions
+        self.qty_probes = qty_probes
+        self.learning_rate = learning_rate
+
+        self.centroids = None
+        # The number of nodes the codebook was built from
+        self.qty_nodes_built = 0
+        # The nodes of every partition and their rows, None when the rows have to be gathered again
+        self.members = []
+        self.rows = []
+        self.dirty = set()
+        # The partition of the last query's nearest centroid, it learns the encoding
+        self.last_partition = None
+
+    def __len__(self):
+        """
+        Returns the number of nodes in the partitions, including deleted nodes that were not dropped yet.
+        """
+        return sum(len(members) for members in self.members)
+
+    def build(self, nodes, rng=np.random):
+        """
+        Creates the codebook from the positions of a sample of the nodes, spread like the seeding of k-means++, and
+        assigns every node to its partition.
+
+        :param nodes: The nodes of the cortex.
+        :param rng: A numpy RandomState (or the `np.random` module).
+        """
+        positions = self.store.positions[self.store.rows(nodes)]
+        sample = seeding.reservoir(positions, self.SAMPLE_PER_PARTITION * self.qty_partitions, rng)
+        self.centroids = np.array(seeding.kmeans_plus_plus(sample, self.qty_partitions, rng), dtype=float)
+        self.qty_partitions = len(self.centroids)
+        self.members = [[] for _ in range(self.qty_partitions)]
+        self.rows = [None] * self.qty_partitions
+        self.dirty = set()
+        self.qty_nodes_built = len(nodes)
+
+        for node, partition in zip(nodes, self._nearest_centroids(positions)):
+            self.members[partition].append(node)
+
+    def _nearest_centroids(self, positions):
+        """
+        Returns the index of the nearest centroid of every position.
+        """
+        sq_norms = (self.centroids ** 2).sum(axis=1)
+        nearest = np.empty(len(positions), dtype=np.intp)
+        for start in range(0, len(positions), self.CHUNK_SIZE):
+            chunk = positions[start:start + self.CHUNK_SIZE]
+            # The squared norms of the positions do not change the order
+            nearest[start:start + self.CHUNK_SIZE] = np.argmin(sq_norms - 2 * chunk @ self.centroids.T, axis=1)
+        return nearest
+
+    def add(self, node):
+        """
+        Adds a new node to the partition of its nearest centroid.
+
+        :param node: The node.
+        """
+        partition = int(self._nearest_centroids(node.position[None])[0])
+        self.members[partition].append(node)
+        self.rows[partition] = None
+
+    def _partition_rows(self, partition):
+        """
+        Returns the rows of the nodes of a partition, gathering them if they changed.
+        """
+        if self.rows[partition] is None:
+            self.rows[partition] = self.store.rows(self.members[partition])
+        return self.rows[partition]
+
+    def _drop_deleted(self, partition):
+        """
+        Drops the nodes of a partition that were deleted from the database.
+        """
+        self.members[partition] = [node for node in self.members[partition] if node.name in db.nodes.data]
+        self.rows[partition] = None
+
+    def nearest(self, encoding):
+        """
+        Returns the nearest node to an encoding among the nodes of the `qty_probes` partitions with the nearest
+        centroids.
+
+        :param encoding: The encoding.
+        :return: A tuple containing the nearest node and its distance, None if the probed partitions have no nodes.
+        """
+        distances = np.linalg.norm(self.centroids - encoding, axis=1)
+        qty_probes = min(self.qty_probes, self.qty_partitions)
+        probes = np.argpartition(distances, qty_probes - 1)[:qty_probes]
+        self.last_partition = int(probes[np.argmin(distances[probes])])
+
+        nearest = None
+        for partition in probes:
+            partition_nearest = self._nearest_in(partition, encoding)
+            if partition_nearest is not None and (nearest is None or partition_nearest[1] < nearest[1]):
+                nearest = partition_nearest + (partition,)
+
+        if nearest is None:
+            return None
+
+        # The nearest node moves when it learns
+        self.dirty.add(nearest[2])
+        return nearest[0], nearest[1]
+
+    def _nearest_in(self, partition, encoding):
+        """
+        Returns the nearest node of a partition to an encoding and its distance, None if the partition has no nodes.
+        """
+        while self.members[partition]:
+            idx, distance = kernels.nearest(self.store.positions, self._partition_rows(partition), encoding)
+            node = self.members[partition][idx]
+            if node.name in db.nodes.data:
+                return node, distance
+            # Its row may have been reused by another node, search the partition again without it
+            self._drop_deleted(partition)
+        return None
+
+    def learn(self, encoding):
+        """
+        Moves the centroid of the last query's nearest partition towards the encoding.
+
+        :param encoding: The encoding of the last query.
+        """
+        centroid = self.centroids[self.last_partition]
+        centroid += self.learning_rate * (encoding - centroid)
+        self.dirty.add(self.last_partition)
+
+    def refresh(self):
+        """
+        Reassigns the nodes of the dirty partitions to their nearest centroid and drops their deleted nodes. The
+        other partitions are not visited.
+
+        :return: The number of nodes that moved to another partition.
+        """
+        qty_moved = 0
+        for partition in sorted(self.dirty):
+            self._drop_deleted(partition)
+            members = self.members[partition]
+            if not members:
+                continue
+
+            nearest_centroids = self._nearest_centroids(self.store.positions[self._partition_rows(partition)])
+            if np.all(nearest_centroids == partition):
+                continue
+
+            self.members[partition] = []
+            for node, nearest_centroid in zip(members, nearest_centroids):
+                self.members[nearest_centroid].append(node)
+                self.rows[nearest_centroid] = None
+            qty_moved += int(np.sum(nearest_centroids != partition))
+
+        self.dirty = set()
+        return qty_moved
+
+    @property
+    def nbytes(self):
+        """
+        Returns the number of bytes of the centroids and of the rows of the partitions.
+        """
+        return self.centroids.nbytes + sum(rows.nbytes for rows in self.rows if rows is not None)
@@ -0,0 +1,72 @@
+"""
+Chooses the positions of the initial nodes of a cortex from a block of encodings. See `NodeManager.seed_nodes`.
+"""
+
+import numpy as np
+
+
+def reservoir(encodings, qty, rng):
+    """
+    Samples encodings uniformly without replacement. Iterables are read once (reservoir sampling), so a block does not
+    need to be loaded as a whole.
+
+    :param encodings: A 2D array of encodings, or a finite iterable of encodings.
+    :param qty: The number of encodings to choose.
+    :param rng: A numpy RandomState (or the `np.random` module).
+    :return: A 2D array of the chosen encodings, in the order of the block.
+    """
+    if isinstance(encodings, np.ndarray):
+        idxs = np.sort(rng.choice(len(encodings), min(qty, len(encodings)), replace=False))
+        return encodings[idxs]
+
+    chosen = []
+    positions = []
+    for idx, encoding in enumerate(encodings):
+        if idx < qty:
+            chosen.append(np.array(encoding))
+            positions.append(idx)
+        else:
+            replace_idx = rng.randint(idx + 1)
+            if replace_idx < qty:
+                chosen[replace_idx] = np.array(encoding)
+                positions[replace_idx] = idx
+
+    order = np.argsort(positions)
+    return np.array([chosen[idx] for idx in order])
+
+
+def kmeans_plus_plus(encodings, qty, rng):
+    """
+    Chooses encodings that are spread over the block, like the seeding of k-means++: every encoding is chosen with a
+    probability proportional to its squared distance to the nearest encoding chosen so far. Takes O(qty * len(block))
+    distance computations.
+
+    :param encodings: A 2D array of encodings, or a finite iterable of encodings.
+    :param qty: The number of encodings to choose.
+    :param rng: A numpy RandomState (or the `np.random` module).
+    :return: A 2D array of the chosen encodings, in the order they were chosen.
+    """
+    encodings = np.asarray(encodings if isinstance(encodings, np.ndarray) else list(encodings))
+    qty = min(qty, len(encodings))
+    if qty == 0:
+        return encodings[:0]
+
+    chosen = [rng.randint(len(encodings))]
+    sq_distances = ((encodings - encodings[chosen[0]]) ** 2).sum(axis=1)
+    for _ in range(qty - 1):
+        total = sq_distances.sum()
+        if total > 0:
+            idx = rng.choice(len(encodings), p=sq_distances / total)
+        else:
+            # The remaining encodings are duplicates of chosen ones
+            idx = rng.choice(np.setdiff1d(np.arange(len(encodings)), chosen))
+        chosen.append(idx)
+        sq_distances = np.minimum(sq_distances, ((encodings - encodings[idx]) ** 2).sum(axis=1))
+
+    return encodings[chosen]
+
+
+METHODS = {
+    'reservoir': reservoir,
+    'kmeans++': kmeans_plus_plus,
+}
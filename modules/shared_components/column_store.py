@@ -0,0 +1,86 @@
+import numpy as np
+
+
+class ColumnStore(object):
+    """
+    Stores the state of many items column-wise: every attribute is a numpy array (a column) and every item is a row.
+    Rows of removed items are reused by new items. This keeps the memory per item small and makes queries over all
+    the items array operations.
+    """
+
+    INITIAL_CAPACITY = 64
+
+    def __init__(self):
+        """
+        Initializes an empty ColumnStore instance. Columns are added with `add_column`.
+        """
+        # The value of every column for rows without an item
+        self.columns = {}
+        self.capacity = 0
+        self.qty_rows = 0
+        self.free_rows = []
+
+    def __len__(self):
+        """
+        Returns the number of items in the store.
+        """
+        return self.qty_rows - len(self.free_rows)
+
+    def add_column(self, name, dtype, fill=0, width=None):
+        """
+        Adds a column, available as the attribute `name`.
+
+        :param name: The name of the column.
+        :param dtype: The numpy dtype of the column.
+        :param fill: The value of rows without an item.
+        :param width: The number of values per row, None for scalars.
+        """
+        shape = (self.capacity,) if width is None else (self.capacity, width)
+        setattr(self, name, np.full(shape, fill, dtype=dtype))
+        self.columns[name] = fill
+
+    def allocate(self):
+        """
+        Returns a free row for a new item, growing the columns if needed. Arrays taken from the columns before they
+        grow (e.g. views of a row) no longer refer to the store.
+
+        :return: The index of the row.
+        """
+        if self.free_rows:
+            return self.free_rows.pop()
+
+        if self.qty_rows == self.capacity:
+            self._grow(max(self.INITIAL_CAPACITY, 2 * self.capacity))
+
+        self.qty_rows += 1
+        return self.qty_rows - 1
+
+    def release(self, row):
+        """
+        Frees the row of a removed item so that it can be reused.
+
+        :param row: The index of the row.
+        """
+        for name, fill in self.columns.items():
+            getattr(self, name)[row] = fill
+        self.free_rows.append(row)
+
+    def _grow(self, capacity):
+        """
+        Reallocates every column with the given capacity.
+
+        :param capacity: The new number of rows.
+        """
+        for name, fill in self.columns.items():
+            column = getattr(self, name)
+            new_column = np.full((capacity,) + column.shape[1:], fill, dtype=column.dtype)
+            new_column[:self.capacity] = column
+            setattr(self, name, new_column)
+        self.capacity = capacity
+
+    @property
+    def nbytes(self):
+        """
+        Returns the number of bytes of the columns.
+        """
+        return sum(getattr(self, name).nbytes for name in self.columns)
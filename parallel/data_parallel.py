@@ -0,0 +1,227 @@
+"""
+Data-parallel training.
+
+N worker processes each train a replica brain on their own shard of the stream. Every `merge_frequency` steps the
+replicas are merged into one model (see `merge.py`) which is broadcast back to the workers. Maintenance (cleanup,
+neural growth) only runs on the merged model, at the same timesteps it would run in a single-process run.
+"""
+
+import multiprocessing
+import random
+import time
+
+import numpy as np
+
+from cdzproject import config
+from cdzproject.brain import Brain
+from cdzproject.utils import utils, dataset_registry
+from cdzproject.modules.cortex.autoencoder import Autoencoder
+from cdzproject.parallel.state import export_state, restore_state
+from cdzproject.parallel.merge import merge_states
+
+
+def _seed(seed):
+    """Seeds the random generators used by the datasets."""
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def _new_brain():
+    """Creates a brain with the visual and audio cortices used by the datasets."""
+    brain = Brain()
+    brain.add_cortex('visual', Autoencoder())
+    brain.add_cortex('audio', Autoencoder())
+    return brain
+
+
+def _train_step(brain, samples):
+    """Sends the next training example of the sample stream to the brain."""
+    visual_input, audio_input, class_label = next(samples)
+    brain.receive_sensory_input(brain.get_cortex('visual'), visual_input)
+    brain.receive_sensory_input(brain.get_cortex('audio'), audio_input)
+
+
+def _train_replica(args):
+    """
+    Restores a replica from the broadcast state and trains it on its shard of the stream.
+
+    The replicas' timesteps are interleaved so that together they cover the same timesteps as a single-process run.
+    """
+    state, dataset_name, worker_id, num_workers, num_steps, seed = args
+    stream = dataset_registry.get_dataset(dataset_name).sample_stream(seed=seed)
+    samples = iter(stream)
+
+    brain = restore_state(state)
+    brain.timestep = state['timestep'] + worker_id + 1 - num_workers
+    for _ in range(num_steps):
+        brain.increment_timestep(num_workers)
+        _train_step(brain, samples)
+
+    stream.close()
+    return export_state(brain)
+
+
+def _crossed(frequency, previous_timestep, timestep):
+    """Returns True if a multiple of `frequency` lies in (previous_timestep, timestep]."""
+    return int(previous_timestep // frequency) != int(timestep // frequency)
+
+
+def train_single_process(dataset_name, num_steps, seed=0):
+    """
+    Trains a brain in this process, the same way `examples/basic_example.py` does.
+
+    :param dataset_name: The name of the dataset (see `dataset_registry.DATASETS`) or its module name.
+    :param num_steps: The number of training examples.
+    :param seed: The random seed.
+    :return: The trained brain.
+    """
+    _seed(seed)
+    stream = dataset_registry.get_dataset(dataset_name).sample_stream(seed=seed)
+    samples = iter(stream)
+    brain = _new_brain()
+
+    for timestep in range(num_steps):
+        brain.increment_timestep()
+        _train_step(brain, samples)
+
+        brain.cleanup()
+        brain.build_nrnd_indexes()
+        if timestep / num_steps < 0.75:
+            brain.create_new_nodes()
+
+    stream.close()
+    return brain
+
+
+class DataParallelTrainer(object):
+    """
+    Trains a brain with several worker processes and periodically merges their replicas.
+    """
+
+    def __init__(self, dataset_name, num_workers=config.DP_NUM_WORKERS, merge_frequency=config.DP_MERGE_FREQUENCY,
+                 seed=0):
+        """
+        Initializes a DataParallelTrainer instance.
+
+        :param dataset_name: The name of the dataset (see `dataset_registry.DATASETS`) or its module name.
+        :param num_workers: The number of worker processes.
+        :param merge_frequency: The number of samples each replica processes between merges.
+        :param seed: The random seed. Every worker uses a different seed derived from it.
+        """
+        self.dataset_name = dataset_name
+        self.num_workers = num_workers
+        self.merge_frequency = merge_frequency
+        self.seed = seed
+        self.brain = None
+
+    def train(self, num_steps):
+        """
+        Trains a brain on `num_steps` examples in total, across all workers.
+
+        :param num_steps: The number of training examples.
+        :return: The trained (merged) brain.
+        """
+        _seed(self.seed)
+        stream = dataset_registry.get_dataset(self.dataset_name).sample_stream(seed=self.seed)
+        samples = iter(stream)
+        self.brain = _new_brain()
+
+        # The initial nodes are created in this process so that every replica starts from the same nodes.
+        while not all(cortex.node_manager.finished_initial for cortex in self.brain.cortices.values()):
+            self.brain.increment_timestep()
+            _train_step(self.brain, samples)
+        stream.close()
+
+        state = export_state(self.brain)
+        round_idx = 0
+
+        with multiprocessing.Pool(self.num_workers) as pool:
+            while state['timestep'] < num_steps:
+                remaining = num_steps - state['timestep']
+                steps_per_worker = min(self.merge_frequency, -(-remaining // self.num_workers))
+
+                tasks = [
+                    (state, self.dataset_name, worker_id, self.num_workers, steps_per_worker,
+                     self.seed + 1 + round_idx * self.num_workers + worker_id)
+                    for worker_id in range(self.num_workers)
+                ]
+                merged_state = merge_states(state, pool.map(_train_replica, tasks))
+                merged_state['timestep'] = state['timestep'] + steps_per_worker * self.num_workers
+
+                self.brain = restore_state(merged_state, build_indexes=False)
+                self._run_maintenance(state['timestep'], num_steps)
+
+                state = export_state(self.brain)
+                round_idx += 1
+
+        self.brain = restore_state(state)
+        return self.brain
+
+    def _run_maintenance(self, previous_timestep, num_steps):
+        """
+        Runs the maintenance that a single-process run would have run between `previous_timestep` and now.
+
+        :param previous_timestep: The timestep of the previous merge.
+        :param num_steps: The total number of training examples.
+        """
+        timestep = self.brain.timestep
+
+        if _crossed(config.BRN_CLEANUP_FREQUENCY, previous_timestep, timestep):
+            self.brain.cleanup(force=True)
+
+        # Stop creating new nodes towards the end of training, see `examples/basic_example.py`
+        if timestep / num_steps < 0.75 and _crossed(config.BRN_NEURAL_GROWTH_FREQUENCY, previous_timestep, timestep):
+            self.brain.create_new_nodes(force=True)
+
+
+def _run_single_process(args):
+    """Trains and scores a single-process brain. Runs in its own process so that it gets its own database."""
+    dataset_name, num_steps, seed = args
+    start = time.time()
+    brain = train_single_process(dataset_name, num_steps, seed=seed)
+    seconds = time.time() - start
+
+    brain.cleanup(force=True)
+    return utils.print_score(dataset_registry.get_dataset(dataset_name), brain), seconds
+
+
+def compare_with_single_process(dataset_name, num_steps, num_workers=config.DP_NUM_WORKERS,
+                                merge_frequency=config.DP_MERGE_FREQUENCY, seed=0):
+    """
+    Trains a brain with and without data parallelism and reports the final clustering quality of both.
+
+    :param dataset_name: The name of the dataset (see `dataset_registry.DATASETS`) or its module name.
+    :param num_steps: The number of training examples for each run.
+    :param num_workers: The number of worker processes for the data-parallel run.
+    :param merge_frequency: The number of samples each replica processes between merges.
+    :param seed: The random seed.
+    :return: A dictionary with the scores and training times of both runs.
+    """
+    with multiprocessing.Pool(1) as pool:
+        single_scores, single_seconds = pool.apply(_run_single_process, ((dataset_name, num_steps, seed),))
+
+    start = time.time()
+    trainer = DataParallelTrainer(dataset_name, num_workers=num_workers, merge_frequency=merge_frequency, seed=seed)
+    brain = trainer.train(num_steps)
+    parallel_seconds = time.time() - start
+
+    brain.cleanup(force=True)
+    parallel_scores = utils.print_score(dataset_registry.get_dataset(dataset_name), brain)
+
+    print('================ Data-Parallel Report ================')
+    print('Workers:', num_workers, '-- Merge frequency:', merge_frequency, '-- Steps:', num_steps)
+    print('Training time (s): single', '{0:.1f}'.format(single_seconds),
+          '-- parallel', '{0:.1f}'.format(parallel_seconds))
+    for set_name in ('train', 'test'):
+        for cortex_name in ('visual', 'audio'):
+            single_score, single_unique = single_scores[set_name][cortex_name]
+            parallel_score, parallel_unique = parallel_scores[set_name][cortex_name]
+            print(set_name, cortex_name, '-- avg score: single', '{0:.4f}'.format(single_score),
+                  'parallel', '{0:.4f}'.format(parallel_score),
+                  '-- unique top clusters: single', single_unique, 'parallel', parallel_unique)
+    print('================ End Data-Parallel Report ============')
+
+    return {
+        'single': {'scores': single_scores, 'seconds': single_seconds},
+        'parallel': {'scores': parallel_scores, 'seconds': parallel_seconds},
+    }
@@ -0,0 +1,188 @@
+"""
+Merges the states of replica brains that were trained in parallel from a common base state.
+
+Replicas never grow or delete nodes (maintenance only runs on the merged model), so every replica holds the same nodes
+and clusters as the base and they can be matched by name:
+    - Node positions and momenta are averaged, weighted by how often each replica used the node during the round.
+    - Node-cluster and cluster-node strengths are summed across replicas and renormalized.
+    - CDZ correlation weights are summed across replicas and renormalized.
+    - Counters are merged as the base value plus the sum of every replica's increments.
+"""
+
+from collections import defaultdict
+
+import numpy as np
+
+
+def _latest(values):
+    """Returns the most recent of the passed timesteps, ignoring the ones that are None."""
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def _normalize(strengths):
+    """Normalizes a dictionary of strengths so that they sum to one."""
+    total = sum(strengths.values())
+    if total <= 0.0:
+        raise Exception('Cannot normalize a list with a total of zero or less.')
+    return {key: value / total for key, value in strengths.items()}
+
+
+def _increments(base_value, values):
+    """Returns the base value plus the sum of every replica's increment over it."""
+    return base_value + sum(value - base_value for value in values)
+
+
+def _merge_positions(base_position, positions, weights):
+    """Averages the replicas' positions, weighted by each replica's utilization of the node."""
+    total = sum(weights)
+    if total <= 0:
+        return np.array(base_position, copy=True)
+    return sum(weight * np.asarray(position) for position, weight in zip(positions, weights)) / total
+
+
+def _merge_momenta(base_momentum, momenta, weights):
+    """Averages the replicas' momenta. Momentum starts as the int 0 and becomes an array once the node moves."""
+    if all(np.isscalar(momentum) for momentum in momenta):
+        return base_momentum
+    return _merge_positions(base_momentum, [np.asarray(momentum, dtype=float) for momentum in momenta], weights)
+
+
+def _merge_relations(replica_relations, base_counts):
+    """
+    Merges the relationships of one item across replicas.
+
+    :param replica_relations: A list of (names, strengths, positions, counts) tuples, one per replica.
+    :param base_counts: A dictionary of the relationship counts in the base state.
+    :return: A tuple of lists (names, strengths, positions, counts).
+    """
+    strengths = defaultdict(float)
+    counts = defaultdict(list)
+    positions = defaultdict(list)
+
+    for names, replica_strengths, replica_positions, replica_counts in replica_relations:
+        for idx, name in enumerate(names):
+            strengths[name] += replica_strengths[idx]
+            counts[name].append(replica_counts[idx])
+            if replica_positions[idx] is not None:
+                positions[name].append((replica_positions[idx], replica_counts[idx]))
+
+    strengths = _normalize(strengths)
+    names = list(strengths)
+
+    merged_positions = []
+    merged_counts = []
+    for name in names:
+        # Relations that are new in a replica did not exist in the base, i.e. they had a count of 0.
+        base_count = base_counts.get(name, 0)
+        replica_counts = counts[name] + [base_count] * (len(replica_relations) - len(counts[name]))
+        merged_counts.append(_increments(base_count, replica_counts))
+
+        if positions[name]:
+            merged_positions.append(_merge_positions(
+                positions[name][0][0], [position for position, _ in positions[name]],
+                [count for _, count in positions[name]]
+            ))
+        else:
+            merged_positions.append(None)
+
+    return names, [strengths[name] for name in names], merged_positions, merged_counts
+
+
+def merge_states(base_state, replica_states):
+    """
+    Merges replica states that were all restored from `base_state` and trained on different shards of the stream.
+
+    :param base_state: The state the replicas started from.
+    :param replica_states: The states exported by the replicas after training.
+    :return: The merged state.
+    """
+    merged = {
+        'timestep': max(state['timestep'] for state in replica_states),
+        'name_counter': max(state['name_counter'] for state in replica_states),
+        'cortices': {},
+        'correlations': {},
+    }
+
+    for cortex_name, base_cortex in base_state['cortices'].items():
+        replica_cortices = [state['cortices'][cortex_name] for state in replica_states]
+
+        nodes = {}
+        for node_name, base_node in base_cortex['nodes'].items():
+            replica_nodes = [cortex['nodes'][node_name] for cortex in replica_cortices]
+            used = [node['qty_feedback_packets'] - base_node['qty_feedback_packets'] for node in replica_nodes]
+
+            names, strengths, positions, counts = _merge_relations(
+                [(node['clusters'], node['strengths'], node['positions'], node['counts']) for node in replica_nodes],
+                dict(zip(base_node['clusters'], base_node['counts']))
+            )
+
+            nodes[node_name] = {
+                'position': _merge_positions(base_node['position'], [node['position'] for node in replica_nodes], used),
+                'momentum': _merge_momenta(base_node['momentum'], [node['momentum'] for node in replica_nodes], used),
+                'created_at': base_node['created_at'],
+                'last_utilized': _latest([node['last_utilized'] for node in replica_nodes]),
+                'qty_feedback_packets': _increments(
+                    base_node['qty_feedback_packets'], [node['qty_feedback_packets'] for node in replica_nodes]
+                ),
+                'clusters': names,
+                'strengths': strengths,
+                'positions': positions,
+                'counts': counts,
+            }
+
+        clusters = {}
+        for cluster_name, base_cluster in base_cortex['clusters'].items():
+            replica_clusters = [cortex['clusters'][cluster_name] for cortex in replica_cortices]
+
+            if any(cluster['nodes'] for cluster in replica_clusters):
+                names, strengths, _, counts = _merge_relations(
+                    [(cluster['nodes'], cluster['strengths'], [None] * len(cluster['nodes']), cluster['counts'])
+                     for cluster in replica_clusters],
+                    dict(zip(base_cluster['nodes'], base_cluster['counts']))
+                )
+            else:
+                names, strengths, counts = [], [], []
+
+            clusters[cluster_name] = {
+                'created_at': base_cluster['created_at'],
+                'last_fired': _latest([cluster['last_fired'] for cluster in replica_clusters]),
+                'last_feedback_packet': _latest([cluster['last_feedback_packet'] for cluster in replica_clusters]),
+                'required_utilization': base_cluster['required_utilization'],
+                'nodes': names,
+                'strengths': strengths,
+                'counts': counts,
+            }
+
+        merged['cortices'][cortex_name] = {
+            'nodes': nodes,
+            'clusters': clusters,
+            'finished_initial': base_cortex['finished_initial'],
+            'avg_distance': float(np.mean([cortex['avg_distance'] for cortex in replica_cortices])),
+            'distance_count': _increments(
+                base_cortex['distance_count'], [cortex['distance_count'] for cortex in replica_cortices]
+            ),
+            'avg_distance_momentum': float(np.mean([cortex['avg_distance_momentum'] for cortex in replica_cortices])),
+        }
+
+    correlation_names = set()
+    for state in replica_states:
+        correlation_names.update(state['correlations'])
+
+    for cluster_name in correlation_names:
+        base_age = base_state['correlations'].get(cluster_name, {'age': 1})['age']
+        replica_correlations = [
+            state['correlations'].get(cluster_name, {'age': base_age, 'connections': {}}) for state in replica_states
+        ]
+
+        connections = defaultdict(float)
+        for correlation in replica_correlations:
+            for connected_name, strength in correlation['connections'].items():
+                connections[connected_name] += strength
+
+        merged['correlations'][cluster_name] = {
+            'age': _increments(base_age, [correlation['age'] for correlation in replica_correlations]),
+            'connections': _normalize(connections) if sum(connections.values()) > 0 else dict(connections),
+        }
+
+    return merged
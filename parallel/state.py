@@ -0,0 +1,174 @@
+"""
+Exports the learned state of a brain into plain python/numpy structures and restores it again.
+
+The exported state can be pickled and sent between processes. It is what replicas exchange during data-parallel
+training. Transient state (the CDZ packet queue, the last fired node, nearest node indexes) is not exported, it is
+rebuilt when the state is restored.
+"""
+
+import numpy as np
+
+from cdzproject import db
+from cdzproject.utils import utils
+from cdzproject.brain import Brain
+from cdzproject.modules.cortex.node import Node
+from cdzproject.modules.cortex.cluster import Cluster
+from cdzproject.modules.cortex.autoencoder import Autoencoder
+from cdzproject.modules.cdz.cluster_correlation import ClusterCorrelation
+
+
+def _copy(value):
+    """Copies arrays so that the exported state does not share memory with the live brain."""
+    return np.array(value, copy=True) if isinstance(value, np.ndarray) else value
+
+
+def export_state(brain):
+    """
+    Exports the learned state of the brain.
+
+    :param brain: The brain to export.
+    :return: A dictionary containing only names, numbers and numpy arrays.
+    """
+    # Include the feedback buffered with config.CE_DEFER_FEEDBACK
+    brain.apply_feedback()
+    state = {
+        'timestep': brain.timestep,
+        'name_counter': len(utils.counter),
+        'cortices': {},
+        'correlations': {},
+    }
+
+    clusters_by_cortex = {name: {} for name in brain.cortices}
+    for cluster_data in db.clusters_to_nodes.data.values():
+        cluster = cluster_data['obj']
+        if cluster.cortex.brain is not brain:
+            continue
+
+        clusters_by_cortex[cluster.cortex.name][cluster.name] = {
+            'created_at': cluster.created_at,
+            'last_fired': cluster.last_fired,
+            'last_feedback_packet': cluster.last_feedback_packet,
+            'required_utilization': cluster.REQUIRED_UTILIZATION,
+            'nodes': [node.name for node in cluster_data['list']],
+            'strengths': list(cluster_data['strengths']),
+            'counts': list(cluster_data['count']),
+        }
+
+    for cortex_name, cortex in brain.cortices.items():
+        node_manager = cortex.node_manager
+        nodes = {}
+        for node in node_manager.nodes:
+            clusters, strengths, positions, counts = db.get_nodes_clusters(node, include_all=True)
+            nodes[node.name] = {
+                'position': _copy(node.position),
+                'momentum': _copy(node.position_momentum),
+                'created_at': node.created_at,
+                'last_utilized': node.last_utilized,
+                'qty_feedback_packets': node.qty_feedback_packets,
+                'clusters': [cluster.name for cluster in clusters],
+                'strengths': list(strengths),
+                'positions': [_copy(position) for position in positions],
+                'counts': list(counts),
+            }
+
+        state['cortices'][cortex_name] = {
+            'nodes': nodes,
+            'clusters': clusters_by_cortex[cortex_name],
+            'finished_initial': node_manager.finished_initial,
+            'avg_distance': node_manager.avg_distance,
+            'distance_count': node_manager.distance_count,
+            'avg_distance_momentum': node_manager.avg_distance_momentum,
+        }
+
+    for cluster_name, correlation in brain.cdz.correlations.items():
+        state['correlations'][cluster_name] = {
+            'age': correlation.age,
+            'connections': dict(correlation.connections),
+        }
+
+    return state
+
+
+def restore_state(state, brain=None, build_indexes=True):
+    """
+    Restores an exported state into a brain.
+
+    WARNING: The database is global, restoring a state resets it. Only one brain can live in a process that restores
+    a state.
+
+    :param state: A state returned by `export_state`.
+    :param brain: A freshly created brain without cortices. A new one is created if it is not given.
+    :param build_indexes: Whether to rebuild the nearest node indexes (default: True).
+    :return: The restored brain.
+    """
+    db.reset()
+    brain = brain if brain is not None else Brain()
+    brain.timestep = state['timestep']
+
+    # Make sure newly generated names never collide with the restored ones
+    utils.counter.extend([0] * max(state['name_counter'] - len(utils.counter), 0))
+
+    clusters = {}
+    nodes = {}
+    for cortex_name, cortex_state in state['cortices'].items():
+        cortex = brain.add_cortex(cortex_name, Autoencoder())
+
+        for cluster_name, cluster_state in cortex_state['clusters'].items():
+            cluster = Cluster(cortex, cluster_name, required_utilization=cluster_state['required_utilization'])
+            cluster.created_at = cluster_state['created_at']
+            cluster.last_fired = cluster_state['last_fired']
+            cluster.last_feedback_packet = cluster_state['last_feedback_packet']
+            clusters[cluster_name] = cluster
+            db.clusters.add(cluster)
+
+        for node_name, node_state in cortex_state['nodes'].items():
+            node = Node(cortex, _copy(node_state['position']), name=node_name)
+            node.position_momentum = _copy(node_state['momentum'])
+            node.created_at = node_state['created_at']
+            node.last_utilized = node_state['last_utilized']
+            node.qty_feedback_packets = node_state['qty_feedback_packets']
+            nodes[node_name] = node
+            db.nodes.add(node)
+
+        node_manager = cortex.node_manager
+        node_manager.finished_initial = cortex_state['finished_initial']
+        node_manager.avg_distance = cortex_state['avg_distance']
+        node_manager.distance_count = cortex_state['distance_count']
+        node_manager.avg_distance_momentum = cortex_state['avg_distance_momentum']
+
+        manager_nodes = [nodes[node_name] for node_name in cortex_state['nodes']]
+        db.node_manager_to_nodes.load(
+            node_manager, manager_nodes, [1 / max(len(manager_nodes), 1)] * len(manager_nodes),
+            [None] * len(manager_nodes), [1] * len(manager_nodes)
+        )
+
+    for cortex_state in state['cortices'].values():
+        for node_name, node_state in cortex_state['nodes'].items():
+            db.nodes_to_clusters.load(
+                nodes[node_name], [clusters[name] for name in node_state['clusters']], node_state['strengths'],
+                [_copy(position) for position in node_state['positions']], node_state['counts']
+            )
+
+        for cluster_name, cluster_state in cortex_state['clusters'].items():
+            db.clusters_to_nodes.load(
+                clusters[cluster_name], [nodes[name] for name in cluster_state['nodes']], cluster_state['strengths'],
+                [None] * len(cluster_state['nodes']), cluster_state['counts']
+            )
+
+    cdz = brain.cdz
+    for cluster_name, correlation_state in state['correlations'].items():
+        correlation = ClusterCorrelation(clusters[cluster_name], cdz)
+        correlation.age = correlation_state['age']
+        correlation.connections.update(correlation_state['connections'])
+        for connected_name in correlation_state['connections']:
+            correlation.cluster_objects[connected_name] = clusters[connected_name]
+        cdz.correlations[cluster_name] = correlation
+
+    # Rebuild the references from the connections
+    for cluster_name, correlation in cdz.correlations.items():
+        for connected_name in correlation.connections:
+            cdz.correlations[connected_name].add_ref(clusters[cluster_name])
+
+    if build_indexes:
+        brain.build_nrnd_indexes(force=True)
+    return brain
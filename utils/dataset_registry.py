@@ -0,0 +1,90 @@
+"""
+A registry of the datasets and of the arrays they load.
+
+Arrays are resolved relative to `config.DATA_DIR` (the package's `data` directory by default), not the current working
+directory, and are only opened on first use. They are opened memory-mapped and read-only, so worker processes share
+the same physical pages instead of each holding a copy of the dataset.
+"""
+
+import importlib
+import os
+
+import numpy as np
+
+from cdzproject import config
+
+# The available datasets, by name
+DATASETS = {
+    'mnist_fsdd': 'cdzproject.utils.encodings_mnist_fsdd',
+    'mnist_1d': 'cdzproject.utils.encodings_mnist_1d',
+    'mnist_mnist': 'cdzproject.utils.encodings_mnist_mnist',
+    'synthetic': 'cdzproject.utils.encodings_synthetic',
+}
+
+_arrays = {}
+
+
+def get_dataset(name):
+    """
+    Imports a dataset module by name. Importing a dataset module does not load any data.
+
+    :param name: The name of the dataset (see `DATASETS`) or the module name of a dataset.
+    :return: The dataset module.
+    """
+    return importlib.import_module(DATASETS.get(name, name))
+
+
+def get_path(filename):
+    """
+    Returns the absolute path of a data file.
+
+    :param filename: The name of the file in the data directory.
+    :return: The absolute path.
+    """
+    return os.path.join(config.DATA_DIR, filename)
+
+
+def load(filename):
+    """
+    Returns the array stored in a data file. The file is opened memory-mapped and read-only the first time it is
+    requested; later requests return the same array.
+
+    WARNING: The returned array is read-only. Copy the rows that are handed to the brain, as nodes are moved in place.
+
+    :param filename: The name of the `.npy` file in the data directory.
+    :return: The memory-mapped array.
+    """
+    if filename not in _arrays:
+        _arrays[filename] = np.load(get_path(filename), mmap_mode='r')
+    return _arrays[filename]
+
+
+def unload(prefix=''):
+    """
+    Forgets the arrays that were loaded from files whose names start with the prefix, e.g. after they were rewritten.
+
+    :param prefix: The file name prefix (default: every file).
+    """
+    for filename in [filename for filename in _arrays if filename.startswith(prefix)]:
+        del _arrays[filename]
+
+
+def lazy_attributes(module_globals, attributes):
+    """
+    Returns a module level `__getattr__` that loads the module's arrays on first access.
+
+    :param module_globals: The `globals()` of the dataset module. Loaded values are cached there.
+    :param attributes: A dictionary mapping attribute names to either a data file name or a function that computes
+                       the value.
+    :return: The `__getattr__` function.
+    """
+    def __getattr__(name):
+        if name not in attributes:
+            raise AttributeError("module '{}' has no attribute '{}'".format(module_globals['__name__'], name))
+
+        value = attributes[name]
+        value = load(value) if isinstance(value, str) else value()
+        module_globals[name] = value
+        return value
+
+    return __getattr__
@@ -1,19 +1,29 @@
 """
 This is a dataset where the audio encoding is simply an integer.
 This is useful for testing and experimentation purposes.
+
+Importing this module does not load any data. The visual arrays are memory-mapped on first access, see
+`dataset_registry.py`.
 """
 
 import random
 import numpy as np
 
-# Load visual data
-v_train_data = np.load('data/mnist_train_encodings.npy')
-v_train_labels = np.load('data/mnist_train_encodings_labels.npy')
+from cdzproject import config
+from cdzproject.utils import dataset_registry
+from cdzproject.utils.sample_stream import SampleStream
+
+_ARRAYS = {
+    # Visual data
+    'v_train_data': 'mnist_train_encodings.npy',
+    'v_train_labels': 'mnist_train_encodings_labels.npy',
+    'v_test_data': 'mnist_test_encodings.npy',
+    'v_test_labels': 'mnist_test_encodings_labels.npy',
+}
 
-v_test_data = np.load('data/mnist_test_encodings.npy')
-v_test_labels = np.load('data/mnist_test_encodings_labels.npy')
+__getattr__ = dataset_registry.lazy_attributes(globals(), _ARRAYS)
 
-# Load audio data
+# Audio data
 a_train_data = list(range(10))  # Convert range to list for Python 3 compatibility
 a_train_labels = list(range(10))
 
@@ -21,14 +31,37 @@ a_test_data = list(range(10))
 a_test_labels = list(range(10))
 
 
+def _load(name):
+    """Returns one of the dataset's arrays by attribute name."""
+    return dataset_registry.load(_ARRAYS[name])
+
+
 def get_random_train_data():
     """
     Retrieves a random training example consisting of a visual encoding, audio encoding, and label.
 
     :return: A tuple containing the visual encoding, audio encoding, and label.
     """
+    v_train_labels = _load('v_train_labels')
     rand_idx = random.randint(0, len(v_train_labels) - 1)
-    visual_encoding = v_train_data[rand_idx]
+    visual_encoding = np.array(_load('v_train_data')[rand_idx])
     label = v_train_labels[rand_idx]
     audio_encoding = [np.float32(label)]
-    return visual_encoding, audio_encoding, np.float32(label)
\ No newline at end of file
+    return visual_encoding, audio_encoding, np.float32(label)
+
+
+def sample_stream(batch_size=config.DATA_STREAM_BATCH_SIZE, prefetch=config.DATA_STREAM_PREFETCH, seed=None):
+    """
+    Returns a prefetching stream of random training examples, drawn in vectorized blocks by a background thread.
+    Iterating over it yields the same (visual encoding, audio encoding, label) tuples as `get_random_train_data()`.
+
+    :param batch_size: The number of examples drawn at once.
+    :param prefetch: The maximum number of ready batches kept in the buffer.
+    :param seed: The random seed.
+    :return: A SampleStream instance.
+    """
+    return SampleStream(
+        _load('v_train_data'), _load('v_train_labels'),
+        np.asarray(a_train_data, dtype=np.float32).reshape(-1, 1), a_train_labels,
+        batch_size=batch_size, prefetch=prefetch, seed=seed
+    )
@@ -1,29 +1,45 @@
 """
 This is the dataset used in the paper.
+
+Importing this module does not load any data. The arrays (`v_train_data`, `a_test_labels`, ...) are memory-mapped on
+first access, see `dataset_registry.py`.
 """
 
 import random
-from collections import defaultdict
+from functools import lru_cache
 import numpy as np
 
-# Load visual data
-v_train_data = np.load('../data/mnist_train_encodings.npy')
-v_train_labels = np.load('../data/mnist_train_encodings_labels.npy')
+from cdzproject import config
+from cdzproject.utils import dataset_registry
+from cdzproject.utils.sample_stream import SampleStream
+
+_ARRAYS = {
+    # Visual data
+    'v_train_data': 'mnist_train_encodings.npy',
+    'v_train_labels': 'mnist_train_encodings_labels.npy',
+    'v_test_data': 'mnist_test_encodings.npy',
+    'v_test_labels': 'mnist_test_encodings_labels.npy',
+
+    # Audio data
+    'a_train_data': 'fsdd_train_encodings.npy',
+    'a_train_labels': 'fsdd_train_encodings_labels.npy',
+    'a_test_data': 'fsdd_test_encodings.npy',
+    'a_test_labels': 'fsdd_test_encodings_labels.npy',
+}
 
-v_test_data = np.load('../data/mnist_test_encodings.npy')
-v_test_labels = np.load('../data/mnist_test_encodings_labels.npy')
+__getattr__ = dataset_registry.lazy_attributes(globals(), _ARRAYS)
 
-# Load audio data
-a_train_data = np.load('../data/fsdd_train_encodings.npy')
-a_train_labels = np.load('../data/fsdd_train_encodings_labels.npy')
 
-a_test_data = np.load('../data/fsdd_test_encodings.npy')  # Fixed typo: 'fsdd_test_encodingsnpy' → 'fsdd_test_encodings.npy'
-a_test_labels = np.load('../data/fsdd_test_encodings_labels.npy')
+def _load(name):
+    """Returns one of the dataset's arrays by attribute name."""
+    return dataset_registry.load(_ARRAYS[name])
 
-# Create a dictionary to map labels to audio encodings
-audio_dict = defaultdict(list)
-for idx, label in enumerate(a_train_labels):
-    audio_dict[str(label)].append(a_train_data[idx])
+
+@lru_cache(maxsize=None)
+def _audio_indices():
+    """Returns a dictionary mapping each label to the indices of its audio encodings."""
+    a_train_labels = _load('a_train_labels')
+    return {label: np.flatnonzero(a_train_labels == label) for label in np.unique(a_train_labels)}
 
 
 def get_random_train_data():
@@ -32,12 +48,29 @@ def get_random_train_data():
 
     :return: A tuple containing the visual encoding, audio encoding, and label.
     """
-    rand_idx = random.randint(0, len(v_train_data) - 1)
-    visual_encoding = v_train_data[rand_idx]
+    v_train_labels = _load('v_train_labels')
+    rand_idx = random.randint(0, len(v_train_labels) - 1)
+    visual_encoding = np.array(_load('v_train_data')[rand_idx])
     label = v_train_labels[rand_idx]
 
     # Get a random audio example of the same label
-    rand_idx_audio = random.randint(0, len(audio_dict[str(label)]) - 1)
-    audio_encoding = audio_dict[str(label)][rand_idx_audio]
+    audio_idxs = _audio_indices()[label]
+    audio_encoding = np.array(_load('a_train_data')[audio_idxs[random.randint(0, len(audio_idxs) - 1)]])
+
+    return visual_encoding, audio_encoding, np.float32(label)
 
-    return visual_encoding, audio_encoding, np.float32(label)
\ No newline at end of file
+
+def sample_stream(batch_size=config.DATA_STREAM_BATCH_SIZE, prefetch=config.DATA_STREAM_PREFETCH, seed=None):
+    """
+    Returns a prefetching stream of random training examples, drawn in vectorized blocks by a background thread.
+    Iterating over it yields the same (visual encoding, audio encoding, label) tuples as `get_random_train_data()`.
+
+    :param batch_size: The number of examples drawn at once.
+    :param prefetch: The maximum number of ready batches kept in the buffer.
+    :param seed: The random seed.
+    :return: A SampleStream instance.
+    """
+    return SampleStream(
+        _load('v_train_data'), _load('v_train_labels'), _load('a_train_data'), _load('a_train_labels'),
+        batch_size=batch_size, prefetch=prefetch, seed=seed
+    )
@@ -2,47 +2,106 @@
 A dataset that consists of 5 digits of MNIST as visual and different 5 digits as audio.
 
 It trains the network to classify the digits {0,1,2,3,4} in terms of {5,6,7,8,9} and vice versa.
+
+Importing this module does not load any data. The arrays are computed from the memory-mapped MNIST encodings on first
+access, see `dataset_registry.py`. The encodings of every split are sorted by label once, into a file next to them.
 """
 
+import os
 import random
-from collections import defaultdict
+from functools import lru_cache
 import numpy as np
 
-# Load visual data
-v_train_data = np.load('data/mnist_train_encodings_3.npy')
-v_train_labels = np.load('data/mnist_train_encodings_3_labels.npy')
+from cdzproject import config
+from cdzproject.utils import dataset_registry
+from cdzproject.utils.sample_stream import SampleStream
+
+_FILES = {
+    'train_data': 'mnist_train_encodings_3.npy',
+    'train_labels': 'mnist_train_encodings_3_labels.npy',
+    'test_data': 'mnist_test_encodings_3.npy',
+    'test_labels': 'mnist_test_encodings_3_labels.npy',
+}
+
+VISUAL_LABELS = range(5)
+AUDIO_LABELS = range(5, 10)
+
+
+@lru_cache(maxsize=None)
+def _label_indices(split):
+    """Returns a dictionary mapping each label to the indices of its encodings in the train or test split."""
+    labels = dataset_registry.load(_FILES[split + '_labels'])
+    return {label: np.flatnonzero(labels == label) for label in range(10)}
+
+
+def _sorted_filename(split):
+    """Returns the name of the file that holds the encodings of a split sorted by label."""
+    return _FILES[split + '_data'].replace('.npy', '_by_label.npy')
+
+
+def _sorted_data(split):
+    """
+    Returns the encodings of the train or test split sorted by label, memory-mapped.
+
+    The sorted copy is written to the data directory once, one label at a time, and is rewritten when it is older than
+    the encodings. The encodings of a range of labels are then a contiguous slice of it, which worker processes share
+    instead of each gathering a private copy.
 
-v_test_data = np.load('data/mnist_test_encodings_3.npy')
-v_test_labels = np.load('data/mnist_test_encodings_3_labels.npy')
+    :param split: Either 'train' or 'test'.
+    :return: The memory-mapped array.
+    """
+    filename = _sorted_filename(split)
+    path = dataset_registry.get_path(filename)
+    data_path = dataset_registry.get_path(_FILES[split + '_data'])
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(data_path):
+        data = dataset_registry.load(_FILES[split + '_data'])
+        # Write to a temporary file first, so other processes never open a partially written file.
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        sorted_data = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=data.dtype, shape=data.shape)
+        start = 0
+        for label, idxs in sorted(_label_indices(split).items()):
+            sorted_data[start:start + len(idxs)] = data[idxs]
+            start += len(idxs)
+        sorted_data.flush()
+        del sorted_data
+        os.replace(tmp_path, path)
+        dataset_registry.unload(filename)
+    return dataset_registry.load(filename)
 
-# Create dictionaries to map labels to data
-data_dict = defaultdict(list)
-for idx, label in enumerate(v_train_labels):
-    data_dict[label].append(v_train_data[idx])
 
-test_data_dict = defaultdict(list)
-for idx, label in enumerate(v_test_labels):
-    test_data_dict[label].append(v_test_data[idx])
+@lru_cache(maxsize=None)
+def _subset(split, labels):
+    """
+    Returns the encodings and labels of the given digits, grouped by digit. The encodings are a slice of the
+    memory-mapped, sorted encodings (see `_sorted_data`), not a copy.
 
-# Fix the train labels (digits 0-4)
-v_train_data = [item for label in range(5) for item in data_dict[label]]
-v_train_labels = [label for label in range(5) for _ in data_dict[label]]
-v_train_labels = np.ravel(v_train_labels)  # Flattens the list
+    :param split: Either 'train' or 'test'.
+    :param labels: The digits to keep, a range of consecutive digits.
+    :return: A tuple (data, labels) of arrays.
+    """
+    label_indices = _label_indices(split)
+    counts = [len(label_indices[label]) for label in range(10)]
+    start = sum(counts[:labels[0]])
+    end = start + sum(counts[label] for label in labels)
+    return (
+        _sorted_data(split)[start:end],
+        np.concatenate([np.full(counts[label], label) for label in labels])
+    )
 
-# Fix the test labels (digits 0-4)
-v_test_data = [item for label in range(5) for item in test_data_dict[label]]
-v_test_labels = [label for label in range(5) for _ in test_data_dict[label]]
-v_test_labels = np.ravel(v_test_labels)  # Flattens the list
 
-# Fix the train labels (digits 5-9)
-a_train_data = [item for label in range(5, 10) for item in data_dict[label]]
-a_train_labels = [label for label in range(5, 10) for _ in data_dict[label]]
-a_train_labels = np.ravel(a_train_labels)  # Flattens the list
+__getattr__ = dataset_registry.lazy_attributes(globals(), {
+    # The digits {0, 1, 2, 3, 4}
+    'v_train_data': lambda: _subset('train', VISUAL_LABELS)[0],
+    'v_train_labels': lambda: _subset('train', VISUAL_LABELS)[1],
+    'v_test_data': lambda: _subset('test', VISUAL_LABELS)[0],
+    'v_test_labels': lambda: _subset('test', VISUAL_LABELS)[1],
 
-# Fix the test labels (digits 5-9)
-a_test_data = [item for label in range(5, 10) for item in test_data_dict[label]]
-a_test_labels = [label for label in range(5, 10) for _ in test_data_dict[label]]
-a_test_labels = np.ravel(a_test_labels)  # Flattens the list
+    # The digits {5, 6, 7, 8, 9}
+    'a_train_data': lambda: _subset('train', AUDIO_LABELS)[0],
+    'a_train_labels': lambda: _subset('train', AUDIO_LABELS)[1],
+    'a_test_data': lambda: _subset('test', AUDIO_LABELS)[0],
+    'a_test_labels': lambda: _subset('test', AUDIO_LABELS)[1],
+})
 
 
 def get_random_train_data():
@@ -51,7 +110,28 @@ def get_random_train_data():
 
     :return: A tuple containing the visual encoding, audio encoding, and label.
     """
+    train_data = dataset_registry.load(_FILES['train_data'])
+    label_indices = _label_indices('train')
+
     v_label = random.randint(0, 4)  # Randomly select a label from {0, 1, 2, 3, 4}
-    visual_encoding = random.choice(data_dict[v_label])  # Randomly select a visual encoding for the label
-    audio_encoding = random.choice(data_dict[v_label + 5])  # Randomly select an audio encoding for the corresponding label + 5
-    return visual_encoding, audio_encoding, np.float32(v_label)
\ No newline at end of file
+    visual_encoding = np.array(train_data[random.choice(label_indices[v_label])])  # Randomly select a visual encoding for the label
+    audio_encoding = np.array(train_data[random.choice(label_indices[v_label + 5])])  # Randomly select an audio encoding for the corresponding label + 5
+    return visual_encoding, audio_encoding, np.float32(v_label)
+
+
+def sample_stream(batch_size=config.DATA_STREAM_BATCH_SIZE, prefetch=config.DATA_STREAM_PREFETCH, seed=None):
+    """
+    Returns a prefetching stream of random training examples, drawn in vectorized blocks by a background thread.
+    Iterating over it yields the same (visual encoding, audio encoding, label) tuples as `get_random_train_data()`.
+
+    :param batch_size: The number of examples drawn at once.
+    :param prefetch: The maximum number of ready batches kept in the buffer.
+    :param seed: The random seed.
+    :return: A SampleStream instance.
+    """
+    v_train_data, v_train_labels = _subset('train', VISUAL_LABELS)
+    a_train_data, a_train_labels = _subset('train', AUDIO_LABELS)
+    return SampleStream(
+        v_train_data, v_train_labels, a_train_data, a_train_labels, audio_label_offset=5, balanced_labels=True,
+        batch_size=batch_size, prefetch=prefetch, seed=seed
+    )
@@ -0,0 +1,320 @@
+"""
+A generated multimodal dataset for stress-testing how the system scales.
+
+`generate()` synthesizes a stream of paired (visual, audio) encodings and writes it to `config.SYNTH_DIR` (in
+`config.DATA_DIR`) as chunks of memory-mapped `.npy` files, so streams of 10M+ examples never have to fit in memory:
+    meta.json                                   the generation parameters and the chunk sizes
+    train_{visual,audio}_{NNNNN}.npy            float32 encodings of chunk NNNNN
+    train_{visual,audio}_labels_{NNNNN}.npy     int32 labels of chunk NNNNN
+    test_{visual,audio}[_labels].npy            the test set
+
+The generator controls:
+    - num_classes, visual_dims, audio_dims: the classes and the dimensions of each modality.
+    - overlap: the standard deviation of the encodings around their class center. Centers are drawn from a standard
+      normal distribution, so values around 0.5 and above make neighbouring classes overlap.
+    - label_noise: the fraction of pairs whose audio comes from another (random) class. The audio label is the class
+      the audio encoding actually belongs to.
+    - audio_modes: the number of distinct audio clusters of every class (one-to-many class mapping).
+    - drift: how far (in center units) every class center moves along a random direction from the start to the end of
+      the stream. The test set is drawn from the final centers.
+
+Like the other datasets, importing this module does not load any data. `v_train_data`, `a_train_labels`, ... are the
+first chunk of the stream (so that the training score stays cheap), `v_test_data`, ... the test set.
+`get_random_train_data()` and `sample_stream()` draw from the whole stream; `iter_batches()` replays it in order.
+"""
+
+import argparse
+import json
+import os
+import random
+from functools import lru_cache
+
+import numpy as np
+
+from cdzproject import config
+from cdzproject.utils import dataset_registry
+from cdzproject.utils.sample_stream import PrefetchingStream
+
+META_FILE = 'meta.json'
+
+# The number of examples generated at once. Bounds the memory used by `generate()`.
+_BLOCK_SIZE = 65536
+
+
+def _filename(name):
+    """Returns the name of a file of the dataset, relative to `config.DATA_DIR`."""
+    return os.path.join(config.SYNTH_DIR, name)
+
+
+def _chunk_filename(kind, chunk_idx):
+    """Returns the name of a file of a train chunk, e.g. 'train_visual_00003.npy'."""
+    return _filename('train_%s_%05d.npy' % (kind, chunk_idx))
+
+
+class _Generator(object):
+    """
+    Draws paired examples at given positions of the stream.
+    """
+
+    def __init__(self, num_classes, visual_dims, audio_dims, overlap, label_noise, audio_modes, drift, seed):
+        self.num_classes = num_classes
+        self.overlap = overlap
+        self.label_noise = label_noise
+        self.audio_modes = audio_modes
+        self.drift = drift
+        self.rng = np.random.default_rng(seed)
+
+        self.v_centers = self.rng.normal(size=(num_classes, visual_dims))
+        self.a_centers = self.rng.normal(size=(num_classes, audio_modes, audio_dims))
+        self.v_directions = self._unit(self.rng.normal(size=self.v_centers.shape))
+        self.a_directions = self._unit(self.rng.normal(size=self.a_centers.shape))
+
+    @staticmethod
+    def _unit(vectors):
+        """Scales vectors to unit length."""
+        return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+    def draw(self, progress):
+        """
+        Draws one example for every passed stream position.
+
+        :param progress: An array of positions in the stream, from 0 (start) to 1 (end). Determines the drift.
+        :return: A tuple (visual, audio, visual labels, audio labels) of arrays.
+        """
+        num_examples = len(progress)
+        v_labels = self.rng.integers(0, self.num_classes, num_examples)
+        a_labels = v_labels.copy()
+        noisy = self.rng.random(num_examples) < self.label_noise
+        a_labels[noisy] = self.rng.integers(0, self.num_classes, int(noisy.sum()))
+        modes = self.rng.integers(0, self.audio_modes, num_examples)
+
+        shift = self.drift * progress[:, None]
+        visual = self.v_centers[v_labels] + shift * self.v_directions[v_labels]
+        visual += self.rng.normal(0, self.overlap, visual.shape)
+        audio = self.a_centers[a_labels, modes] + shift * self.a_directions[a_labels, modes]
+        audio += self.rng.normal(0, self.overlap, audio.shape)
+        return visual, audio, v_labels, a_labels
+
+
+def _write_arrays(name, generator, num_examples, dims, start=0, total=None):
+    """
+    Generates examples and writes them to memory-mapped files, one block at a time.
+
+    :param name: The name of the files, e.g. 'train_{}_00003' ('{}' is replaced by the kind of array).
+    :param generator: The _Generator.
+    :param num_examples: The number of examples.
+    :param dims: A tuple (visual dims, audio dims).
+    :param start: The position of the first example in the stream.
+    :param total: The number of examples in the stream. None draws every example from the end of the stream.
+    """
+    shapes = {
+        'visual': ((num_examples, dims[0]), np.float32),
+        'audio': ((num_examples, dims[1]), np.float32),
+        'visual_labels': ((num_examples,), np.int32),
+        'audio_labels': ((num_examples,), np.int32),
+    }
+    arrays = {
+        kind: np.lib.format.open_memmap(
+            dataset_registry.get_path(_filename(name.format(kind) + '.npy')), mode='w+', dtype=dtype, shape=shape
+        )
+        for kind, (shape, dtype) in shapes.items()
+    }
+
+    for block_start in range(0, num_examples, _BLOCK_SIZE):
+        block_end = min(block_start + _BLOCK_SIZE, num_examples)
+        if total is None:
+            progress = np.ones(block_end - block_start)
+        else:
+            progress = np.arange(start + block_start, start + block_end) / max(total - 1, 1)
+
+        visual, audio, v_labels, a_labels = generator.draw(progress)
+        arrays['visual'][block_start:block_end] = visual
+        arrays['audio'][block_start:block_end] = audio
+        arrays['visual_labels'][block_start:block_end] = v_labels
+        arrays['audio_labels'][block_start:block_end] = a_labels
+
+    for array in arrays.values():
+        array.flush()
+
+
+def generate(num_examples, num_classes=10, visual_dims=64, audio_dims=32, overlap=0.1, label_noise=0.0,
+             audio_modes=1, drift=0.0, num_test_examples=10000, chunk_size=config.SYNTH_CHUNK_SIZE, seed=0):
+    """
+    Generates the dataset and writes it to `config.SYNTH_DIR`. An existing dataset is replaced.
+
+    :param num_examples: The number of paired training examples in the stream.
+    :param num_classes: The number of classes.
+    :param visual_dims: The number of dimensions of the visual encodings.
+    :param audio_dims: The number of dimensions of the audio encodings.
+    :param overlap: The standard deviation of the encodings around their class center.
+    :param label_noise: The fraction of pairs whose audio encoding comes from a random class.
+    :param audio_modes: The number of distinct audio clusters of every class.
+    :param drift: The distance every class center moves from the start to the end of the stream.
+    :param num_test_examples: The number of examples in the test set.
+    :param chunk_size: The number of examples per file.
+    :param seed: The random seed.
+    :return: The metadata of the dataset.
+    """
+    os.makedirs(dataset_registry.get_path(config.SYNTH_DIR), exist_ok=True)
+    dataset_registry.unload(config.SYNTH_DIR)
+    _metadata.cache_clear()
+    _forget_attributes()
+
+    generator = _Generator(num_classes, visual_dims, audio_dims, overlap, label_noise, audio_modes, drift, seed)
+    dims = (visual_dims, audio_dims)
+
+    chunk_sizes = []
+    for chunk_idx, start in enumerate(range(0, num_examples, chunk_size)):
+        chunk_sizes.append(min(chunk_size, num_examples - start))
+        _write_arrays('train_{}_%05d' % chunk_idx, generator, chunk_sizes[-1], dims, start=start, total=num_examples)
+    # The test set is drawn from the final distribution
+    _write_arrays('test_{}', generator, num_test_examples, dims)
+
+    meta = {
+        'num_examples': num_examples, 'num_classes': num_classes, 'visual_dims': visual_dims,
+        'audio_dims': audio_dims, 'overlap': overlap, 'label_noise': label_noise, 'audio_modes': audio_modes,
+        'drift': drift, 'num_test_examples': num_test_examples, 'chunk_sizes': chunk_sizes, 'seed': seed,
+    }
+    with open(dataset_registry.get_path(_filename(META_FILE)), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+@lru_cache(maxsize=None)
+def _metadata():
+    """Returns the metadata of the generated dataset."""
+    with open(dataset_registry.get_path(_filename(META_FILE))) as f:
+        return json.load(f)
+
+
+def _chunk(chunk_idx):
+    """Returns the memory-mapped (visual, audio, visual labels, audio labels) arrays of a train chunk."""
+    return tuple(
+        dataset_registry.load(_chunk_filename(kind, chunk_idx))
+        for kind in ('visual', 'audio', 'visual_labels', 'audio_labels')
+    )
+
+
+_ATTRIBUTES = {
+    'v_train_data': _chunk_filename('visual', 0),
+    'v_train_labels': _chunk_filename('visual_labels', 0),
+    'a_train_data': _chunk_filename('audio', 0),
+    'a_train_labels': _chunk_filename('audio_labels', 0),
+    'v_test_data': _filename('test_visual.npy'),
+    'v_test_labels': _filename('test_visual_labels.npy'),
+    'a_test_data': _filename('test_audio.npy'),
+    'a_test_labels': _filename('test_audio_labels.npy'),
+}
+
+__getattr__ = dataset_registry.lazy_attributes(globals(), _ATTRIBUTES)
+
+
+def _forget_attributes():
+    """Removes the arrays cached as module attributes, so that they are loaded again on next access."""
+    for name in _ATTRIBUTES:
+        globals().pop(name, None)
+
+
+def _gather(positions):
+    """
+    Copies the examples at the passed stream positions, grouped by chunk so that every chunk is read once.
+
+    :param positions: An array of positions in the stream.
+    :return: A tuple (visual, audio, labels) of float64 arrays. The labels are the visual labels.
+    """
+    meta = _metadata()
+    chunk_starts = np.cumsum([0] + meta['chunk_sizes'])
+    chunk_idxs = np.searchsorted(chunk_starts, positions, side='right') - 1
+
+    visual = np.empty((len(positions), meta['visual_dims']))
+    audio = np.empty((len(positions), meta['audio_dims']))
+    labels = np.empty(len(positions), dtype=np.float32)
+    for chunk_idx in np.unique(chunk_idxs):
+        rows = np.flatnonzero(chunk_idxs == chunk_idx)
+        offsets = positions[rows] - chunk_starts[chunk_idx]
+        order = np.argsort(offsets)
+        v_data, a_data, v_labels, a_labels = _chunk(chunk_idx)
+        visual[rows[order]] = v_data[offsets[order]]
+        audio[rows[order]] = a_data[offsets[order]]
+        labels[rows[order]] = v_labels[offsets[order]]
+    return visual, audio, labels
+
+
+def get_batch(batch_size, rng=None):
+    """
+    Draws random paired training examples from the whole stream.
+
+    :param batch_size: The number of examples.
+    :param rng: The numpy random generator (default: a new unseeded one).
+    :return: A tuple (visual, audio, labels) of arrays. The arrays are copies and can be handed to the brain.
+    """
+    rng = rng or np.random.default_rng()
+    return _gather(np.sort(rng.integers(0, _metadata()['num_examples'], batch_size)))
+
+
+def iter_batches(batch_size=config.DATA_STREAM_BATCH_SIZE):
+    """
+    Yields the stream in order, in batches. Use this to train on the drift of the stream.
+
+    :param batch_size: The number of examples per batch.
+    :return: A generator of (visual, audio, labels) arrays.
+    """
+    num_examples = _metadata()['num_examples']
+    for start in range(0, num_examples, batch_size):
+        yield _gather(np.arange(start, min(start + batch_size, num_examples)))
+
+
+def get_random_train_data():
+    """
+    Retrieves a random training example consisting of a visual encoding, audio encoding, and label.
+
+    :return: A tuple containing the visual encoding, audio encoding, and label.
+    """
+    visual, audio, labels = _gather(np.array([random.randrange(_metadata()['num_examples'])]))
+    return visual[0], audio[0], labels[0]
+
+
+class _SyntheticStream(PrefetchingStream):
+    """
+    A prefetching stream of random examples of the synthetic dataset. The examples are already paired, so none of the
+    label indexes of SampleStream are needed.
+    """
+
+    def _draw_batch(self):
+        """Draws one batch of random examples from the whole stream."""
+        return get_batch(self.batch_size, self.rng)
+
+
+def sample_stream(batch_size=config.DATA_STREAM_BATCH_SIZE, prefetch=config.DATA_STREAM_PREFETCH, seed=None):
+    """
+    Returns a prefetching stream of random training examples, drawn in vectorized blocks by a background thread.
+    Iterating over it yields the same (visual encoding, audio encoding, label) tuples as `get_random_train_data()`.
+
+    :param batch_size: The number of examples drawn at once.
+    :param prefetch: The maximum number of ready batches kept in the buffer.
+    :param seed: The random seed.
+    :return: A PrefetchingStream instance.
+    """
+    return _SyntheticStream(batch_size, prefetch, seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates the synthetic multimodal dataset.')
+    parser.add_argument('num_examples', type=int)
+    parser.add_argument('--classes', type=int, default=10)
+    parser.add_argument('--visual-dims', type=int, default=64)
+    parser.add_argument('--audio-dims', type=int, default=32)
+    parser.add_argument('--overlap', type=float, default=0.1)
+    parser.add_argument('--label-noise', type=float, default=0.0)
+    parser.add_argument('--audio-modes', type=int, default=1)
+    parser.add_argument('--drift', type=float, default=0.0)
+    parser.add_argument('--test-examples', type=int, default=10000)
+    parser.add_argument('--chunk-size', type=int, default=config.SYNTH_CHUNK_SIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate(
+        args.num_examples, num_classes=args.classes, visual_dims=args.visual_dims, audio_dims=args.audio_dims,
+        overlap=args.overlap, label_noise=args.label_noise, audio_modes=args.audio_modes, drift=args.drift,
+        num_test_examples=args.test_examples, chunk_size=args.chunk_size, seed=args.seed,
+    ))
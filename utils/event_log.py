@@ -0,0 +1,202 @@
+"""
+A binary log of the topology changes of a brain: nodes added, split, deleted and merged, clusters deleted and merged
+and nearest node indexes rebuilt.
+
+Every event is a fixed-size little-endian record (see `RECORD` and `DTYPE`):
+    event: uint8, timestep: uint64, cortex: 16 bytes (name, NUL padded), subject: int64, related: int64
+The subject and related ids are the numbers at the end of the node/cluster names (e.g. 42 for `visual_42` and
+`cluster_visual_42`), -1 if there is none:
+    NODE_ADDED       subject: the node (added while seeding the cortex)
+    NODE_SPLIT       subject: the new node, related: the node that was split
+    NODE_DELETED     subject: the node
+    NODE_MERGED      subject: the merged node, related: the node it was merged into
+    CLUSTER_DELETED  subject: the cluster
+    CLUSTER_MERGED   subject: the merged cluster, related: the cluster it was merged into
+    INDEX_REBUILT    subject: the number of nodes in the index
+
+Events are packed into an in-memory buffer and written by a background thread, so the hot path never waits on the
+disk. The log can be read back as a numpy structured array with `read_events` and aggregated with `summarize`.
+"""
+
+import atexit
+import queue
+import struct
+import threading
+
+import numpy as np
+
+from cdzproject import config
+
+NODE_ADDED = 1
+NODE_SPLIT = 2
+NODE_DELETED = 3
+CLUSTER_DELETED = 4
+INDEX_REBUILT = 5
+CLUSTER_MERGED = 6
+NODE_MERGED = 7
+
+EVENT_NAMES = {
+    NODE_ADDED: 'node_added',
+    NODE_SPLIT: 'node_split',
+    NODE_DELETED: 'node_deleted',
+    CLUSTER_DELETED: 'cluster_deleted',
+    INDEX_REBUILT: 'index_rebuilt',
+    CLUSTER_MERGED: 'cluster_merged',
+    NODE_MERGED: 'node_merged',
+}
+
+RECORD = struct.Struct('<BQ16sqq')
+DTYPE = np.dtype([
+    ('event', 'u1'), ('timestep', '<u8'), ('cortex', 'S16'), ('subject', '<i8'), ('related', '<i8')
+])
+assert DTYPE.itemsize == RECORD.size
+
+# The log events are written to, see `open_log`
+_log = None
+
+
+class EventLog(object):
+    """
+    Appends event records to a file through a buffer that is written by a background thread.
+    """
+
+    def __init__(self, path, buffer_size=config.EVENT_LOG_BUFFER_SIZE):
+        """
+        Initializes an EventLog instance and starts its writer thread.
+
+        :param path: The path of the log file. Events are appended if it exists.
+        :param buffer_size: The number of events buffered before they are handed to the writer thread.
+        """
+        self.path = path
+        self.buffer_limit = buffer_size * RECORD.size
+        self.buffer = bytearray()
+        self.file = open(path, 'ab')
+        self.chunks = queue.Queue()
+        self.writer = threading.Thread(target=self._write_chunks, daemon=True)
+        self.writer.start()
+
+    def emit(self, event, timestep, cortex_name, subject, related=-1):
+        """
+        Records an event.
+
+        :param event: The event type, e.g. NODE_ADDED.
+        :param timestep: The timestep of the event.
+        :param cortex_name: The name of the cortex. Truncated to 16 bytes.
+        :param subject: The id of the subject.
+        :param related: The id of the related item, -1 if there is none.
+        """
+        self.buffer += RECORD.pack(event, timestep, cortex_name.encode(), subject, related)
+        if len(self.buffer) >= self.buffer_limit:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the buffered events to the writer thread.
+        """
+        if self.buffer:
+            self.chunks.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def close(self):
+        """
+        Writes the remaining events and closes the file.
+        """
+        self.flush()
+        self.chunks.put(None)
+        self.writer.join()
+        self.file.close()
+
+    def _write_chunks(self):
+        """Writes the chunks of events until the log is closed."""
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            self.file.write(chunk)
+            # Make the events visible to readers while the brain is still running
+            if self.chunks.empty():
+                self.file.flush()
+
+
+def _name_id(name):
+    """Returns the number at the end of a node/cluster name, -1 if there is none."""
+    suffix = name.rsplit('_', 1)[-1]
+    return int(suffix) if suffix.isdigit() else -1
+
+
+def open_log(path, buffer_size=config.EVENT_LOG_BUFFER_SIZE):
+    """
+    Starts recording events to a file. The log is closed when the program exits.
+
+    :param path: The path of the log file.
+    :param buffer_size: The number of events buffered before they are written.
+    """
+    global _log
+    close_log()
+    _log = EventLog(path, buffer_size)
+    atexit.register(close_log)
+
+
+def current_log():
+    """
+    :return: The open EventLog, None if events are not being recorded.
+    """
+    return _log
+
+
+def close_log():
+    """
+    Stops recording events and writes the remaining ones.
+    """
+    global _log
+    if _log is not None:
+        _log.close()
+        _log = None
+        atexit.unregister(close_log)
+
+
+def emit(event, timestep, cortex_name, subject_name=None, related_name=None, subject_id=None):
+    """
+    Records an event if a log is open. Does nothing otherwise.
+
+    :param event: The event type, e.g. NODE_ADDED.
+    :param timestep: The timestep of the event.
+    :param cortex_name: The name of the cortex.
+    :param subject_name: The name of the node/cluster the event is about.
+    :param related_name: The name of the related node/cluster, if any.
+    :param subject_id: The subject id, for events that are not about a node/cluster (instead of `subject_name`).
+    """
+    if _log is None:
+        return
+
+    if subject_id is None:
+        subject_id = _name_id(subject_name)
+    _log.emit(event, timestep, cortex_name, subject_id, _name_id(related_name) if related_name else -1)
+
+
+def read_events(path):
+    """
+    Reads a log file.
+
+    :param path: The path of the log file.
+    :return: A numpy structured array with the fields of `DTYPE`.
+    """
+    return np.fromfile(path, dtype=DTYPE)
+
+
+def summarize(path, epoch_size=config.TRAINING_SET_SIZE):
+    """
+    Counts the events of a log per epoch, cortex and event type.
+
+    :param path: The path of the log file.
+    :param epoch_size: The number of timesteps in an epoch.
+    :return: A dictionary {epoch: {cortex name: {event name: count}}}, for the epochs that have events.
+    """
+    events = read_events(path)
+    epochs = events['timestep'] // int(epoch_size)
+
+    summary = {}
+    for (epoch, cortex, event), count in zip(*np.unique(
+            np.rec.fromarrays([epochs, events['cortex'], events['event']]), return_counts=True)):
+        summary.setdefault(int(epoch), {}).setdefault(cortex.decode(), {})[EVENT_NAMES[int(event)]] = int(count)
+    return summary
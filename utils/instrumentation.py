@@ -0,0 +1,363 @@
+"""
+Timers and counters around the stages of the hot path.
+
+Instrumentation works by wrapping the methods listed in `STAGES` while it is enabled, and restoring the original
+methods when it is disabled. Disabled instrumentation therefore costs nothing.
+
+While enabled, every call of a stage is counted. Hot stages are timed on one call out of `sample_every` on average;
+maintenance stages are timed on every call. Timings are passed to the sinks:
+    - HistogramSink: keeps a log-scale histogram per stage in memory.
+    - PrometheusSink: also writes the histograms to a file in the Prometheus text format, periodically.
+    - JSONSummarySink: also writes a JSON summary of every stage when it is closed (at the end of the run).
+
+Example:
+    instrumentation.enable([HistogramSink()])
+    ... train ...
+    histograms, = instrumentation.disable()
+    print(histograms.summary(instrumentation.calls()))
+
+Times are inclusive: the time of `node_manager.receive_encoding` includes `node_manager.find_nearest_node`.
+"""
+
+import atexit
+import bisect
+import functools
+import importlib
+import json
+import os
+import random
+import time
+from collections import defaultdict
+
+from cdzproject import config
+
+# The instrumented stages: (stage name, module, class, method, sampled)
+STAGES = (
+    ('node_manager.receive_encoding', 'cdzproject.modules.cortex.node_manager', 'NodeManager', 'receive_encoding',
+     True),
+    ('node_manager.find_nearest_node', 'cdzproject.modules.cortex.node_manager', 'NodeManager', '_find_nearest_node',
+     True),
+    ('db.adjust_node_to_cluster_strength', 'cdzproject.db.database', 'Database', 'adjust_node_to_cluster_strength',
+     True),
+    ('db.adjust_cluster_to_node_strength', 'cdzproject.db.database', 'Database', 'adjust_cluster_to_node_strength',
+     True),
+    ('cdz.receive_packet', 'cdzproject.modules.cdz.cdz', 'CDZ', 'receive_packet', True),
+    ('cdz.send_feedback_packet', 'cdzproject.modules.cdz.cdz', 'CDZ', '_send_feedback_packet', True),
+    ('brain.cleanup', 'cdzproject.brain', 'Brain', 'cleanup', False),
+    ('brain.create_new_nodes', 'cdzproject.brain', 'Brain', 'create_new_nodes', False),
+    ('node_manager.build_nrnd_index', 'cdzproject.modules.cortex.node_manager', 'NodeManager', 'build_nrnd_index',
+     False),
+)
+
+# The upper bounds (in seconds) of the histogram buckets: 1us, 2us, 4us, ... ~33s
+BUCKETS = tuple(1e-6 * 2 ** exponent for exponent in range(26))
+
+# The sinks of the enabled instrumentation
+sinks = []
+
+# The original methods of the instrumented stages, keyed by (class, method name)
+_originals = {}
+
+# The wrappers of the last enabled instrumentation, keyed by stage name. Kept after disabling to read the counts.
+_wrappers = {}
+
+
+class Histogram(object):
+    """
+    A histogram of durations with log-scale buckets (see `BUCKETS`).
+    """
+
+    def __init__(self):
+        """
+        Initializes a Histogram instance.
+        """
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """
+        Adds a duration.
+
+        :param seconds: The duration in seconds.
+        """
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """
+        Returns an upper bound of a percentile: the bound of the bucket the percentile falls in.
+
+        :param q: The percentile, between 0 and 100.
+        :return: The duration in seconds.
+        """
+        rank = q / 100 * self.count
+        cumulative = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class HistogramSink(object):
+    """
+    Keeps a histogram of the sampled durations of every stage in memory.
+    """
+
+    def __init__(self):
+        """
+        Initializes a HistogramSink instance.
+        """
+        self.histograms = defaultdict(Histogram)
+
+    def observe(self, stage, seconds):
+        """
+        Records the duration of a call.
+
+        :param stage: The name of the stage.
+        :param seconds: The duration in seconds.
+        """
+        self.histograms[stage].observe(seconds)
+
+    def summary(self, calls):
+        """
+        Summarizes every stage.
+
+        :param calls: The number of calls of every stage, keyed by stage name.
+        :return: A dictionary keyed by stage name. The estimated total time extrapolates the sampled calls to all the
+                 calls of the stage.
+        """
+        summary = {}
+        for stage, histogram in sorted(self.histograms.items()):
+            mean = histogram.sum / histogram.count
+            summary[stage] = {
+                'calls': calls.get(stage, histogram.count),
+                'sampled_calls': histogram.count,
+                'estimated_total_s': mean * calls.get(stage, histogram.count),
+                'mean_ms': mean * 1000,
+                'p50_ms': histogram.percentile(50) * 1000,
+                'p90_ms': histogram.percentile(90) * 1000,
+                'p99_ms': histogram.percentile(99) * 1000,
+                'max_ms': histogram.max * 1000,
+            }
+        return summary
+
+    def close(self, calls):
+        """
+        Called when instrumentation is disabled.
+
+        :param calls: The number of calls of every stage, keyed by stage name.
+        """
+
+
+class PrometheusSink(HistogramSink):
+    """
+    Writes the histograms to a file in the Prometheus text exposition format, e.g. for the node exporter's textfile
+    collector.
+    """
+
+    def __init__(self, path=config.INSTR_PROMETHEUS_FILE, interval=config.INSTR_PROMETHEUS_INTERVAL):
+        """
+        Initializes a PrometheusSink instance.
+
+        :param path: The path of the file. It is replaced atomically.
+        :param interval: The minimum number of seconds between writes.
+        """
+        super(PrometheusSink, self).__init__()
+        self.path = path
+        self.interval = interval
+        self.last_write = time.time()
+
+    def observe(self, stage, seconds):
+        """
+        Records the duration of a call and writes the file if `interval` passed since the last write.
+
+        :param stage: The name of the stage.
+        :param seconds: The duration in seconds.
+        """
+        super(PrometheusSink, self).observe(stage, seconds)
+        if time.time() - self.last_write >= self.interval:
+            self.write(calls())
+
+    def write(self, calls):
+        """
+        Writes the file.
+
+        :param calls: The number of calls of every stage, keyed by stage name.
+        """
+        lines = [
+            '# HELP cdz_stage_seconds Sampled durations of the instrumented stages.',
+            '# TYPE cdz_stage_seconds histogram',
+        ]
+        for stage, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append('cdz_stage_seconds_bucket{stage="%s",le="%g"} %d' % (stage, bound, cumulative))
+            lines.append('cdz_stage_seconds_bucket{stage="%s",le="+Inf"} %d' % (stage, histogram.count))
+            lines.append('cdz_stage_seconds_sum{stage="%s"} %r' % (stage, histogram.sum))
+            lines.append('cdz_stage_seconds_count{stage="%s"} %d' % (stage, histogram.count))
+
+        lines.append('# HELP cdz_stage_calls_total Calls of the instrumented stages.')
+        lines.append('# TYPE cdz_stage_calls_total counter')
+        for stage, count in sorted(calls.items()):
+            lines.append('cdz_stage_calls_total{stage="%s"} %d' % (stage, count))
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+        self.last_write = time.time()
+
+    def close(self, calls):
+        """
+        Writes the file a last time.
+
+        :param calls: The number of calls of every stage, keyed by stage name.
+        """
+        self.write(calls)
+
+
+class JSONSummarySink(HistogramSink):
+    """
+    Writes a JSON summary of every stage (see `HistogramSink.summary`) when instrumentation is disabled.
+    """
+
+    def __init__(self, path=config.INSTR_SUMMARY_FILE):
+        """
+        Initializes a JSONSummarySink instance.
+
+        :param path: The path of the file.
+        """
+        super(JSONSummarySink, self).__init__()
+        self.path = path
+
+    def close(self, calls):
+        """
+        Writes the summary.
+
+        :param calls: The number of calls of every stage, keyed by stage name.
+        """
+        with open(self.path, 'w') as f:
+            json.dump(self.summary(calls), f, indent=2, sort_keys=True)
+
+
+def _observe(stage, seconds):
+    """Passes a duration to the sinks."""
+    for sink in sinks:
+        sink.observe(stage, seconds)
+
+
+def _instrument(stage, function, sample_every):
+    """
+    Returns a wrapper of a method that counts its calls and times one call out of `sample_every` on average.
+
+    :param stage: The name of the stage.
+    :param function: The method to wrap.
+    :param sample_every: Time one call out of this many.
+    :return: The wrapper.
+    """
+    perf_counter = time.perf_counter
+    randrange = random.randrange
+    count = 0
+    next_sample = randrange(1, 2 * sample_every) if sample_every > 1 else 1
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        nonlocal count, next_sample
+        count += 1
+        if count < next_sample:
+            return function(*args, **kwargs)
+
+        # Jitter the sampling interval so that it does not alias with periodic work (e.g. the maintenance schedule)
+        next_sample = count + (randrange(1, 2 * sample_every) if sample_every > 1 else 1)
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _observe(stage, perf_counter() - start)
+
+    wrapper.calls = lambda: count
+    return wrapper
+
+
+def calls():
+    """
+    Returns the number of calls of every stage since instrumentation was last enabled.
+
+    :return: A dictionary keyed by stage name.
+    """
+    return {stage: wrapper.calls() for stage, wrapper in _wrappers.items()}
+
+
+def default_sinks():
+    """
+    Returns the sinks configured in `config`: always a HistogramSink, plus a PrometheusSink if
+    `config.INSTR_PROMETHEUS_FILE` is set and a JSONSummarySink if `config.INSTR_SUMMARY_FILE` is set.
+
+    :return: A list of sinks.
+    """
+    configured_sinks = [HistogramSink()]
+    if config.INSTR_PROMETHEUS_FILE:
+        configured_sinks.append(PrometheusSink(config.INSTR_PROMETHEUS_FILE, config.INSTR_PROMETHEUS_INTERVAL))
+    if config.INSTR_SUMMARY_FILE:
+        configured_sinks.append(JSONSummarySink(config.INSTR_SUMMARY_FILE))
+    return configured_sinks
+
+
+def is_enabled():
+    """
+    :return: True if the stages are instrumented.
+    """
+    return bool(_originals)
+
+
+def enable(new_sinks=None, sample_every=config.INSTR_SAMPLE_EVERY):
+    """
+    Instruments the stages in `STAGES`. Does nothing if instrumentation is already enabled.
+    Instrumentation is disabled (and the sinks are closed) when the program exits.
+
+    :param new_sinks: The sinks to pass the timings to (default: `default_sinks()`).
+    :param sample_every: Time one call of a hot stage out of this many.
+    """
+    if is_enabled():
+        return
+
+    _wrappers.clear()
+    sinks[:] = new_sinks if new_sinks is not None else default_sinks()
+
+    for stage, module_name, class_name, method_name, sampled in STAGES:
+        cls = getattr(importlib.import_module(module_name), class_name)
+        original = cls.__dict__[method_name]
+        _originals[(cls, method_name)] = original
+        _wrappers[stage] = _instrument(stage, original, sample_every if sampled else 1)
+        setattr(cls, method_name, _wrappers[stage])
+
+    atexit.register(disable)
+
+
+def disable():
+    """
+    Restores the original methods and closes the sinks. Does nothing if instrumentation is not enabled.
+
+    :return: The sinks, e.g. to read the in-memory histograms.
+    """
+    if not is_enabled():
+        return []
+
+    for (cls, method_name), original in _originals.items():
+        setattr(cls, method_name, original)
+    _originals.clear()
+    atexit.unregister(disable)
+
+    closed_sinks = list(sinks)
+    counts = calls()
+    for sink in closed_sinks:
+        sink.close(counts)
+    del sinks[:]
+    return closed_sinks
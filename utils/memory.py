@@ -0,0 +1,334 @@
+"""
+Estimates how much memory each subsystem of a brain uses (see `Brain.memory_report()`), and evicts state to keep it
+within a budget (see `Brain.enforce_memory_budget()`).
+
+Sizes are estimated from the `nbytes` of numpy arrays plus `sys.getsizeof` of the Python objects, dicts and lists that
+hold the state. Arrays that share memory (e.g. a node position that is a view of a batch of encodings, or a relation
+position that is the same array as a node's last encoding) are counted once, in the first subsystem that references
+them, including the whole buffer they are a view of. Annoy indexes are not Python objects; their size is estimated from
+the number of items, dimensions and trees.
+
+Subsystems:
+    - nodes: Node handles.
+    - node_arrays: the node stores (positions, momenta, counters) and the last encodings of the nodes.
+    - clusters: Cluster handles and the cluster stores.
+    - relations: the entries of the node/cluster/node manager relationship tables (lists, strengths, counts).
+    - relation_positions: the mean positions stored per node to cluster relation.
+    - cdz: the CDZ correlations (connections, cluster references), the packet queue and the buffered feedback.
+    - indexes: the nearest node indexes (Annoy or partitions).
+"""
+
+import math
+import sys
+import tracemalloc
+
+import numpy as np
+
+from cdzproject import db, config
+
+SUBSYSTEMS = ('nodes', 'node_arrays', 'clusters', 'relations', 'relation_positions', 'cdz', 'indexes')
+
+# The counters of `enforce_budget`
+EVICTION_COUNTERS = ('rounds', 'nodes', 'clusters', 'connections', 'positions')
+
+
+class _Accountant(object):
+    """
+    Sums object sizes per subsystem and cortex, counting every object at most once.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.subsystems = dict.fromkeys(SUBSYSTEMS, 0)
+        self.cortices = {}
+
+    def add(self, subsystem, cortex_name, nbytes):
+        """Adds bytes to a subsystem and a cortex."""
+        self.subsystems[subsystem] += nbytes
+        cortex = self.cortices.setdefault(cortex_name, dict.fromkeys(SUBSYSTEMS, 0))
+        cortex[subsystem] += nbytes
+
+    def size(self, obj):
+        """Returns the size of an object that was not counted yet (0 otherwise). Arrays include their buffer."""
+        if obj is None or id(obj) in self.seen:
+            return 0
+        self.seen.add(id(obj))
+
+        if isinstance(obj, np.ndarray):
+            # The data of a view belongs to its root array
+            root = obj
+            while isinstance(root.base, np.ndarray):
+                root = root.base
+            size = sys.getsizeof(obj) if root is obj else sys.getsizeof(obj) + self.size(root)
+            return size
+
+        return sys.getsizeof(obj)
+
+    def size_of_instance(self, obj):
+        """Returns the size of an object and of its attribute dictionary."""
+        return self.size(obj) + self.size(getattr(obj, '__dict__', None))
+
+    def size_of_list(self, items):
+        """Returns the size of a list and of the numbers it contains (not of other objects it references)."""
+        return self.size(items) + sum(self.size(item) for item in items if isinstance(item, (int, float)))
+
+
+def _annoy_size(num_items, dims, num_trees):
+    """
+    Estimates the memory of an Annoy euclidean index. Every item and every split node is a node of 16 + 4 * dims bytes;
+    leaves hold up to dims + 2 items, so every tree has about 2 * num_items / (dims + 2) split nodes.
+    """
+    num_nodes = num_items + num_trees * max(1, 2 * num_items // (dims + 2))
+    return num_nodes * (16 + 4 * dims)
+
+
+def _tracemalloc_report():
+    """Returns the memory traced by tracemalloc, in total and per source file of the package."""
+    if not tracemalloc.is_tracing():
+        return {'tracing': False}
+
+    current, peak = tracemalloc.get_traced_memory()
+    package_dir = config.__file__.rsplit('/', 1)[0]
+    by_file = {}
+    for stat in tracemalloc.take_snapshot().statistics('filename'):
+        filename = stat.traceback[0].filename
+        if filename.startswith(package_dir):
+            by_file[filename[len(package_dir) + 1:]] = stat.size
+
+    return {'tracing': True, 'current': current, 'peak': peak, 'by_file': by_file}
+
+
+def _account_node(accountant, cortex_name, node):
+    """Adds a node, its last encoding and its relations to clusters."""
+    accountant.add('nodes', cortex_name, accountant.size_of_instance(node))
+    accountant.add('node_arrays', cortex_name, accountant.size(node.last_encoding))
+
+    data = db.nodes_to_clusters.get(node)
+    accountant.add('relations', cortex_name, accountant.size(data) + accountant.size_of_list(data['list']) +
+                   accountant.size_of_list(data['strengths']) + accountant.size_of_list(data['count']))
+    accountant.add('relation_positions', cortex_name, accountant.size(data['position']) +
+                   sum(accountant.size(position) for position in data['position']))
+
+
+def _account_correlation(accountant, cortex_name, correlation):
+    """Adds the CDZ correlation of a cluster."""
+    accountant.add('cdz', cortex_name, accountant.size_of_instance(correlation) +
+                   accountant.size(correlation.connections) +
+                   sum(accountant.size(strength) for strength in correlation.connections.values()) +
+                   accountant.size(correlation.cluster_objects) + accountant.size(correlation.ref_clusters))
+
+
+def _account_cluster(accountant, brain, data):
+    """Adds a cluster, given its entry in `db.clusters_to_nodes`, its relations to nodes and its CDZ correlation."""
+    cluster = data['obj']
+    cortex_name = cluster.cortex.name
+    accountant.add('clusters', cortex_name, accountant.size_of_instance(cluster))
+    accountant.add('relations', cortex_name, accountant.size(data) + accountant.size_of_list(data['list']) +
+                   accountant.size_of_list(data['strengths']) + accountant.size_of_list(data['count']) +
+                   accountant.size_of_list(data['position']))
+
+    correlation = brain.cdz.correlations.get(cluster.name)
+    if correlation:
+        _account_correlation(accountant, cortex_name, correlation)
+
+
+def memory_report(brain, trace=False):
+    """
+    Estimates the memory used by a brain, per subsystem and per cortex.
+
+    :param brain: The brain.
+    :param trace: Whether to add the memory traced by tracemalloc, per source file of the package. Only available if
+                  tracemalloc was started before the brain was built (e.g. `python -X tracemalloc`).
+    :return: A dictionary with the total bytes, the bytes per subsystem and the bytes per subsystem of every cortex.
+    """
+    # Before the accounting, so that the snapshot does not include it
+    traced = _tracemalloc_report() if trace else None
+
+    accountant = _Accountant()
+    for cortex_name, cortex in brain.cortices.items():
+        node_manager = cortex.node_manager
+        store = node_manager.store
+        accountant.add('node_arrays', cortex_name, accountant.size_of_instance(store) + accountant.size(store.free_rows) +
+                       sum(accountant.size(getattr(store, name)) for name in store.columns))
+        cluster_store = cortex.cluster_store
+        accountant.add('clusters', cortex_name, accountant.size_of_instance(cluster_store) +
+                       accountant.size(cluster_store.free_rows) + accountant.size(cluster_store.clusters) +
+                       sum(accountant.size(getattr(cluster_store, name)) for name in cluster_store.columns))
+        for node in node_manager.nodes:
+            _account_node(accountant, cortex_name, node)
+
+        data = db.node_manager_to_nodes.data.get(node_manager.name)
+        if data:
+            accountant.add('relations', cortex_name, accountant.size(data) + accountant.size_of_list(data['list']) +
+                           accountant.size_of_list(data['strengths']) + accountant.size_of_list(data['count']) +
+                           accountant.size_of_list(data['position']))
+
+        if node_manager.partitions is not None:
+            accountant.add('indexes', cortex_name, accountant.size_of_instance(node_manager.partitions) +
+                           node_manager.partitions.nbytes)
+        if node_manager.nn_index:
+            accountant.add('indexes', cortex_name, _annoy_size(
+                node_manager.nn_index.get_n_items(), store.positions.shape[1], node_manager.nn_index.get_n_trees()
+            ))
+
+    for data in db.clusters_to_nodes.data.values():
+        if data['obj'].cortex.brain is brain:
+            _account_cluster(accountant, brain, data)
+
+    for packet in brain.cdz.packet_queue:
+        accountant.add('cdz', packet.cluster.cortex.name, accountant.size_of_instance(packet))
+    for node, cluster, amount, encoding in brain.cdz.feedback_buffer:
+        accountant.add('cdz', cluster.cortex.name, accountant.size((node, cluster, amount, encoding)) +
+                       accountant.size(amount))
+
+    report = {
+        'total': sum(accountant.subsystems.values()),
+        'subsystems': accountant.subsystems,
+        'cortices': accountant.cortices,
+    }
+    if trace:
+        report['tracemalloc'] = traced
+    return report
+
+
+def _last_used(node):
+    """Returns the last timestep a node was utilized (or created)."""
+    return max(node.created_at, node.last_utilized if node.last_utilized is not None else 0)
+
+
+def _evict_nodes(brain, fraction, evictions):
+    """
+    Tears down the least recently used nodes of every cortex, keeping at least one, and deletes the clusters that are
+    left without nodes.
+
+    :return: A tuple (number of nodes and clusters evicted, estimated bytes freed).
+    """
+    # Measures what is evicted, with the same estimates as `memory_report`
+    accountant = _Accountant()
+    qty_evicted = 0
+    for cortex in brain.cortices.values():
+        nodes = sorted(cortex.node_manager.nodes, key=_last_used)
+        qty_nodes = min(int(math.ceil(len(nodes) * fraction)), len(nodes) - 1)
+        for node in nodes[:qty_nodes]:
+            _account_node(accountant, cortex.name, node)
+            node.teardown()
+
+        if qty_nodes:
+            # The index refers to the nodes by their position in the list, rebuild it if there is one
+            cortex.node_manager.build_nrnd_index()
+        qty_evicted += qty_nodes
+    evictions['nodes'] += qty_evicted
+
+    clusters = [
+        cluster for cluster in db.clusters_to_nodes.get_items_without_related_items() if cluster.cortex.brain is brain
+    ]
+    for cluster in clusters:
+        _account_cluster(accountant, brain, db.clusters_to_nodes.get(cluster))
+        db._delete_cluster(cluster)
+    evictions['clusters'] += len(clusters)
+
+    return qty_evicted + len(clusters), sum(accountant.subsystems.values())
+
+
+def _evict_connections(brain, fraction, evictions):
+    """
+    Removes the weakest CDZ connections. The strongest connection of every cluster is kept.
+
+    :return: A tuple (number of connections evicted, estimated bytes freed).
+    """
+    connections = []
+    for correlation in brain.cdz.correlations.values():
+        if not correlation.connections:
+            continue
+        strongest = max(correlation.connections, key=correlation.connections.get)
+        connections.extend(
+            (strength, correlation.cluster, correlation.cluster_objects[cluster_name])
+            for cluster_name, strength in correlation.connections.items() if cluster_name != strongest
+        )
+
+    connections.sort(key=lambda connection: connection[0])
+    qty_connections = int(math.ceil(len(connections) * fraction))
+    evicted = connections[:qty_connections]
+    correlations = {}
+    for strength, cluster, connected_cluster in evicted:
+        for changed_cluster in (cluster, connected_cluster):
+            correlations[changed_cluster.name] = brain.cdz.correlations[changed_cluster.name]
+
+    # The correlations stay, measure them before and after the removal
+    before = _Accountant()
+    for correlation in correlations.values():
+        _account_correlation(before, correlation.cluster.cortex.name, correlation)
+    for strength, cluster, connected_cluster in evicted:
+        brain.cdz.remove_connection(cluster, connected_cluster)
+    after = _Accountant()
+    for correlation in correlations.values():
+        _account_correlation(after, correlation.cluster.cortex.name, correlation)
+
+    evictions['connections'] += qty_connections
+    return qty_connections, before.subsystems['cdz'] - after.subsystems['cdz']
+
+
+def _evict_positions(brain, fraction, evictions):
+    """
+    Drops the mean positions stored for the relations of the least recently used nodes of every cortex. The means
+    restart from the next encodings the nodes receive.
+
+    :return: A tuple (number of positions evicted, estimated bytes freed).
+    """
+    accountant = _Accountant()
+    qty_evicted = 0
+    nbytes = 0
+    for cortex in brain.cortices.values():
+        nodes = [
+            node for node in sorted(cortex.node_manager.nodes, key=_last_used)
+            if any(position is not None for position in db.nodes_to_clusters.get(node)['position'])
+        ]
+        for node in nodes[:int(math.ceil(len(nodes) * fraction))]:
+            # A position that is the node's last encoding stays alive
+            accountant.size(node.last_encoding)
+            nbytes += sum(accountant.size(position) for position in db.nodes_to_clusters.get(node)['position'])
+            qty_evicted += db.nodes_to_clusters.reset_positions(node)
+
+    evictions['positions'] += qty_evicted
+    return qty_evicted, nbytes
+
+
+_EVICTORS = {
+    'nodes': _evict_nodes,
+    'connections': _evict_connections,
+    'positions': _evict_positions,
+}
+
+
+def enforce_budget(brain, budget, evictions, order=config.BRN_MEMORY_EVICTION_ORDER,
+                   fraction=config.BRN_MEMORY_EVICTION_FRACTION):
+    """
+    Evicts state until the estimated memory of a brain is within a budget. Every round evicts up to `fraction` of the
+    nodes, connections and positions, in the given order, and stops as soon as the brain is within the budget.
+
+    :param brain: The brain.
+    :param budget: The budget in bytes.
+    :param evictions: A dictionary of counters (see `EVICTION_COUNTERS`), updated with what was evicted.
+    :param order: The order of the evictions: 'nodes', 'connections' and/or 'positions'.
+    :param fraction: The maximum fraction of the items of a kind evicted per round.
+    :return: The estimated memory after the eviction. It may remain over the budget if there is nothing left to evict.
+    """
+    total = memory_report(brain)['total']
+    if total <= budget:
+        return total
+
+    # Between the two reports, the estimate is updated with the bytes every eviction frees
+    while total > budget:
+        evictions['rounds'] += 1
+        qty_evicted = 0
+        for kind in order:
+            qty, nbytes = _EVICTORS[kind](brain, fraction, evictions)
+            qty_evicted += qty
+            total -= nbytes
+            if total <= budget:
+                break
+
+        if not qty_evicted:
+            break
+
+    return memory_report(brain)['total']
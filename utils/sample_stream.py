@@ -0,0 +1,221 @@
+"""
+A prefetching stream of paired (visual, audio, label) training examples.
+
+Indices are drawn in large vectorized blocks using per-label index arrays, and a background thread keeps a bounded
+buffer of ready batches so that sampling costs (almost) nothing on the training thread.
+"""
+
+import queue
+import threading
+
+import numpy as np
+
+from cdzproject import config
+
+# Put in the buffer by `close()`, so that the consumers waiting for a batch stop instead of waiting forever
+_CLOSED = object()
+
+
+class _Failure(object):
+    """
+    Put in the buffer when drawing a batch fails, so that the consumers raise the error instead of waiting forever.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+class _LabelIndex(object):
+    """
+    Groups the indices of a dataset by label, so that a random example of any label can be drawn in O(1).
+    """
+
+    def __init__(self, labels):
+        """
+        Initializes a _LabelIndex instance.
+
+        :param labels: The labels of the dataset, one per example.
+        """
+        labels = np.asarray(labels).ravel()
+        self.order = np.argsort(labels, kind='stable')
+        self.labels, self.starts, self.counts = np.unique(labels[self.order], return_index=True, return_counts=True)
+
+    def label_positions(self, labels):
+        """
+        Returns the positions of the passed labels in `self.labels`.
+
+        :param labels: An array of labels. Every label must be present in the dataset.
+        :return: An array of positions.
+        """
+        positions = np.searchsorted(self.labels, labels)
+        assert np.all(self.labels[np.minimum(positions, len(self.labels) - 1)] == labels), 'Unknown label.'
+        return positions
+
+    def draw(self, positions, rng):
+        """
+        Draws one random example index for every passed label position.
+
+        :param positions: An array of label positions (see `label_positions`).
+        :param rng: The random generator.
+        :return: An array of example indices.
+        """
+        offsets = (rng.random(len(positions)) * self.counts[positions]).astype(np.int64)
+        return self.order[self.starts[positions] + offsets]
+
+
+class PrefetchingStream(object):
+    """
+    A stream of batches drawn by `_draw_batch()`, which subclasses implement. A background thread keeps a bounded
+    buffer of ready batches.
+
+    Iterating over the stream yields (visual_encoding, audio_encoding, label) tuples, just like
+    `get_random_train_data()`. `batches()` yields whole (visual, audio, labels) batches.
+    """
+
+    def __init__(self, batch_size=config.DATA_STREAM_BATCH_SIZE, prefetch=config.DATA_STREAM_PREFETCH, seed=None):
+        """
+        Initializes a PrefetchingStream instance.
+
+        :param batch_size: The number of examples drawn at once.
+        :param prefetch: The maximum number of ready batches kept in the buffer.
+        :param seed: The random seed.
+        """
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+
+        self.buffer = queue.Queue(maxsize=prefetch)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _draw_batch(self):
+        """
+        Draws one batch of examples.
+
+        :return: A tuple (visual, audio, labels) of arrays.
+        """
+        raise NotImplementedError
+
+    def _fill_buffer(self):
+        """
+        Keeps the buffer full until the stream is closed. Runs in a background thread. If drawing a batch fails, the
+        error is put in the buffer and the thread stops.
+        """
+        while not self.stop_event.is_set():
+            try:
+                batch = self._draw_batch()
+            except Exception as error:
+                batch = _Failure(error)
+
+            while not self.stop_event.is_set():
+                try:
+                    self.buffer.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+            if isinstance(batch, _Failure):
+                return
+
+    def _drain_buffer(self):
+        """Removes every batch (and the closing marker) from the buffer."""
+        while True:
+            try:
+                self.buffer.get_nowait()
+            except queue.Empty:
+                return
+
+    def start(self):
+        """
+        Starts the background thread. This is called automatically when the stream is first used, and restarts a
+        closed stream.
+        """
+        if self.thread is None:
+            self.stop_event.clear()
+            self._drain_buffer()
+            self.thread = threading.Thread(target=self._fill_buffer, name='SampleStream', daemon=True)
+            self.thread.start()
+
+    def close(self):
+        """
+        Stops the background thread. The iterations over the stream that are in progress end.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self._drain_buffer()
+        self.buffer.put(_CLOSED)
+
+    def batches(self):
+        """
+        Yields (visual, audio, labels) batches of `batch_size` paired examples, until the stream is closed. Raises the
+        error of the background thread if drawing a batch failed.
+        """
+        self.start()
+        while True:
+            batch = self.buffer.get()
+            if batch is _CLOSED or isinstance(batch, _Failure):
+                # Leave the marker for the other consumers
+                self.buffer.put(batch)
+                if batch is _CLOSED:
+                    return
+                raise batch.error
+            yield batch
+
+    def __iter__(self):
+        for visual, audio, labels in self.batches():
+            for idx in range(len(labels)):
+                # Copies, so that the nodes created from (and moved in place from) an encoding do not keep the whole
+                # batch alive
+                yield visual[idx].copy(), audio[idx].copy(), labels[idx]
+
+
+class SampleStream(PrefetchingStream):
+    """
+    Draws random paired training examples. The audio example always has the label of the visual example plus
+    `audio_label_offset`.
+    """
+
+    def __init__(self, v_data, v_labels, a_data, a_labels, audio_label_offset=0, balanced_labels=False,
+                 batch_size=config.DATA_STREAM_BATCH_SIZE, prefetch=config.DATA_STREAM_PREFETCH, seed=None):
+        """
+        Initializes a SampleStream instance.
+
+        :param v_data: The visual encodings.
+        :param v_labels: The visual labels.
+        :param a_data: The audio encodings.
+        :param a_labels: The audio labels.
+        :param audio_label_offset: The difference between an audio label and its paired visual label.
+        :param balanced_labels: If True, labels are drawn uniformly and then an example of that label is drawn.
+                                Otherwise visual examples are drawn uniformly.
+        :param batch_size: The number of examples drawn at once.
+        :param prefetch: The maximum number of ready batches kept in the buffer.
+        :param seed: The random seed.
+        """
+        super(SampleStream, self).__init__(batch_size, prefetch, seed)
+        self.v_data = np.asarray(v_data)
+        self.v_labels = np.asarray(v_labels).ravel()
+        self.a_data = np.asarray(a_data)
+        self.audio_label_offset = audio_label_offset
+        self.balanced_labels = balanced_labels
+
+        self.v_index = _LabelIndex(self.v_labels)
+        self.a_index = _LabelIndex(a_labels)
+
+    def _draw_batch(self):
+        """
+        Draws one batch of paired examples.
+
+        :return: A tuple (visual, audio, labels) of arrays.
+        """
+        if self.balanced_labels:
+            v_positions = self.rng.integers(0, len(self.v_index.labels), self.batch_size)
+            v_idxs = self.v_index.draw(v_positions, self.rng)
+        else:
+            v_idxs = self.rng.integers(0, len(self.v_labels), self.batch_size)
+
+        labels = self.v_labels[v_idxs]
+        a_idxs = self.a_index.draw(self.a_index.label_positions(labels + self.audio_label_offset), self.rng)
+
+        # Fancy indexing copies the rows, so the training thread owns the batches it receives.
+        return self.v_data[v_idxs], self.a_data[a_idxs], labels.astype(np.float32)
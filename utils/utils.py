@@ -1,8 +1,10 @@
 from datetime import datetime
-from collections import defaultdict
 import math
 
+import numpy as np
+
 from cdzproject import db, config
+from cdzproject.evaluation import scoring
 
 counter = []
 
@@ -26,66 +28,55 @@ def name_generator(cortex, name=None):
         return str(name)
 
 
-def _get_score(encodings, labels, cortex):
+def _print_cortex_score(cortex_name, result):
     """
-    Calculates the score for the system by evaluating how well clusters are associated with labels.
+    Prints the score of a cortex.
 
-    :param encodings: The input data encodings.
-    :param labels: The corresponding labels for the encodings.
-    :param cortex: The cortex object to evaluate.
+    :param cortex_name: The name of the cortex.
+    :param result: The result of `evaluation.scoring.score`.
     """
-    labels_dict = defaultdict(list)
-    scores = []
-    strongest = []
-
-    def most_common(lst):
-        """Returns the most common value in a list."""
-        return max(set(lst), key=lst.count)
-
-    for idx, data in enumerate(encodings):
-        excited_cluster = cortex.receive_sensory_input(data, learn=False)
-
-        # Ignore new clusters as they are not fully trained.
-        if cortex.cdz.correlations.get(excited_cluster.name) and not excited_cluster.is_underutilized():
-            other_modality_cluster = cortex.cdz.correlations[excited_cluster.name].get_strongest_correlation()[0]
-            labels_dict[labels[idx]].append(other_modality_cluster.name)
-
     print('----------')
-    print("Cortex:", str(cortex.name))
+    print("Cortex:", str(cortex_name))
 
-    for label_name, array in labels_dict.items():  # Use .items() instead of .iteritems()
-        mst_common_cluster_name = most_common(array)
-        strongest.append(mst_common_cluster_name)
-        percent = array.count(mst_common_cluster_name) / len(array)
-        scores.append(percent)
+    for label_name, (percent, mst_common_cluster_name) in result['labels'].items():
         print('Label', label_name, ' -- ', percent, '--', mst_common_cluster_name)
 
-    print("Avg score:", sum(scores) / len(scores))
-    print("# Unique Top Cluster:", len(set(strongest)))
+    print("Avg score:", result['avg_score'])
+    print("# Unique Top Cluster:", result['unique_top_clusters'])
 
 
 def print_score(dataset, brain):
     """
     Calculates scores of the system. Calculates both training and test scores in both modalities.
 
+    The brain is frozen and scored in worker processes (see `evaluation.scoring`), it is not changed.
+
     WARNING: This function ignores new clusters as they may not be trained and should not count.
+
+    :return: A dictionary of (average score, number of unique top clusters) tuples keyed by set and cortex name.
     """
-    print("======= Training Score =======")
-    _get_score(dataset.v_train_data, dataset.v_train_labels, brain.get_cortex('visual'))
-    _get_score(dataset.a_train_data, dataset.a_train_labels, brain.get_cortex('audio'))
+    results = scoring.evaluate(brain.freeze(), dataset)
+    scores = {'train': {}, 'test': {}}
+
+    for set_name, title in (('train', "======= Training Score ======="), ('test', "======= Test Score ===========")):
+        print(title)
+        for cortex_name in ('visual', 'audio'):
+            result = results[set_name][cortex_name]
+            _print_cortex_score(cortex_name, result)
+            scores[set_name][cortex_name] = (result['avg_score'], result['unique_top_clusters'])
 
-    print("======= Test Score ===========")
-    _get_score(dataset.v_test_data, dataset.v_test_labels, brain.get_cortex('visual'))
-    _get_score(dataset.a_test_data, dataset.a_test_labels, brain.get_cortex('audio'))
+    return scores
 
 
-def print_info(dataset, brain, num_runs):
+def print_info(dataset, brain, num_runs, scheduler=None):
     """
     Prints information about the system, including cluster and node counts, and calculates scores.
 
     :param dataset: The dataset containing training and test data.
     :param brain: The brain object managing the system.
     :param num_runs: The total number of runs for progress tracking.
+    :param scheduler: An optional `evaluation.scheduler.EvaluationScheduler`. If given, the scores are calculated in
+                      the background and written to its metrics file instead of blocking training.
     """
     timestep = brain.timestep
 
@@ -93,18 +84,19 @@ def print_info(dataset, brain, num_runs):
         print(timestep, (str(int(timestep * 100 / num_runs))) + '%', "{0:.2f}".format(timestep / config.TRAINING_SET_SIZE))
 
     if timestep and timestep % config.TRAINING_SET_SIZE == 0:
-        strongest_audio_clusters = defaultdict(list)
-        strongest_visual_clusters = defaultdict(list)
-
-        # Get the strongest clusters
-        for node_name, data in db.nodes_to_clusters.data.items():  # Use .items() instead of .iteritems()
-            node = data['obj']
-            cluster = node.get_strongest_cluster()
-            if node.correlation_variance() <= 0.05 and not node.is_new():
-                if 'audio' in node.name:
-                    strongest_audio_clusters[cluster.name].append(node)
-                elif 'visual' in node.name:
-                    strongest_visual_clusters[cluster.name].append(node)
+        # The strongest clusters of the old nodes with a low correlation variance, per cortex
+        strongest_clusters = {}
+        for cortex_name, cortex in brain.cortices.items():
+            nodes = cortex.node_manager.nodes
+            store = cortex.node_manager.store
+            old_nodes = np.flatnonzero(~store.is_new(store.rows(nodes)))
+            strongest_clusters[cortex_name] = set()
+            for idx in old_nodes:
+                clusters, strengths = db.get_nodes_clusters(nodes[idx], include_strengths=True)
+                strength = max(strengths)
+                # `Node.correlation_variance` and `Node.get_strongest_cluster` from a single lookup
+                if 1 - strength <= 0.05:
+                    strongest_clusters[cortex_name].add(clusters[strengths.index(strength)].name)
 
         print('================ System Info =================')
         # for node_name, data in db.nodes_to_clusters.data.items():
@@ -121,16 +113,19 @@ def print_info(dataset, brain, num_runs):
         # print(strengths)
 
         print('')
-        print("Audio clusters:", len([key for key in db.clusters_to_nodes.data.keys() if 'audio' in key]))
-        print("Visual clusters:", len([key for key in db.clusters_to_nodes.data.keys() if 'visual' in key]))
+        for cortex_name, cortex in sorted(brain.cortices.items()):
+            print(cortex_name.capitalize() + " clusters:", len(cortex.cluster_store))
         print('')
-        print("Audio nodes:", len([key for key in db.nodes_to_clusters.data.keys() if 'audio' in key]))
-        print("Visual nodes:", len([key for key in db.nodes_to_clusters.data.keys() if 'visual' in key]))
+        for cortex_name, cortex in sorted(brain.cortices.items()):
+            print(cortex_name.capitalize() + " nodes:", len(cortex.node_manager.store))
         print('')
         print("=== # Old and low_variance clusters ===")
-        print(">> Audio clusters: ", len(strongest_audio_clusters))
-        print(">> Visual clusters: ", len(strongest_visual_clusters))
+        for cortex_name in sorted(strongest_clusters):
+            print(">> " + cortex_name.capitalize() + " clusters: ", len(strongest_clusters[cortex_name]))
         print('')
 
         print('================ End System Info ===============')
-        print_score(dataset, brain)
\ No newline at end of file
+        if scheduler:
+            scheduler.submit(brain)
+        else:
+            print_score(dataset, brain)
\ No newline at end of file